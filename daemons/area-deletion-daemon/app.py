@@ -7,4 +7,5 @@ from upload.common.upload_area import UploadArea
 def delete_upload_area(event, context):
     unwrapped_event = json.loads(event["Records"][0]["body"])
     area_uuid = unwrapped_event["area_uuid"]
-    UploadArea(area_uuid).delete()
+    UploadArea(area_uuid).delete(start_after=unwrapped_event.get("start_after"),
+                                 get_remaining_time_in_millis=context.get_remaining_time_in_millis)
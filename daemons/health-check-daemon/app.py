@@ -5,4 +5,7 @@ logger = get_logger(__name__)
 
 
 def health_check(event, context):
-    HealthCheck().run_upload_service_health_check()
+    checker = HealthCheck()
+    checker.run_upload_service_health_check()
+    checker.requeue_stale_notifications()
+    checker.reconcile_area_status_counts(get_remaining_time_in_millis=context.get_remaining_time_in_millis)
@@ -0,0 +1,8 @@
+from upload.lambdas.notification_daemon import NotificationDaemon
+
+
+# This lambda function is invoked by messages in the notification_queue (AWS SQS).
+# The queue and the lambda function are connected via aws_lambda_event_source_mapping.
+# Each message names a notification record awaiting delivery to Ingest.
+def deliver_notifications(event, context):
+    NotificationDaemon(context).consume_sqs_records(event["Records"])
@@ -1,12 +1,12 @@
-import json
 from upload.lambdas.checksum_daemon import ChecksumDaemon
 
 
 # This lambda function is invoked by messages in the the pre_checksum_upload_queue (AWS SQS).
-# The queue and the lambda function are connected via aws_lambda_event_source_mapping
+# The queue and the lambda function are connected via aws_lambda_event_source_mapping.
+# Each invocation may carry several messages, which are processed concurrently.
+# Only the messages listed in the returned batchItemFailures are returned to the queue.
 def call_checksum_daemon(event, context):
-    unwrapped_events = json.loads(event["Records"][0]["body"])
-    ChecksumDaemon(context).consume_events(unwrapped_events)
+    return ChecksumDaemon(context).consume_sqs_records(event["Records"])
 
 
 """
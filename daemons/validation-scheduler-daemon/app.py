@@ -20,10 +20,7 @@ def schedule_file_validation(event, context):
     env = unwrapped_event["environment"]
     orig_validation_id = unwrapped_event["orig_validation_id"]
     upload_area = UploadArea(upload_area_uuid)
-    files = []
-    for filename in filenames:
-        file = upload_area.uploaded_file(filename)
-        files.append(file)
+    files = upload_area.uploaded_files(filenames)
     validation_scheduler = ValidationScheduler(upload_area_uuid, files)
     validation_id = validation_scheduler.schedule_batch_validation(validation_id, image, env, orig_validation_id)
     logger.info(f"scheduled batch job with {event}")
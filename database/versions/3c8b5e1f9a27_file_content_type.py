@@ -0,0 +1,27 @@
+"""file_content_type
+
+Record each file's content type, which list_objects_v2 does not return, so that listing an upload area only
+needs to HEAD the objects that have no file record yet.
+
+Revision ID: 3c8b5e1f9a27
+Revises: 7d2f9a4c6e15
+Create Date: 2026-10-18 12:26:50.731904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c8b5e1f9a27'
+down_revision = '7d2f9a4c6e15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('file', sa.Column('content_type', sa.String, nullable=True))
+
+
+def downgrade():
+    op.drop_column('file', 'content_type')
@@ -0,0 +1,36 @@
+"""checksum_cache
+
+Cache the checksums of content we have checksummed, keyed by S3 ETag, size and multipart part size
+(0 for objects uploaded in one part), so the same content uploaded again need not be checksummed again.
+
+Revision ID: 4f0d8e6b2a91
+Revises: 6c9fcd3bd5a4
+Create Date: 2026-10-17 15:21:37.604812
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import JSONB
+
+
+# revision identifiers, used by Alembic.
+revision = '4f0d8e6b2a91'
+down_revision = '6c9fcd3bd5a4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'checksum_cache',
+        sa.Column('s3_etag', sa.String, primary_key=True),
+        sa.Column('size', sa.BigInteger, primary_key=True),
+        sa.Column('part_size', sa.BigInteger, primary_key=True),
+        sa.Column('checksums', JSONB, nullable=False),
+        sa.Column('created_at', sa.types.DateTime(timezone=True), nullable=False, server_default=text('now()'))
+    )
+
+
+def downgrade():
+    op.drop_table('checksum_cache')
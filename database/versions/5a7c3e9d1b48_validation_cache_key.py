@@ -0,0 +1,33 @@
+"""validation_cache_key
+
+Key validations by a hash of their image, environment and the s3_etags of their files in order, so that a
+validation's results are only re-used for one that would run the same validator on the same inputs.
+
+Revision ID: 5a7c3e9d1b48
+Revises: b8e21f4c7d36
+Create Date: 2026-10-18 09:12:41.508213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a7c3e9d1b48'
+down_revision = 'b8e21f4c7d36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('validation', sa.Column('cache_key', sa.String, nullable=True))
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction.
+    op.execute('COMMIT')
+    op.execute("CREATE INDEX CONCURRENTLY validation_cache_key_index "
+               "ON validation (cache_key) WHERE cache_key IS NOT NULL;")
+
+
+def downgrade():
+    op.execute('COMMIT')
+    op.execute("DROP INDEX CONCURRENTLY validation_cache_key_index;")
+    op.drop_column('validation', 'cache_key')
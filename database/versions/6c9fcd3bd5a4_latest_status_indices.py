@@ -0,0 +1,44 @@
+"""latest_status_indices
+
+Index checksum and validation_files by (file_id, created_at DESC), so that the latest checksum or validation of
+a file is a single index probe.  These replace the plain file_id indices, which they make redundant.
+
+validation_files rows created by 0e33836280f2 were all stamped with the time of that migration,
+so give every validation_files row the creation time of its validation, which is what it means to order by.
+
+Revision ID: 6c9fcd3bd5a4
+Revises: d71b1d26c164
+Create Date: 2026-10-17 11:38:05.917344
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '6c9fcd3bd5a4'
+down_revision = 'd71b1d26c164'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("UPDATE validation_files SET created_at = validation.created_at "
+               "FROM validation WHERE validation_files.validation_id = validation.id "
+               "AND validation_files.created_at <> validation.created_at;")
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction.
+    op.execute('COMMIT')
+    op.execute("CREATE INDEX CONCURRENTLY checksum_file_id_created_at_index "
+               "ON checksum (file_id, created_at DESC);")
+    op.execute("CREATE INDEX CONCURRENTLY validation_files_file_id_created_at_index "
+               "ON validation_files (file_id, created_at DESC);")
+    op.execute("DROP INDEX CONCURRENTLY checksum_file_id_index;")
+    op.execute("DROP INDEX CONCURRENTLY validation_files_file_id_index;")
+
+
+def downgrade():
+    op.execute('COMMIT')
+    op.execute("CREATE INDEX CONCURRENTLY checksum_file_id_index ON checksum (file_id);")
+    op.execute("CREATE INDEX CONCURRENTLY validation_files_file_id_index ON validation_files (file_id);")
+    op.execute("DROP INDEX CONCURRENTLY checksum_file_id_created_at_index;")
+    op.execute("DROP INDEX CONCURRENTLY validation_files_file_id_created_at_index;")
@@ -0,0 +1,34 @@
+"""notification_type
+
+Record the type of each notification, so that one left DELIVERING (because its queue message was never sent,
+or ended up in the dead-letter queue) can be queued for delivery again.  Partially index the DELIVERING ones
+by updated_at, to find those quickly.
+
+Revision ID: 7d2f9a4c6e15
+Revises: 5a7c3e9d1b48
+Create Date: 2026-10-18 11:03:27.164390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2f9a4c6e15'
+down_revision = '5a7c3e9d1b48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('notification', sa.Column('notification_type', sa.String, nullable=True))
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction.
+    op.execute('COMMIT')
+    op.execute("CREATE INDEX CONCURRENTLY notification_delivering_index "
+               "ON notification (updated_at) WHERE status = 'DELIVERING';")
+
+
+def downgrade():
+    op.execute('COMMIT')
+    op.execute("DROP INDEX CONCURRENTLY notification_delivering_index;")
+    op.drop_column('notification', 'notification_type')
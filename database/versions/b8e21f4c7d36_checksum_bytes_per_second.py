@@ -0,0 +1,33 @@
+"""checksum_bytes_per_second
+
+Record the throughput of checksums computed inline by the checksum daemon, so it can estimate how long a file
+would take to checksum inline from recent measurements.  They are looked up most recent first.
+
+Revision ID: b8e21f4c7d36
+Revises: 4f0d8e6b2a91
+Create Date: 2026-10-17 16:48:20.733159
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8e21f4c7d36'
+down_revision = '4f0d8e6b2a91'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('checksum', sa.Column('bytes_per_second', sa.Float, nullable=True))
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction.
+    op.execute('COMMIT')
+    op.execute("CREATE INDEX CONCURRENTLY checksum_bytes_per_second_created_at_index "
+               "ON checksum (created_at DESC) WHERE bytes_per_second IS NOT NULL;")
+
+
+def downgrade():
+    op.execute('COMMIT')
+    op.execute("DROP INDEX CONCURRENTLY checksum_bytes_per_second_created_at_index;")
+    op.drop_column('checksum', 'bytes_per_second')
@@ -0,0 +1,269 @@
+"""area_status_counts
+
+Keep per-area counts of files, checksum statuses and validation statuses up to date with triggers,
+so that the /checksums and /validations endpoints don't have to aggregate over the whole area.
+
+The counts have the same meaning as the queries they replace:
+- file_count is the number of distinct file names in the area
+- checksum_counts maps each checksum status to the number of distinct files with a checksum in that status
+- validation_counts maps each validation status to the number of (validation, file) pairs in that status
+
+Rows that cascade-delete with their parent are counted out by BEFORE DELETE triggers on the parent, as the
+children's own triggers can no longer see the parent.  Races between concurrent transactions touching the
+same file can still leave a count off, so reconcile_area_status_counts() recomputes an area's counts from
+scratch; it is run daily by the health check.
+
+Revision ID: d71b1d26c164
+Revises: 0e33836280f2
+Create Date: 2026-10-17 10:12:41.302611
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import JSONB
+
+
+# revision identifiers, used by Alembic.
+revision = 'd71b1d26c164'
+down_revision = '0e33836280f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'area_status_counts',
+        sa.Column('upload_area_id', sa.Integer, primary_key=True),
+        sa.Column('file_count', sa.Integer, nullable=False, server_default=text('0')),
+        sa.Column('checksum_counts', JSONB, nullable=False, server_default=text("'{}'::jsonb")),
+        sa.Column('validation_counts', JSONB, nullable=False, server_default=text("'{}'::jsonb")),
+        sa.Column('updated_at', sa.types.DateTime(timezone=True), nullable=False, server_default=text('now()'))
+    )
+    op.execute("ALTER TABLE area_status_counts "
+               "ADD CONSTRAINT area_status_counts_upload_area_id FOREIGN KEY (upload_area_id) "
+               "REFERENCES upload_area (id) ON DELETE CASCADE;")
+
+    op.execute("""
+        CREATE FUNCTION jsonb_add_to_count(counts jsonb, key text, delta integer) RETURNS jsonb AS $$
+            SELECT CASE WHEN COALESCE((counts->>key)::integer, 0) + delta = 0 THEN counts - key
+                        ELSE jsonb_set(counts, ARRAY[key], to_jsonb(COALESCE((counts->>key)::integer, 0) + delta))
+                   END;
+        $$ LANGUAGE sql IMMUTABLE;
+    """)
+
+    op.execute("""
+        CREATE FUNCTION add_to_area_status_count(p_area_id integer, p_kind text, p_status text, p_delta integer)
+        RETURNS void AS $$
+        BEGIN
+            IF p_area_id IS NULL OR p_delta = 0 OR (p_kind <> 'file' AND p_status IS NULL) THEN
+                RETURN;
+            END IF;
+            -- The area may be going away in this same statement, e.g. when its deletion cascades to its files.
+            INSERT INTO area_status_counts (upload_area_id)
+                SELECT p_area_id WHERE EXISTS (SELECT 1 FROM upload_area WHERE id = p_area_id)
+                ON CONFLICT (upload_area_id) DO NOTHING;
+            IF p_kind = 'file' THEN
+                UPDATE area_status_counts SET file_count = file_count + p_delta, updated_at = now()
+                    WHERE upload_area_id = p_area_id;
+            ELSIF p_kind = 'checksum' THEN
+                UPDATE area_status_counts
+                    SET checksum_counts = jsonb_add_to_count(checksum_counts, p_status, p_delta), updated_at = now()
+                    WHERE upload_area_id = p_area_id;
+            ELSE
+                UPDATE area_status_counts
+                    SET validation_counts = jsonb_add_to_count(validation_counts, p_status, p_delta), updated_at = now()
+                    WHERE upload_area_id = p_area_id;
+            END IF;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    # file: a name counts once however many versions (s3_etags) of it there are.
+    # s3_key is <area uuid>/<name>, so we can use the file_s3_key_s3_etag index to look for other versions.
+    op.execute("""
+        CREATE FUNCTION file_area_status_counts() RETURNS trigger AS $$
+        DECLARE
+            counts record;
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                IF NOT EXISTS (SELECT 1 FROM file WHERE s3_key = NEW.s3_key AND id <> NEW.id) THEN
+                    PERFORM add_to_area_status_count(NEW.upload_area_id, 'file', NULL, 1);
+                END IF;
+                RETURN NULL;
+            END IF;
+
+            IF NOT EXISTS (SELECT 1 FROM file WHERE s3_key = OLD.s3_key AND id <> OLD.id) THEN
+                PERFORM add_to_area_status_count(OLD.upload_area_id, 'file', NULL, -1);
+            END IF;
+            FOR counts IN SELECT DISTINCT status::text AS status FROM checksum WHERE file_id = OLD.id LOOP
+                PERFORM add_to_area_status_count(OLD.upload_area_id, 'checksum', counts.status, -1);
+            END LOOP;
+            FOR counts IN SELECT validation.status::text AS status, COUNT(*) AS n
+                          FROM validation_files
+                          INNER JOIN validation ON validation_files.validation_id = validation.id
+                          WHERE validation_files.file_id = OLD.id GROUP BY validation.status LOOP
+                PERFORM add_to_area_status_count(OLD.upload_area_id, 'validation', counts.status, -counts.n::integer);
+            END LOOP;
+            RETURN OLD;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER file_area_status_counts_insert AFTER INSERT ON file
+            FOR EACH ROW EXECUTE PROCEDURE file_area_status_counts();
+        CREATE TRIGGER file_area_status_counts_delete BEFORE DELETE ON file
+            FOR EACH ROW EXECUTE PROCEDURE file_area_status_counts();
+    """)
+
+    # checksum: a file counts once per status however many checksum records it has in that status.
+    op.execute("""
+        CREATE FUNCTION checksum_area_status_counts() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'UPDATE' THEN
+                IF OLD.status = NEW.status AND OLD.file_id = NEW.file_id THEN
+                    RETURN NULL;
+                END IF;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                IF NOT EXISTS (SELECT 1 FROM checksum
+                               WHERE file_id = OLD.file_id AND status = OLD.status AND id <> OLD.id) THEN
+                    PERFORM add_to_area_status_count((SELECT upload_area_id FROM file WHERE id = OLD.file_id),
+                                                     'checksum', OLD.status::text, -1);
+                END IF;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                IF NOT EXISTS (SELECT 1 FROM checksum
+                               WHERE file_id = NEW.file_id AND status = NEW.status AND id <> NEW.id) THEN
+                    PERFORM add_to_area_status_count((SELECT upload_area_id FROM file WHERE id = NEW.file_id),
+                                                     'checksum', NEW.status::text, 1);
+                END IF;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER checksum_area_status_counts AFTER INSERT OR DELETE OR UPDATE OF status, file_id ON checksum
+            FOR EACH ROW EXECUTE PROCEDURE checksum_area_status_counts();
+    """)
+
+    # validation: a validation counts once for each of its files.
+    op.execute("""
+        CREATE FUNCTION validation_area_status_counts() RETURNS trigger AS $$
+        DECLARE
+            counts record;
+        BEGIN
+            IF TG_OP = 'UPDATE' THEN
+                IF OLD.status = NEW.status THEN
+                    RETURN NULL;
+                END IF;
+            END IF;
+            FOR counts IN SELECT file.upload_area_id AS area_id, COUNT(*) AS n
+                          FROM validation_files
+                          INNER JOIN file ON validation_files.file_id = file.id
+                          WHERE validation_files.validation_id = OLD.id GROUP BY file.upload_area_id LOOP
+                PERFORM add_to_area_status_count(counts.area_id, 'validation', OLD.status::text, -counts.n::integer);
+                IF TG_OP = 'UPDATE' THEN
+                    PERFORM add_to_area_status_count(counts.area_id, 'validation', NEW.status::text, counts.n::integer);
+                END IF;
+            END LOOP;
+            IF TG_OP = 'DELETE' THEN
+                RETURN OLD;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER validation_area_status_counts_update AFTER UPDATE OF status ON validation
+            FOR EACH ROW EXECUTE PROCEDURE validation_area_status_counts();
+        CREATE TRIGGER validation_area_status_counts_delete BEFORE DELETE ON validation
+            FOR EACH ROW EXECUTE PROCEDURE validation_area_status_counts();
+    """)
+
+    op.execute("""
+        CREATE FUNCTION validation_files_area_status_counts() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM add_to_area_status_count((SELECT upload_area_id FROM file WHERE id = NEW.file_id),
+                                                 'validation',
+                                                 (SELECT status::text FROM validation WHERE id = NEW.validation_id),
+                                                 1);
+            ELSE
+                PERFORM add_to_area_status_count((SELECT upload_area_id FROM file WHERE id = OLD.file_id),
+                                                 'validation',
+                                                 (SELECT status::text FROM validation WHERE id = OLD.validation_id),
+                                                 -1);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER validation_files_area_status_counts AFTER INSERT OR DELETE ON validation_files
+            FOR EACH ROW EXECUTE PROCEDURE validation_files_area_status_counts();
+    """)
+
+    # Recompute an area's counts with the original aggregate queries.  Returns true if they had drifted.
+    op.execute("""
+        CREATE FUNCTION reconcile_area_status_counts(p_area_id integer) RETURNS boolean AS $$
+        DECLARE
+            existing area_status_counts%ROWTYPE;
+            actual_file_count integer;
+            actual_checksum_counts jsonb;
+            actual_validation_counts jsonb;
+        BEGIN
+            -- Hold off trigger updates for this area while we count.
+            SELECT * INTO existing FROM area_status_counts WHERE upload_area_id = p_area_id FOR UPDATE;
+
+            SELECT COUNT(DISTINCT name) INTO actual_file_count FROM file WHERE upload_area_id = p_area_id;
+            SELECT COALESCE(jsonb_object_agg(status, n), '{}'::jsonb) INTO actual_checksum_counts
+                FROM (SELECT checksum.status::text AS status, COUNT(DISTINCT checksum.file_id) AS n
+                      FROM checksum
+                      INNER JOIN file ON checksum.file_id = file.id
+                      WHERE file.upload_area_id = p_area_id GROUP BY checksum.status) AS checksum_counts;
+            SELECT COALESCE(jsonb_object_agg(status, n), '{}'::jsonb) INTO actual_validation_counts
+                FROM (SELECT validation.status::text AS status, COUNT(validation.id) AS n
+                      FROM validation
+                      INNER JOIN validation_files ON validation.id = validation_files.validation_id
+                      INNER JOIN file ON validation_files.file_id = file.id
+                      WHERE file.upload_area_id = p_area_id GROUP BY validation.status) AS validation_counts;
+
+            IF existing.upload_area_id IS NOT NULL
+                    AND existing.file_count = actual_file_count
+                    AND existing.checksum_counts = actual_checksum_counts
+                    AND existing.validation_counts = actual_validation_counts THEN
+                RETURN false;
+            END IF;
+            IF existing.upload_area_id IS NULL AND actual_file_count = 0
+                    AND actual_checksum_counts = '{}'::jsonb AND actual_validation_counts = '{}'::jsonb THEN
+                RETURN false;
+            END IF;
+
+            INSERT INTO area_status_counts (upload_area_id, file_count, checksum_counts, validation_counts)
+                VALUES (p_area_id, actual_file_count, actual_checksum_counts, actual_validation_counts)
+                ON CONFLICT (upload_area_id) DO UPDATE
+                SET file_count = EXCLUDED.file_count,
+                    checksum_counts = EXCLUDED.checksum_counts,
+                    validation_counts = EXCLUDED.validation_counts,
+                    updated_at = now();
+            RETURN true;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    op.execute("SELECT reconcile_area_status_counts(id) FROM upload_area;")
+
+
+def downgrade():
+    op.execute("DROP TRIGGER validation_files_area_status_counts ON validation_files;")
+    op.execute("DROP TRIGGER validation_area_status_counts_delete ON validation;")
+    op.execute("DROP TRIGGER validation_area_status_counts_update ON validation;")
+    op.execute("DROP TRIGGER checksum_area_status_counts ON checksum;")
+    op.execute("DROP TRIGGER file_area_status_counts_delete ON file;")
+    op.execute("DROP TRIGGER file_area_status_counts_insert ON file;")
+    op.execute("DROP FUNCTION reconcile_area_status_counts(integer);")
+    op.execute("DROP FUNCTION validation_files_area_status_counts();")
+    op.execute("DROP FUNCTION validation_area_status_counts();")
+    op.execute("DROP FUNCTION checksum_area_status_counts();")
+    op.execute("DROP FUNCTION file_area_status_counts();")
+    op.execute("DROP FUNCTION add_to_area_status_count(integer, text, text, integer);")
+    op.execute("DROP FUNCTION jsonb_add_to_count(jsonb, text, integer);")
+    op.drop_table('area_status_counts')
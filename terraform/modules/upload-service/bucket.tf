@@ -3,6 +3,16 @@ resource "aws_s3_bucket" "upload_areas_bucket" {
   acl = "private"
   force_destroy = "false"
   acceleration_status = "Enabled"
+
+  // Checkpoints of checksummers that never finished
+  lifecycle_rule {
+    id = "expire-checksum-checkpoints"
+    prefix = "_checksum_checkpoints/"
+    enabled = true
+    expiration {
+      days = 14
+    }
+  }
 }
 
 resource "aws_iam_policy" "upload_areas_submitter_access" {
@@ -66,6 +66,16 @@ resource "aws_iam_policy" "csum_job_policy" {
                 "arn:aws:s3:::${aws_s3_bucket.upload_areas_bucket.bucket}/*"
             ]
         },
+        {
+            "Effect": "Allow",
+            "Action": [
+                "s3:PutObject",
+                "s3:DeleteObject"
+            ],
+            "Resource": [
+                "arn:aws:s3:::${aws_s3_bucket.upload_areas_bucket.bucket}/_checksum_checkpoints/*"
+            ]
+        },
         {
             "Effect": "Allow",
             "Action": [
@@ -93,6 +93,16 @@ resource "aws_iam_role_policy" "upload_csum_lambda" {
       "Resource": [
         "arn:aws:sqs:*:*:${aws_sqs_queue.upload_queue.name}"
       ]
+    },
+    {
+      "Effect": "Allow",
+      "Action": [
+        "sqs:SendMessage"
+      ],
+      "Resource": [
+        "arn:aws:sqs:*:*:${aws_sqs_queue.upload_queue.name}",
+        "arn:aws:sqs:*:*:${aws_sqs_queue.notification_queue.name}"
+      ]
     }
   ]
 }
@@ -59,6 +59,15 @@ resource "aws_iam_role_policy" "upload_health_check_lambda" {
         "*"
       ]
     },
+    {
+      "Effect": "Allow",
+      "Action": [
+        "sqs:SendMessage"
+      ],
+      "Resource": [
+        "arn:aws:sqs:*:*:${aws_sqs_queue.notification_queue.name}"
+      ]
+    },
     {
       "Effect": "Allow",
       "Action": [
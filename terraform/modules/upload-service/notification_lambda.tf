@@ -0,0 +1,96 @@
+resource "aws_iam_role" "notification_lambda" {
+  name = "notification-daemon-${var.deployment_stage}"
+  assume_role_policy = <<POLICY
+{
+  "Version": "2012-10-17",
+  "Statement": [
+    {
+      "Sid": "",
+      "Effect": "Allow",
+      "Principal": {
+        "Service": "lambda.amazonaws.com"
+      },
+      "Action": "sts:AssumeRole"
+    }
+  ]
+}
+POLICY
+}
+
+resource "aws_iam_role_policy" "notification_lambda" {
+  name = "notification-daemon-${var.deployment_stage}"
+  role = "${aws_iam_role.notification_lambda.name}"
+  policy = <<EOF
+{
+  "Version": "2012-10-17",
+  "Statement": [
+    {
+      "Sid": "LambdaLogging",
+      "Action": [
+        "logs:CreateLogGroup",
+        "logs:CreateLogStream",
+        "logs:DescribeLogStreams"
+      ],
+      "Resource": [
+        "arn:aws:logs:*:*:*"
+      ],
+      "Effect": "Allow"
+    },
+    {
+      "Sid": "LambdaObjectLogging",
+      "Action": [
+        "logs:PutLogEvents"
+      ],
+      "Resource": [
+        "arn:aws:logs:*:*:/aws/lambda/${aws_lambda_function.notification_lambda.function_name}:*"
+      ],
+      "Effect": "Allow"
+    },
+    {
+      "Effect": "Allow",
+      "Action": [
+        "secretsmanager:DescribeSecret",
+        "secretsmanager:GetSecretValue"
+      ],
+      "Resource": [
+        "arn:aws:secretsmanager:${local.aws_region}:${local.account_id}:secret:dcp/upload/${var.deployment_stage}/*"
+      ]
+    },
+    {
+      "Effect": "Allow",
+      "Action": [
+        "sqs:ChangeMessageVisibility",
+        "sqs:DeleteMessage",
+        "sqs:GetQueueAttributes",
+        "sqs:ReceiveMessage"
+      ],
+      "Resource": [
+        "arn:aws:sqs:*:*:${aws_sqs_queue.notification_queue.name}"
+      ]
+    }
+  ]
+}
+EOF
+}
+
+output "notification_lambda_role_arn" {
+  value = "${aws_iam_role.notification_lambda.arn}"
+}
+
+
+resource "aws_lambda_function" "notification_lambda" {
+  function_name    = "dcp-upload-notification-${var.deployment_stage}"
+  s3_bucket        = "${aws_s3_bucket.lambda_deployments.id}"
+  s3_key           = "notification_daemon.zip"
+  role             = "arn:aws:iam::${local.account_id}:role/notification-daemon-${var.deployment_stage}"
+  handler          = "app.deliver_notifications"
+  runtime          = "python3.6"
+  memory_size      = 256
+  timeout          = 300
+
+  environment {
+    variables = {
+      DEPLOYMENT_STAGE = "${var.deployment_stage}"
+    }
+  }
+}
@@ -19,6 +19,7 @@ resource "aws_secretsmanager_secret_version" "secrets" {
   "csum_job_role_arn": "${aws_iam_role.csum_job_role.arn}",
   "csum_upload_q_url": "${aws_sqs_queue.upload_queue.id}",
   "ingest_api_host": "${var.ingest_api_host}",
+  "notification_q_url": "${aws_sqs_queue.notification_queue.id}",
   "slack_webhook": "${var.slack_webhook}",
   "staging_bucket_arn": "${var.staging_bucket_arn}",
   "upload_submitter_role_arn": "${aws_iam_role.upload_submitter.arn}",
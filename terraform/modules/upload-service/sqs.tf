@@ -49,10 +49,11 @@ POLICY
 }
 
 resource "aws_lambda_event_source_mapping" "event_source_mapping" {
-  batch_size = 1
+  batch_size = 10
   event_source_arn  = "${aws_sqs_queue.upload_queue.arn}"
   enabled           = true
   function_name     = "${aws_lambda_function.upload_checksum_lambda.arn}"
+  function_response_types = ["ReportBatchItemFailures"]
 }
 
 
@@ -97,3 +98,24 @@ resource "aws_lambda_event_source_mapping" "validation_event_source_mapping" {
   enabled           = true
   function_name     = "${aws_lambda_function.validation_scheduler_lambda.arn}"
 }
+
+resource "aws_sqs_queue" "notification_queue" {
+  name                      = "dcp-upload-notification-queue-${var.deployment_stage}"
+//  Queue visibility timeout must be larger than (triggered lambda) function timeout
+  visibility_timeout_seconds = 360
+  message_retention_seconds = 86400
+  redrive_policy            = "{\"deadLetterTargetArn\":\"${aws_sqs_queue.notification_deadletter_queue.arn}\",\"maxReceiveCount\":4}"
+
+}
+
+resource "aws_sqs_queue" "notification_deadletter_queue" {
+  name                      = "dcp-upload-notification-deadletter-queue-${var.deployment_stage}"
+  message_retention_seconds = 1209600
+}
+
+resource "aws_lambda_event_source_mapping" "notification_event_source_mapping" {
+  batch_size = 10
+  event_source_arn  = "${aws_sqs_queue.notification_queue.arn}"
+  enabled           = true
+  function_name     = "${aws_lambda_function.notification_lambda.arn}"
+}
@@ -9,6 +9,7 @@ import boto3
 from moto import mock_iam, mock_s3, mock_sts, mock_sqs
 
 from upload.common.database_orm import DBSessionMaker, DbUploadArea
+from upload.common.upload_area import area_record_cache
 from upload.common.upload_config import UploadConfig, UploadDbConfig, UploadVersion, UploadOutgoingIngestAuthConfig
 
 os.environ['LOG_LEVEL'] = 'CRITICAL'
@@ -86,6 +87,7 @@ class UploadTestCase(unittest.TestCase):
         'csum_job_role_arn': 'bogo_role_arn',
         'csum_upload_q_url': 'csum_sqs_url',
         'ingest_api_host': 'test_ingest_api_host',
+        'notification_q_url': 'test_notification_q_url',
         'slack_webhook': 'bogo_slack_url',
         'staging_bucket_arn': 'staging_bucket_arn',
         'upload_submitter_role_arn': 'bogo_submitter_role_arn',
@@ -130,6 +132,9 @@ class UploadTestCase(unittest.TestCase):
         self.upload_version = UploadVersion()
         self.upload_version.set({"upload_service_version": "0"})
 
+        # Don't let upload area records cached by one test leak into the next
+        area_record_cache.clear()
+
     def tearDown(self):
         self.common_environmentor.exit()
 
@@ -186,6 +191,7 @@ class UploadTestCaseUsingMockAWS(UploadTestCase):
         self.sqs.create_queue(QueueName=f"csum_sqs_url")
         self.sqs.create_queue(QueueName=f"delete_sqs_url")
         self.sqs.create_queue(QueueName=f"test_validation_q_url")
+        self.sqs.create_queue(QueueName="test_notification_q_url")
 
     def tearDown(self):
         super().tearDown()
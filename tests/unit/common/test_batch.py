@@ -0,0 +1,59 @@
+import unittest
+from unittest.mock import patch
+
+from botocore.exceptions import ClientError
+
+from upload.common.batch import JobDefinition
+
+
+@patch('upload.common.batch.batch')
+class TestJobDefinition(unittest.TestCase):
+
+    def setUp(self):
+        JobDefinition._arn_cache.clear()
+
+    def _job_definitions(self, arn):
+        return {'jobDefinitions': [{'jobDefinitionArn': arn}]}
+
+    def test_find_or_create__only_describes_job_definitions_once(self, mock_batch):
+        mock_batch.describe_job_definitions.return_value = self._job_definitions('arn:jobdef:1')
+
+        JobDefinition(docker_image='image', deployment='test').find_or_create('role')
+        job_defn = JobDefinition(docker_image='image', deployment='test').find_or_create('role')
+
+        self.assertEqual('arn:jobdef:1', job_defn.arn)
+        self.assertEqual(1, mock_batch.describe_job_definitions.call_count)
+
+    def test_find_or_create__caches_each_image_separately(self, mock_batch):
+        mock_batch.describe_job_definitions.return_value = self._job_definitions('arn:jobdef:1')
+
+        JobDefinition(docker_image='image1', deployment='test').find_or_create('role')
+        JobDefinition(docker_image='image2', deployment='test').find_or_create('role')
+
+        self.assertEqual(2, mock_batch.describe_job_definitions.call_count)
+
+    def test_submit_job__when_job_definition_is_unknown__looks_it_up_again_and_resubmits(self, mock_batch):
+        mock_batch.describe_job_definitions.side_effect = [self._job_definitions('arn:jobdef:1'),
+                                                           self._job_definitions('arn:jobdef:2')]
+        unknown_job_definition = ClientError({'Error': {'Code': 'ClientException',
+                                                        'Message': 'Job definition arn:jobdef:1 does not exist'}},
+                                             'SubmitJob')
+        mock_batch.submit_job.side_effect = [unknown_job_definition, {'jobId': 'job-id'}]
+        job_defn = JobDefinition(docker_image='image', deployment='test').find_or_create('role')
+
+        job = job_defn.submit_job('role', jobName='job', jobQueue='queue')
+
+        self.assertEqual('job-id', job['jobId'])
+        mock_batch.submit_job.assert_called_with(jobDefinition='arn:jobdef:2', jobName='job', jobQueue='queue')
+        self.assertEqual('arn:jobdef:2', JobDefinition._arn_cache[job_defn.name])
+
+    def test_submit_job__reraises_other_errors(self, mock_batch):
+        mock_batch.describe_job_definitions.return_value = self._job_definitions('arn:jobdef:1')
+        mock_batch.submit_job.side_effect = ClientError({'Error': {'Code': 'ClientException',
+                                                                   'Message': 'Queue does not exist'}}, 'SubmitJob')
+        job_defn = JobDefinition(docker_image='image', deployment='test').find_or_create('role')
+
+        with self.assertRaises(ClientError):
+            job_defn.submit_job('role', jobName='job', jobQueue='queue')
+
+        self.assertEqual(1, mock_batch.describe_job_definitions.call_count)
@@ -0,0 +1,36 @@
+import uuid
+
+from upload.common.checksum_cache import ChecksumCache
+from upload.common.upload_area import UploadArea
+from upload.common.uploaded_file import UploadedFile
+from .. import UploadTestCaseUsingMockAWS
+
+
+class TestChecksumCache(UploadTestCaseUsingMockAWS):
+
+    def setUp(self):
+        super().setUp()
+        self.upload_area = UploadArea(str(uuid.uuid4()))
+        self.upload_area.update_or_create()
+
+    def _uploaded_file(self, name, contents):
+        s3obj = self.upload_bucket.Object(f"{self.upload_area.uuid}/{name}")
+        s3obj.put(Body=contents, ContentType="application/json; dcp-type=data")
+        return UploadedFile(self.upload_area, s3object=s3obj)
+
+    def test_store__then_lookup_of_file_with_same_content__returns_checksums(self):
+        contents = f"cache me {uuid.uuid4()}"
+        original = self._uploaded_file('original', contents)
+        checksums = {'sha1': '2', 'sha256': '3', 'crc32c': '4', 's3_etag': original.s3_etag}
+
+        ChecksumCache.store(original, checksums)
+
+        self.assertEqual(checksums, ChecksumCache.lookup(self._uploaded_file('copy', contents)))
+        self.assertIsNone(ChecksumCache.lookup(self._uploaded_file('other', f"other {uuid.uuid4()}")))
+
+    def test_store__when_checksums_s3_etag_is_not_the_objects__does_not_cache_them(self):
+        uploaded_file = self._uploaded_file('file', f"don't cache me {uuid.uuid4()}")
+
+        ChecksumCache.store(uploaded_file, {'sha1': '2', 'sha256': '3', 'crc32c': '4', 's3_etag': '1'})
+
+        self.assertIsNone(ChecksumCache.lookup(uploaded_file))
@@ -0,0 +1,37 @@
+import uuid
+
+from upload.common.checksum_checkpoint import ChecksumCheckpoint
+from .. import UploadTestCaseUsingMockAWS
+
+
+class TestChecksumCheckpoint(UploadTestCaseUsingMockAWS):
+
+    def setUp(self):
+        super().setUp()
+        self.s3obj = self.upload_bucket.Object(f"{uuid.uuid4()}/foo")
+        self.s3obj.put(Body="exquisite corpse")
+        self.part_checksums = [{'crc32c': 1234, 'md5': b"0123456789abcdef"}]
+        self.hashers = ChecksumCheckpoint.new_hashers()
+        for hasher in self.hashers.values():
+            hasher.update(b"exquisite")
+
+    def test_save__then_load__returns_part_checksums_and_hashers(self):
+        ChecksumCheckpoint(self.s3obj).save(9, self.part_checksums, self.hashers)
+
+        part_checksums, hashers = ChecksumCheckpoint(self.s3obj).load(9)
+
+        self.assertEqual(self.part_checksums, part_checksums)
+        self.assertEqual({name: hasher.hexdigest() for name, hasher in self.hashers.items()},
+                         {name: hasher.hexdigest() for name, hasher in hashers.items()})
+
+    def test_load__without_a_checkpoint__returns_none(self):
+        self.assertIsNone(ChecksumCheckpoint(self.s3obj).load(9))
+
+    def test_load__of_a_checkpoint_of_other_contents_or_part_size__returns_none(self):
+        ChecksumCheckpoint(self.s3obj).save(9, self.part_checksums, self.hashers)
+
+        self.assertIsNone(ChecksumCheckpoint(self.s3obj).load(10))
+
+        self.s3obj.put(Body="something else")
+        self.s3obj.reload()
+        self.assertIsNone(ChecksumCheckpoint(self.s3obj).load(9))
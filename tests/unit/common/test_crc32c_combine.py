@@ -0,0 +1,32 @@
+import os
+import unittest
+import zlib
+
+from dcplib.checksumming_io import ChecksummingSink
+
+from upload.common.crc32c_combine import crc32c_combine
+
+
+class TestCrc32cCombine(unittest.TestCase):
+
+    def _crc32c(self, data):
+        with ChecksummingSink(len(data) + 1, hash_functions=('crc32c',)) as sink:
+            sink.write(data)
+            return int(sink.get_checksums()['crc32c'], 16)
+
+    def test_combining_crc32cs_of_two_blocks__equals_crc32c_of_concatenated_blocks(self):
+        self.assertEqual(0xfe9ada52, crc32c_combine(self._crc32c(b"exquisite"), self._crc32c(b" corpse"), 7))
+
+    def test_with_empty_second_block__returns_first_crc(self):
+        self.assertEqual(0x1234, crc32c_combine(0x1234, 0, 0))
+
+    def test_with_zlib_polynomial__matches_zlib_crc32(self):
+        block1, block2 = os.urandom(1000), os.urandom(4097)
+
+        combined = crc32c_combine(zlib.crc32(block1), zlib.crc32(block2), len(block2), polynomial=0xEDB88320)
+
+        self.assertEqual(zlib.crc32(block1 + block2), combined)
+
+
+if __name__ == '__main__':
+    unittest.main()
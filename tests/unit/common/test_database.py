@@ -1,8 +1,10 @@
 import uuid
+from unittest.mock import patch
 
 from .. import UploadTestCaseUsingMockAWS
 
 from upload.common.database import UploadDB
+from upload.common.exceptions import UploadException
 from upload.common.upload_area import UploadArea
 
 
@@ -48,3 +50,61 @@ class TestDatabase(UploadTestCaseUsingMockAWS):
         self.assertEqual(results[0]["uuid"], self.area_uuid)
         self.assertEqual(results[0]["bucket_name"], self.upload_config.bucket_name)
         self.assertEqual(results[0]["status"], "UNLOCKED")
+
+    def test_create_pg_records__creates_records_in_several_tables(self):
+        area_uuids = [str(uuid.uuid4()), str(uuid.uuid4())]
+        self.db.create_pg_records([
+            ("upload_area", [{"uuid": area_uuid, "status": "UNLOCKED", "bucket_name": self.upload_config.bucket_name}
+                             for area_uuid in area_uuids])
+        ])
+
+        for area_uuid in area_uuids:
+            self.assertEqual("UNLOCKED", self.db.get_pg_record("upload_area", area_uuid, column='uuid')["status"])
+
+    def test_create_pg_records__when_one_record_fails__creates_none_of_them(self):
+        new_area_uuid = str(uuid.uuid4())
+
+        with self.assertRaises(UploadException):
+            self.db.create_pg_records([
+                ("upload_area", [{"uuid": new_area_uuid, "status": "UNLOCKED", "bucket_name": "bucket"}]),
+                ("upload_area", [{"uuid": self.area_uuid, "status": "UNLOCKED", "bucket_name": "bucket"}])
+            ])
+
+        self.assertIsNone(self.db.get_pg_record("upload_area", new_area_uuid, column='uuid'))
+
+    def test_update_pg_records(self):
+        other_area_uuid = str(uuid.uuid4())
+        self.db.create_pg_record("upload_area", {
+            "uuid": other_area_uuid,
+            "status": "UNLOCKED",
+            "bucket_name": self.upload_config.bucket_name
+        })
+
+        self.db.update_pg_records("upload_area", [
+            {"uuid": self.area_uuid, "status": "LOCKED"},
+            {"uuid": other_area_uuid, "status": "DELETED"}
+        ], column='uuid')
+
+        self.assertEqual("LOCKED", self.db.get_pg_record("upload_area", self.area_uuid, column='uuid')["status"])
+        self.assertEqual("DELETED", self.db.get_pg_record("upload_area", other_area_uuid, column='uuid')["status"])
+
+    def test_pool_stats__counts_checkouts(self):
+        checkouts_before = self.db.pool_stats()['checkouts']
+
+        self.db.run_query("SELECT 1;").fetchall()
+
+        stats = self.db.pool_stats()
+        self.assertEqual(checkouts_before + 1, stats['checkouts'])
+        self.assertEqual(0, stats['checked_out'])
+        self.assertGreaterEqual(stats['max_wait_seconds'], 0)
+
+    def test_create_pg_record__of_a_duplicate__does_not_dispose_of_the_pool(self):
+        with patch.object(self.db.engine, 'dispose') as mock_dispose:
+            with self.assertRaises(UploadException):
+                self.db.create_pg_record("upload_area", {
+                    "uuid": self.area_uuid,
+                    "status": "UNLOCKED",
+                    "bucket_name": self.upload_config.bucket_name
+                })
+
+        mock_dispose.assert_not_called()
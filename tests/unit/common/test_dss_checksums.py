@@ -1,9 +1,13 @@
+import hashlib
+import time
 import uuid
+from unittest.mock import patch
 
 import boto3
 
+from upload.common.checksum_checkpoint import ChecksumCheckpoint
 from upload.common.dss_checksums import DssChecksums, __name__ as logger_name
-from upload.common.exceptions import UploadException
+from upload.common.exceptions import UploadException, ChecksumDeadlineExceeded
 from upload.common.logging import get_logger
 from upload.common.upload_area import UploadArea
 from .. import UploadTestCaseUsingMockAWS
@@ -101,6 +105,84 @@ class TestDssChecksums(UploadTestCaseUsingMockAWS):
 
         self.assertEqual(DssChecksums(s3_object=_s3obj).compute(), _test_file.checksums)
 
+    @patch('upload.common.dss_checksums.get_s3_multipart_chunk_size')
+    def test__compute_checksums__for_a_multipart_object__combines_part_checksums(self, mock_chunk_size):
+        mock_chunk_size.return_value = 5
+        _test_file = FixtureFile.factory("foo")
+        _contents = _test_file.contents.encode('utf8')
+        _part_digests = b"".join(hashlib.md5(_contents[i:i + 5]).digest() for i in range(0, len(_contents), 5))
+
+        _s3obj = self.mock_upload_file_to_s3(self.upload_area_id, _test_file.name, contents=_test_file.contents)
+
+        self.assertEqual({
+            'sha1': _test_file.checksums['sha1'],
+            'sha256': _test_file.checksums['sha256'],
+            'crc32c': _test_file.checksums['crc32c'],
+            's3_etag': f"{hashlib.md5(_part_digests).hexdigest()}-4"
+        }, DssChecksums(s3_object=_s3obj).compute())
+
+    @patch.object(DssChecksums.ChecksumComputer, 'CHECKPOINT_INTERVAL', -1)
+    @patch('upload.common.dss_checksums.get_s3_multipart_chunk_size')
+    def test__compute_checksums__with_a_checkpoint__resumes_after_the_last_part_checkpointed(self, mock_chunk_size):
+        mock_chunk_size.return_value = 5
+        _test_file = FixtureFile.factory("foo")
+        _s3obj = self.mock_upload_file_to_s3(self.upload_area_id, _test_file.name, contents=_test_file.contents)
+        _checksum_part = DssChecksums.ChecksumComputer._checksum_part
+
+        def fail_at_third_part(computer, start, end, part_size, part_queue, aborted):
+            if start == 10:
+                error = UploadException(status=500, title="Failed to download part", detail="")
+                part_queue.put(error)
+                raise error
+            return _checksum_part(computer, start, end, part_size, part_queue, aborted)
+
+        with patch.object(DssChecksums.ChecksumComputer, '_checksum_part', fail_at_third_part):
+            with self.assertRaises(UploadException):
+                DssChecksums(s3_object=_s3obj).compute(checkpoint=ChecksumCheckpoint(_s3obj))
+
+        with patch.object(DssChecksums.ChecksumComputer, '_checksum_part', autospec=True,
+                          side_effect=_checksum_part) as mock_checksum_part:
+            _checksums = DssChecksums(s3_object=_s3obj).compute(checkpoint=ChecksumCheckpoint(_s3obj))
+
+        self.assertEqual([10, 15], [call[0][1] for call in mock_checksum_part.call_args_list])
+        self.assertEqual(_test_file.checksums['sha1'], _checksums['sha1'])
+        self.assertEqual(_test_file.checksums['sha256'], _checksums['sha256'])
+        self.assertEqual(_test_file.checksums['crc32c'], _checksums['crc32c'])
+        self.assertIsNone(ChecksumCheckpoint(_s3obj).load(part_size=5))
+
+    @patch('upload.common.dss_checksums.get_s3_multipart_chunk_size')
+    def test__compute_checksums__when_the_deadline_passes__checkpoints_at_the_last_part(self, mock_chunk_size):
+        mock_chunk_size.return_value = 5
+        _test_file = FixtureFile.factory("foo")
+        _s3obj = self.mock_upload_file_to_s3(self.upload_area_id, _test_file.name, contents=_test_file.contents)
+        _checksum_part = DssChecksums.ChecksumComputer._checksum_part
+
+        def slow_third_part(computer, start, end, part_size, part_queue, aborted):
+            if start == 10:
+                time.sleep(1)
+            return _checksum_part(computer, start, end, part_size, part_queue, aborted)
+
+        with patch.object(DssChecksums.ChecksumComputer, '_checksum_part', slow_third_part):
+            with self.assertRaises(ChecksumDeadlineExceeded):
+                DssChecksums(s3_object=_s3obj).compute(deadline=time.time() + 0.5,
+                                                       checkpoint=ChecksumCheckpoint(_s3obj))
+
+        part_checksums, _ = ChecksumCheckpoint(_s3obj).load(part_size=5)
+        self.assertEqual(2, len(part_checksums))
+        with patch.object(DssChecksums.ChecksumComputer, '_checksum_part', autospec=True,
+                          side_effect=_checksum_part) as mock_checksum_part:
+            _checksums = DssChecksums(s3_object=_s3obj).compute(checkpoint=ChecksumCheckpoint(_s3obj))
+        self.assertEqual([10, 15], [call[0][1] for call in mock_checksum_part.call_args_list])
+        self.assertEqual(_test_file.checksums['sha256'], _checksums['sha256'])
+
+    def test__compute_checksums__after_the_deadline__raises_checksum_deadline_exceeded(self):
+        _test_file = FixtureFile.factory("foo")
+
+        _s3obj = self.mock_upload_file_to_s3(self.upload_area_id, _test_file.name, contents=_test_file.contents)
+
+        with self.assertRaises(ChecksumDeadlineExceeded):
+            DssChecksums(s3_object=_s3obj).compute(deadline=time.time() - 1)
+
     def test__save_as_tags_on_s3_object__succeeds(self):
         _filename = "foo"
         _checksums = {'sha1': 'a', 'sha256': 'b', 'crc32c': 'c', 's3_etag': 'd'}
@@ -113,3 +195,10 @@ class TestDssChecksums(UploadTestCaseUsingMockAWS):
         self.assertEqual(
             [{'Key': 'hca-dss-' + _hash_function, 'Value': _value} for _hash_function, _value in _checksums.items()],
             self.s3client.get_object_tagging(Bucket=self.upload_area.bucket_name, Key=_s3obj.key)['TagSet'])
+
+    def test__tagger_checksums_from_tagset__returns_dss_checksums_without_their_prefix(self):
+        tagset = [{'Key': 'hca-dss-sha1', 'Value': 'a'}, {'Key': 'hca-dss-crc32c', 'Value': 'b'},
+                  {'Key': 'some-other-tag', 'Value': 'c'}]
+
+        self.assertEqual({'sha1': 'a', 'crc32c': 'b'}, DssChecksums.Tagger.checksums_from_tagset(tagset))
+        self.assertEqual({}, DssChecksums.Tagger.checksums_from_tagset([]))
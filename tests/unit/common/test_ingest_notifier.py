@@ -1,3 +1,5 @@
+import json
+import time
 import uuid
 
 from unittest.mock import patch
@@ -10,6 +12,10 @@ from .. import UploadTestCaseUsingMockAWS
 
 class TestIngestNotifier(UploadTestCaseUsingMockAWS):
 
+    def setUp(self):
+        super().setUp()
+        IngestNotifier._jwt_cache.clear()
+
     def test_init(self):
         ingest_notifier_one = IngestNotifier("file_uploaded", file_id=None)
         ingest_notifier_two = IngestNotifier("file_validated", file_id=None)
@@ -20,6 +26,14 @@ class TestIngestNotifier(UploadTestCaseUsingMockAWS):
         self.assertEqual(ingest_notifier_one.ingest_notification_url, expected_url_for_one)
         self.assertEqual(ingest_notifier_two.ingest_notification_url, expected_url_for_two)
 
+    def test_init__shares_configs_between_notifiers(self):
+        ingest_notifier_one = IngestNotifier("file_uploaded", file_id=None)
+        ingest_notifier_two = IngestNotifier("file_validated", file_id=None)
+
+        self.assertIs(ingest_notifier_one.upload_config, ingest_notifier_two.upload_config)
+        self.assertIs(ingest_notifier_one.outgoing_ingest_auth_config,
+                      ingest_notifier_two.outgoing_ingest_auth_config)
+
     def test_ingest_api_host(self):
         ingest_notifier = IngestNotifier("file_uploaded", file_id=None)
         ingest_api_host = ingest_notifier.ingest_api_host
@@ -39,8 +53,7 @@ class TestIngestNotifier(UploadTestCaseUsingMockAWS):
         self.assertEqual(gcp_service_acct_creds["private_key_id"], "test_private_key_id")
         self.assertEqual(gcp_service_acct_creds["client_email"], "test_client_email")
 
-    @patch('upload.lambdas.api_server.v1.area.IngestNotifier._send_notification')
-    def test_format_and_send_notification(self, mock_send_notification):
+    def test_format_and_send_notification__records_and_queues_the_notification(self):
         area_uuid = str(uuid.uuid4())
         upload_area = UploadArea(area_uuid)
         upload_area.update_or_create()
@@ -52,9 +65,13 @@ class TestIngestNotifier(UploadTestCaseUsingMockAWS):
         notification_id = ingest_notifier.format_and_send_notification(test_payload)
 
         record = UploadDB().get_pg_record("notification", notification_id, column="id")
-        self.assertEqual(record['status'], "DELIVERED")
+        self.assertEqual(record['status'], "DELIVERING")
         self.assertEqual(record['file_id'], file.db_id)
         self.assertEqual(record['payload'], test_payload)
+        self.assertEqual(record['notification_type'], "file_uploaded")
+        message = self.sqs.meta.client.receive_message(QueueUrl=self.upload_config.notification_q_url)['Messages'][0]
+        self.assertEqual({'notification_id': notification_id, 'notification_type': "file_uploaded"},
+                         json.loads(message['Body']))
 
     @patch('upload.common.ingest_notifier.encode')
     def test_get_service_jwt(self, mock_encode):
@@ -64,3 +81,27 @@ class TestIngestNotifier(UploadTestCaseUsingMockAWS):
         jwt = ingest_notifier.get_service_jwt()
 
         self.assertEqual(jwt, "test_jwt")
+
+    @patch('upload.common.ingest_notifier.encode')
+    def test_get_service_jwt__reuses_the_jwt_until_it_is_close_to_expiry(self, mock_encode):
+        mock_encode.return_value = b"test_jwt"
+
+        IngestNotifier("file_uploaded", file_id=None).get_service_jwt()
+        IngestNotifier("file_validated", file_id=None).get_service_jwt()
+        self.assertEqual(1, mock_encode.call_count)
+
+        with patch('upload.common.ingest_notifier.time.time', return_value=time.time() + 3400):
+            IngestNotifier("file_uploaded", file_id=None).get_service_jwt()
+        self.assertEqual(2, mock_encode.call_count)
+
+    @patch('upload.common.ingest_notifier.http_session.post')
+    @patch('upload.common.ingest_notifier.encode')
+    def test_send_notification__times_out_requests_to_ingest(self, mock_encode, mock_post):
+        mock_encode.return_value = b"test_jwt"
+        mock_post.return_value.status_code = 200
+
+        sent = IngestNotifier("file_uploaded", file_id=None).send_notification("an_id", {'upload_area_id': "a"})
+
+        self.assertTrue(sent)
+        self.assertEqual((IngestNotifier.CONNECT_TIMEOUT, IngestNotifier.READ_TIMEOUT),
+                         mock_post.call_args[1]['timeout'])
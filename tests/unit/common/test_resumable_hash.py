@@ -0,0 +1,40 @@
+import hashlib
+import os
+import unittest
+
+from upload.common.resumable_hash import ResumableHash
+
+
+@unittest.skipUnless(ResumableHash.is_available(), "libcrypto is not available")
+class TestResumableHash(unittest.TestCase):
+
+    def test_hashing_resumed_from_saved_state__equals_hashing_in_one_go(self):
+        data = os.urandom(1024 * 1024 + 7)
+        for name in ('sha1', 'sha256'):
+            hasher = ResumableHash(name)
+            hasher.update(data[:12345])
+            state = hasher.state()
+
+            resumed_hasher = ResumableHash(name, state=state)
+            resumed_hasher.update(data[12345:])
+
+            self.assertEqual(hashlib.new(name, data).hexdigest(), resumed_hasher.hexdigest())
+
+    def test_digest_does_not_end_hashing(self):
+        hasher = ResumableHash('sha256')
+        hasher.update(b"exquisite")
+        self.assertEqual(hashlib.sha256(b"exquisite").hexdigest(), hasher.hexdigest())
+        hasher.update(b" corpse")
+        self.assertEqual(hashlib.sha256(b"exquisite corpse").hexdigest(), hasher.hexdigest())
+
+    def test_copy__carries_on_independently(self):
+        hasher = ResumableHash('sha1')
+        hasher.update(b"exquisite")
+        copy = hasher.copy()
+        hasher.update(b" corpse")
+        self.assertEqual(hashlib.sha1(b"exquisite").hexdigest(), copy.hexdigest())
+        self.assertEqual(hashlib.sha1(b"exquisite corpse").hexdigest(), hasher.hexdigest())
+
+    def test_state_of_the_wrong_size__raises_value_error(self):
+        with self.assertRaises(ValueError):
+            ResumableHash('sha1', state=ResumableHash('sha256').state())
@@ -5,10 +5,12 @@ from botocore.exceptions import ClientError
 from moto import mock_sts
 from sqlalchemy.orm.exc import NoResultFound
 
+from upload.common.checksum_event import ChecksumEvent
 from upload.common.database_orm import DBSessionMaker, DbUploadArea, DbFile
 from upload.common.exceptions import UploadException
-from upload.common.upload_area import UploadArea
+from upload.common.upload_area import UploadArea, S3
 from upload.common.uploaded_file import UploadedFile
+from upload.common.validation_event import ValidationEvent
 from .. import UploadTestCaseUsingMockAWS
 
 
@@ -19,6 +21,10 @@ class UploadAreaTest(UploadTestCaseUsingMockAWS):
         self.db_session_maker = DBSessionMaker()
         self.db = self.db_session_maker.session()
 
+    def tearDown(self):
+        self.db.close()
+        super().tearDown()
+
 
 class TestUploadAreaCreationExistenceAndDeletion(UploadAreaTest):
 
@@ -57,20 +63,120 @@ class TestUploadAreaCreationExistenceAndDeletion(UploadAreaTest):
 
         self.assertTrue(UploadArea(db_area.uuid).is_extant())
 
+    def test_init__does_not_load_the_db_record(self):
+        with patch('upload.common.upload_area.UploadDB.get_pg_record') as mock_get_pg_record:
+            UploadArea(str(uuid.uuid4()))
+
+        mock_get_pg_record.assert_not_called()
+
+    def test_is_extant__reuses_a_recently_loaded_record(self):
+        db_area = self.create_upload_area()
+        self.assertTrue(UploadArea(db_area.uuid).is_extant())
+
+        with patch('upload.common.upload_area.UploadDB.get_pg_record') as mock_get_pg_record:
+            self.assertTrue(UploadArea(db_area.uuid).is_extant())
+
+        mock_get_pg_record.assert_not_called()
+
+    def test_is_extant__after_area_is_deleted_in_this_process__returns_false(self):
+        area = UploadArea(str(uuid.uuid4()))
+        area.update_or_create()
+        self.assertTrue(UploadArea(area.uuid).is_extant())
+
+        area.status = 'DELETED'
+        area._db_update()
+
+        self.assertFalse(UploadArea(area.uuid).is_extant())
+
     def test_delete__marks_area_delete_and_deletes_objects(self):
         db_area = self.create_upload_area(db_session=self.db)
         obj = self.upload_bucket.Object(f'{db_area.uuid}/test_file')
         obj.put(Body="foo")
 
-        with patch('upload.common.upload_area.UploadArea._retrieve_upload_area_deletion_lambda_timeout') as mock_retr:
-            mock_retr.return_value = 900
+        area = UploadArea(uuid=db_area.uuid)
+        area.delete()
 
-            area = UploadArea(uuid=db_area.uuid)
-            area.delete()
+        self.db.refresh(db_area)
+        self.assertEqual("DELETED", db_area.status)
+        with self.assertRaises(ClientError):
+            obj.load()
+
+    def test_delete__deletes_file_records(self):
+        db_area = self.create_upload_area(db_session=self.db)
+        s3obj = self.mock_upload_file_to_s3(db_area.uuid, 'file1')
+        UploadArea(uuid=db_area.uuid).uploaded_file('file1')
+
+        UploadArea(uuid=db_area.uuid).delete(get_remaining_time_in_millis=lambda: 900000)
+
+        self.assertEqual(0, self.db.query(DbFile).filter(DbFile.s3_key == s3obj.key).count())
 
+    @patch('upload.common.upload_area.UploadArea.FILE_RECORD_DELETE_BATCH_SIZE', 1)
+    def test_delete__deletes_file_records_in_batches(self):
+        db_area = self.create_upload_area(db_session=self.db)
+        for filename in ['file1', 'file2', 'file3']:
+            self.mock_upload_file_to_s3(db_area.uuid, filename)
+            UploadArea(uuid=db_area.uuid).uploaded_file(filename)
+
+        UploadArea(uuid=db_area.uuid).delete(get_remaining_time_in_millis=lambda: 900000)
+
+        self.assertEqual(0, self.db.query(DbFile).filter(DbFile.upload_area_id == db_area.id).count())
         self.db.refresh(db_area)
         self.assertEqual("DELETED", db_area.status)
+
+    @patch('upload.common.upload_area.UploadArea.FILE_RECORD_DELETE_BATCH_SIZE', 1)
+    def test_delete__when_out_of_time_deleting_file_records__requeues_after_last_deleted_key(self):
+        db_area = self.create_upload_area(db_session=self.db)
+        objs = [self.mock_upload_file_to_s3(db_area.uuid, filename) for filename in ['file1', 'file2']]
+        [UploadArea(uuid=db_area.uuid).uploaded_file(filename) for filename in ['file1', 'file2']]
+        # Time for two rounds of deleting objects, a batch of validation records and one of file records.
+        remaining_millis = iter([900000] * 4 + [UploadArea.DELETION_TIME_MARGIN * 1000])
+
+        with patch('upload.common.upload_area.SQSHandler.add_message_to_queue') as mock_add_message:
+            UploadArea(uuid=db_area.uuid).delete(get_remaining_time_in_millis=lambda: next(remaining_millis))
+
+        mock_add_message.assert_called_once_with({'area_uuid': db_area.uuid, 'start_after': objs[-1].key})
+        self.assertEqual(1, self.db.query(DbFile).filter(DbFile.upload_area_id == db_area.id).count())
+
+        UploadArea(uuid=db_area.uuid).delete(start_after=objs[-1].key, get_remaining_time_in_millis=lambda: 900000)
+
+        self.assertEqual(0, self.db.query(DbFile).filter(DbFile.upload_area_id == db_area.id).count())
+
+    def test_delete__with_checkpoint__resumes_after_checkpoint(self):
+        db_area = self.create_upload_area(db_session=self.db)
+        objs = [self.mock_upload_file_to_s3(db_area.uuid, filename) for filename in ['file1', 'file2', 'file3']]
+
+        UploadArea(uuid=db_area.uuid).delete(start_after=objs[0].key)
+
+        objs[0].load()
+        for obj in objs[1:]:
+            with self.assertRaises(ClientError):
+                obj.load()
+
+    def test_delete__when_out_of_time__requeues_with_checkpoint(self):
+        db_area = self.create_upload_area(db_session=self.db)
+        checkpoint = f"{db_area.uuid}/file1"
+
+        with patch('upload.common.upload_area.SQSHandler.add_message_to_queue') as mock_add_message:
+            UploadArea(uuid=db_area.uuid).delete(start_after=checkpoint, get_remaining_time_in_millis=lambda: 0)
+
+        mock_add_message.assert_called_once_with({'area_uuid': db_area.uuid, 'start_after': checkpoint})
+        self.db.refresh(db_area)
+        self.assertEqual("DELETION_QUEUED", db_area.status)
+
+    @patch('upload.common.upload_area.UploadArea.DELETION_CONCURRENCY', 1)
+    @patch('upload.common.upload_area.UploadArea.DELETE_BATCH_SIZE', 1)
+    def test_delete__when_no_batch_fits_in_remaining_time__requeues_after_last_deleted_key(self):
+        db_area = self.create_upload_area(db_session=self.db)
+        objs = [self.mock_upload_file_to_s3(db_area.uuid, filename) for filename in ['file1', 'file2', 'file3']]
+        remaining_millis = iter([900000, UploadArea.DELETION_TIME_MARGIN * 1000])
+
+        with patch('upload.common.upload_area.SQSHandler.add_message_to_queue') as mock_add_message:
+            UploadArea(uuid=db_area.uuid).delete(get_remaining_time_in_millis=lambda: next(remaining_millis))
+
+        mock_add_message.assert_called_once_with({'area_uuid': db_area.uuid, 'start_after': objs[0].key})
         with self.assertRaises(ClientError):
+            objs[0].load()
+        for obj in objs[1:]:
             obj.load()
 
 
@@ -168,6 +274,24 @@ class TestUploadAreaFileManipulation(UploadAreaTest):
         self.assertEqual(db_area.id, db_file.upload_area_id)
         self.assertEqual("some.json", db_file.name)
 
+    def test_store_file__tags_the_object_with_checksums_without_downloading_it(self):
+        db_area = self.create_upload_area()
+        area = UploadArea(uuid=db_area.uuid)
+
+        with patch('upload.common.dss_checksums.DssChecksums.ChecksumComputer.compute') as mock_compute:
+            area.store_file("some.json", content="exquisite corpse",
+                            content_type='application/json; dcp-type="metadata/sample"')
+
+        mock_compute.assert_not_called()
+        tagging = self.upload_bucket.meta.client.get_object_tagging(Bucket=self.upload_config.bucket_name,
+                                                                    Key=f"{db_area.uuid}/some.json")
+        self.assertEqual({
+            'hca-dss-crc32c': "fe9ada52",
+            'hca-dss-s3_etag': "18f17fbfdd21cf869d664731e10d4ffd",
+            'hca-dss-sha1': "b1b101e21cf9cf8a4729da44d7818f935eec0ce8",
+            'hca-dss-sha256': "29f5572dfbe07e1db9422a4c84e3f9e455aab9ac596f0bf3340be17841f26f70"
+        }, {tag['Key']: tag['Value'] for tag in tagging['TagSet']})
+
     def test__store_redundant_file__only_uploaded_once(self):
         db_area = self.create_upload_area()
         area = UploadArea(uuid=db_area.uuid)
@@ -231,6 +355,157 @@ class TestUploadAreaFileManipulation(UploadAreaTest):
 
         self.assertEqual(area_2_files, [file['name'] for file in data['files']])
 
+    def test_ls__with_page_size__returns_one_page_and_a_marker(self):
+        db_area = self.create_upload_area(db_session=self.db)
+        [self.mock_upload_file_to_s3(db_area.uuid, file) for file in ['file1', 'file2', 'file3']]
+        area = UploadArea(uuid=db_area.uuid)
+
+        first_page = area.ls(page_size=2)
+        second_page = area.ls(page_size=2, start_after=first_page['next_start_after'])
+
+        self.assertEqual(['file1', 'file2'], [file['name'] for file in first_page['files']])
+        self.assertEqual('file2', first_page['next_start_after'])
+        self.assertEqual(['file3'], [file['name'] for file in second_page['files']])
+        self.assertNotIn('next_start_after', second_page)
+
+    def test_ls__without_page_size__returns_a_page_of_default_size(self):
+        db_area = self.create_upload_area(db_session=self.db)
+        [self.mock_upload_file_to_s3(db_area.uuid, file) for file in ['file1', 'file2', 'file3']]
+
+        with patch('upload.common.upload_area.UploadArea.LS_PAGE_SIZE', 2):
+            data = UploadArea(uuid=db_area.uuid).ls()
+
+        self.assertEqual(['file1', 'file2'], [file['name'] for file in data['files']])
+        self.assertEqual('file2', data['next_start_after'])
+
+    def test_ls__only_heads_objects_without_a_recorded_content_type(self):
+        db_area = self.create_upload_area(db_session=self.db)
+        area = UploadArea(uuid=db_area.uuid)
+        area.store_file('recorded.json', content=str(uuid.uuid4()), content_type='application/json; dcp-type=data')
+        self.mock_upload_file_to_s3(db_area.uuid, 'unrecorded.json', content_type='application/json; dcp-type=data')
+
+        with patch.object(S3.meta.client, 'head_object', wraps=S3.meta.client.head_object) as mock_head_object:
+            data = area.ls()
+
+        self.assertEqual([f"{db_area.uuid}/unrecorded.json"],
+                         [call[1]['Key'] for call in mock_head_object.call_args_list])
+        self.assertEqual(['application/json; dcp-type=data'] * 2, [file['content_type'] for file in data['files']])
+
+    def test_ls__after_an_object_is_retyped_in_place__reports_its_new_content_type(self):
+        db_area = self.create_upload_area(db_session=self.db)
+        area = UploadArea(uuid=db_area.uuid)
+        s3obj = self.mock_upload_file_to_s3(db_area.uuid, 'file1.json', contents=str(uuid.uuid4()),
+                                            content_type='application/json')
+        area.uploaded_file('file1.json')
+        s3obj.copy_from(CopySource={'Bucket': s3obj.bucket_name, 'Key': s3obj.key},
+                        ContentType='application/json; dcp-type=data', MetadataDirective='REPLACE')
+        area.uploaded_file('file1.json')  # as the checksum daemon does on the copy's event
+
+        data = area.ls()
+
+        self.assertEqual('application/json; dcp-type=data', data['files'][0]['content_type'])
+
+    def test_ls__prefers_checksums_from_file_records_over_tags(self):
+        db_area = self.create_upload_area(db_session=self.db)
+        s3obj = self.mock_upload_file_to_s3(db_area.uuid, 'file1', checksums={})
+        db_checksums = {'s3_etag': 'a', 'sha1': 'b', 'sha256': 'c', 'crc32c': 'd'}
+        self.db.add(DbFile(s3_key=s3obj.key, s3_etag=s3obj.e_tag.strip('\"'), upload_area_id=db_area.id,
+                           name='file1', size=s3obj.content_length, checksums=db_checksums))
+        self.db.commit()
+
+        data = UploadArea(uuid=db_area.uuid).ls()
+
+        self.assertEqual(db_checksums, data['files'][0]['checksums'])
+
+    def test_files_info__returns_info_in_the_order_requested(self):
+        db_area = self.create_upload_area(db_session=self.db)
+        [self.mock_upload_file_to_s3(db_area.uuid, file) for file in ['file1', 'file2', 'file3']]
+
+        data = UploadArea(uuid=db_area.uuid).files_info(['file3', 'file1', 'file2'])
+
+        self.assertEqual(['file3', 'file1', 'file2'], [file['name'] for file in data])
+
+    def test_files_info__prefers_checksums_from_file_records_over_tags(self):
+        db_area = self.create_upload_area(db_session=self.db)
+        s3obj = self.mock_upload_file_to_s3(db_area.uuid, 'file1', checksums={})
+        db_checksums = {'s3_etag': 'a', 'sha1': 'b', 'sha256': 'c', 'crc32c': 'd'}
+        self.db.add(DbFile(s3_key=s3obj.key, s3_etag=s3obj.e_tag.strip('\"'), upload_area_id=db_area.id,
+                           name='file1', size=s3obj.content_length, checksums=db_checksums))
+        self.db.commit()
+
+        data = UploadArea(uuid=db_area.uuid).files_info(['file1'])
+
+        self.assertEqual(db_checksums, data[0]['checksums'])
+
+    def test_files_info__for_a_missing_file__raises_404(self):
+        db_area = self.create_upload_area(db_session=self.db)
+        self.mock_upload_file_to_s3(db_area.uuid, 'file1')
+
+        with self.assertRaises(UploadException) as context:
+            UploadArea(uuid=db_area.uuid).files_info(['file1', 'no_such_file'])
+
+        self.assertEqual(404, context.exception.status)
+
+    def test_retrieve_file_checksum_statuses__follows_checksum_status_changes(self):
+        db_area = self.create_upload_area(db_session=self.db)
+        area = UploadArea(uuid=db_area.uuid)
+        [self.mock_upload_file_to_s3(db_area.uuid, filename) for filename in ['file1', 'file2']]
+        files = area.uploaded_files(['file1', 'file2'])
+        checksum_event = ChecksumEvent(file_id=files[0].db_id, checksum_id=str(uuid.uuid4()),
+                                       job_id='123', status="CHECKSUMMING")
+        checksum_event.create_record()
+        checksum_event.status = "CHECKSUMMED"
+        checksum_event.update_record()
+
+        self.assertEqual({
+            'TOTAL_NUM_FILES': 2,
+            'CHECKSUMMING': 0,
+            'CHECKSUMMED': 1,
+            'CHECKSUMMING_UNSCHEDULED': 1
+        }, area.retrieve_file_checksum_statuses_for_upload_area())
+
+    def test_retrieve_file_checksum_statuses__counts_checksum_events_created_in_bulk(self):
+        db_area = self.create_upload_area(db_session=self.db)
+        area = UploadArea(uuid=db_area.uuid)
+        [self.mock_upload_file_to_s3(db_area.uuid, filename) for filename in ['file1', 'file2']]
+        files = area.uploaded_files(['file1', 'file2'])
+
+        ChecksumEvent.create_records([ChecksumEvent(file_id=file.db_id, checksum_id=str(uuid.uuid4()),
+                                                    job_id='123', status="SCHEDULED") for file in files])
+
+        self.assertEqual(2, area.retrieve_file_checksum_statuses_for_upload_area()['SCHEDULED'])
+
+    def test_retrieve_file_validation_statuses__follows_validation_status_changes(self):
+        db_area = self.create_upload_area(db_session=self.db)
+        area = UploadArea(uuid=db_area.uuid)
+        [self.mock_upload_file_to_s3(db_area.uuid, filename) for filename in ['file1', 'file2']]
+        files = area.uploaded_files(['file1', 'file2'])
+        validation_event = ValidationEvent(file_ids=[file.db_id for file in files], validation_id=str(uuid.uuid4()),
+                                           job_id='123', status="SCHEDULED")
+        validation_event.create_record()
+        validation_event.status = "VALIDATING"
+        validation_event.update_record()
+
+        self.assertEqual({'VALIDATING': 2, 'VALIDATED': 0, 'SCHEDULED': 0},
+                         area.retrieve_file_validation_statuses_for_upload_area())
+
+    def test_retrieve_file_count__counts_each_filename_once_and_forgets_deleted_files(self):
+        db_area = self.create_upload_area(db_session=self.db)
+        area = UploadArea(uuid=db_area.uuid)
+        self.mock_upload_file_to_s3(db_area.uuid, 'file1', contents="foo")
+        area.uploaded_file('file1')
+        self.mock_upload_file_to_s3(db_area.uuid, 'file1', contents="bar")
+        area.uploaded_file('file1')
+        self.mock_upload_file_to_s3(db_area.uuid, 'file2')
+        area.uploaded_file('file2')
+
+        self.assertEqual(2, area.retrieve_file_count_for_upload_area())
+
+        self.db.query(DbFile).filter(DbFile.upload_area_id == db_area.id, DbFile.name == 'file2').delete()
+        self.db.commit()
+
+        self.assertEqual(1, area.retrieve_file_count_for_upload_area())
+
     def test_uploaded_file(self):
         db_area = self.create_upload_area()
         filename = "somefile.json"
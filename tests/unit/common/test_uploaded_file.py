@@ -4,9 +4,11 @@ import uuid
 
 from sqlalchemy.orm.exc import NoResultFound
 
+from upload.common.checksum_event import ChecksumEvent
 from upload.common.database_orm import DBSessionMaker, DbFile
 from upload.common.upload_area import UploadArea
 from upload.common.uploaded_file import UploadedFile
+from upload.common.validation_event import ValidationEvent
 from .. import UploadTestCaseUsingMockAWS
 from ... import FixtureFile
 
@@ -34,6 +36,7 @@ class TestUploadedFile(UploadTestCaseUsingMockAWS):
         return record
 
     def tearDown(self):
+        self.db.close()
         super().tearDown()
 
     def test_create__creates_a_new_s3_object_and_db_record(self):
@@ -121,6 +124,19 @@ class TestUploadedFile(UploadTestCaseUsingMockAWS):
         self.assertEqual(s3object, uf.s3object)
         self.assertEqual(file_record.id, uf.db_id)
 
+    def test_from_s3_keys__finds_existing_records_and_creates_missing_ones(self):
+        existing_s3object = self.create_s3_object(f"{self.upload_area_id}/file-{random.randint(0, 999999999)}")
+        existing_record = self.create_file_record(existing_s3object, checksums={'crc32c': 'cafef00d'})
+        new_s3object = self.create_s3_object(f"{self.upload_area_id}/file-{random.randint(0, 999999999)}")
+
+        files = UploadedFile.from_s3_keys(self.upload_area, [existing_s3object.key, new_s3object.key])
+
+        self.assertEqual(existing_record.id, files[0].db_id)
+        self.assertEqual({'crc32c': 'cafef00d'}, files[0].checksums)
+        new_record = self.db.query(DbFile).filter(DbFile.s3_key == new_s3object.key).one()
+        self.assertEqual(new_record.id, files[1].db_id)
+        self.assertEqual(new_s3object.content_length, new_record.size)
+
     def test_from_db_id__initializes_correctly_and_figures_out_which_upload_area_to_use(self):
         filename = f"file-{random.randint(0, 999999999)}"
         s3object = self.create_s3_object(f"{self.upload_area_id}/{filename}")
@@ -178,3 +194,28 @@ class TestUploadedFile(UploadTestCaseUsingMockAWS):
             'checksums': test_file.checksums,
             'last_modified': s3object.last_modified.isoformat()
         }, uf.info())
+
+    def test_retrieve_latest_file_validation_status_and_results__returns_the_newest_validation(self):
+        s3object = self.create_s3_object(f"{self.upload_area_id}/file-{random.randint(0, 999999999)}")
+        uf = UploadedFile(self.upload_area, s3object=s3object)
+        old_validation = ValidationEvent(file_ids=[uf.db_id], validation_id=str(uuid.uuid4()),
+                                         job_id='123', status="VALIDATED")
+        old_validation.results = {'stdout': 'old results'}
+        old_validation.create_record()
+        ValidationEvent(file_ids=[uf.db_id], validation_id=str(uuid.uuid4()),
+                        job_id='456', status="SCHEDULED").create_record()
+
+        self.assertEqual(("SCHEDULED", None), uf.retrieve_latest_file_validation_status_and_results())
+
+    def test_retrieve_latest_checksum_statuses__returns_the_newest_status_of_each_file(self):
+        checksummed_file = UploadedFile(self.upload_area, s3object=self.create_s3_object(
+            f"{self.upload_area_id}/file-{random.randint(0, 999999999)}"))
+        unchecksummed_file = UploadedFile(self.upload_area, s3object=self.create_s3_object(
+            f"{self.upload_area_id}/file-{random.randint(0, 999999999)}"))
+        for status in ("ABORTED", "CHECKSUMMED"):
+            ChecksumEvent(file_id=checksummed_file.db_id, checksum_id=str(uuid.uuid4()),
+                          job_id='123', status=status).create_record()
+
+        statuses = UploadedFile.retrieve_latest_checksum_statuses([checksummed_file.db_id, unchecksummed_file.db_id])
+
+        self.assertEqual({checksummed_file.db_id: "CHECKSUMMED", unchecksummed_file.db_id: "UNSCHEDULED"}, statuses)
@@ -5,6 +5,7 @@ from unittest.mock import patch
 from upload.common.database import UploadDB
 from upload.common.upload_area import UploadArea
 from upload.common.uploaded_file import UploadedFile
+from upload.common.validation_event import ValidationEvent
 from upload.common.validation_scheduler import ValidationScheduler, MAX_FILE_SIZE_IN_BYTES
 from .. import UploadTestCaseUsingMockAWS
 
@@ -34,6 +35,18 @@ class TestValidationScheduler(UploadTestCaseUsingMockAWS):
 
         self.assertEqual(False, file_validatable)
 
+    @patch('upload.common.upload_area.UploadedFile.size', MAX_FILE_SIZE_IN_BYTES + 1)
+    def test_check_files_can_be_validated__when_files_are_too_large_but_will_be_streamed__returns_true(self):
+        uploaded_file = UploadedFile.create(upload_area=self.upload_area,
+                                            name="file2",
+                                            content_type="application/octet-stream; dcp-type=data",
+                                            data="file2_content")
+        scheduler = ValidationScheduler(self.upload_area_id, [uploaded_file])
+
+        file_validatable = scheduler.check_files_can_be_validated({'STAGING_MODE': 'fifo'})
+
+        self.assertEqual(True, file_validatable)
+
     def test__create_validation_event__creates_event_with_correct_status(self):
         uploaded_file = UploadedFile.create(upload_area=self.upload_area,
                                             name="file2#",
@@ -97,3 +110,86 @@ class TestValidationScheduler(UploadTestCaseUsingMockAWS):
         self.assertEqual(message_body["orig_validation_id"], "123456")
         self.assertEqual(message_body["upload_area_uuid"], uploaded_file.upload_area.uuid)
         self.assertEqual(record["status"], "SCHEDULING_QUEUED")
+
+    def _create_completed_validation(self, uploaded_files, docker_image, results_status='completed', env=None):
+        validation_event = ValidationEvent(file_ids=[file.db_id for file in uploaded_files],
+                                           validation_id=str(uuid.uuid4()),
+                                           status="VALIDATED",
+                                           docker_image=docker_image,
+                                           cache_key=ValidationScheduler(self.upload_area_id,
+                                                                         uploaded_files).cache_key(docker_image, env))
+        validation_event.results = {'status': results_status, 'exit_code': 0, 'stdout': "looks good"}
+        validation_event.create_record()
+
+    def _create_file(self, upload_area, name, data):
+        return UploadedFile.create(upload_area=upload_area, name=name,
+                                   content_type="application/octet-stream; dcp-type=data", data=data)
+
+    def test_find_cached_validation_results__for_file_with_same_content_validated_by_same_image__returns_results(self):
+        image = "validator@sha256:0123456789abcdef"
+        data = f"file2_content {uuid.uuid4()}"
+        other_area = UploadArea(str(uuid.uuid4()))
+        other_area.update_or_create()
+        self._create_completed_validation([self._create_file(other_area, "file2", data)], image)
+        scheduler = ValidationScheduler(self.upload_area_id, [self._create_file(self.upload_area, "file2", data)])
+
+        results = scheduler.find_cached_validation_results(image, {'STAGING_MODE': 'fifo'})
+
+        self.assertEqual({'status': 'completed', 'exit_code': 0, 'stdout': "looks good"}, results)
+        self.assertIsNone(scheduler.find_cached_validation_results("validator@sha256:fedcba9876543210", {}))
+        self.assertIsNone(scheduler.find_cached_validation_results(image, {'VARIABLE': 'value'}))
+
+    def test_find_cached_validation_results__only_returns_results_of_validations_with_the_same_environment(self):
+        image = "validator@sha256:0123456789abcdef"
+        uploaded_file = self._create_file(self.upload_area, "file2", f"file2_content {uuid.uuid4()}")
+        self._create_completed_validation([uploaded_file], image, env={'VARIABLE': 'value'})
+        scheduler = ValidationScheduler(self.upload_area_id, [uploaded_file])
+
+        self.assertIsNone(scheduler.find_cached_validation_results(image, {}))
+        self.assertIsNotNone(scheduler.find_cached_validation_results(image, {'VARIABLE': 'value'}))
+
+    def test_find_cached_validation_results__for_the_same_files_in_another_order__returns_none(self):
+        image = "validator@sha256:0123456789abcdef"
+        file1 = self._create_file(self.upload_area, "file1", f"file1_content {uuid.uuid4()}")
+        file2 = self._create_file(self.upload_area, "file2", f"file2_content {uuid.uuid4()}")
+        self._create_completed_validation([file1, file2], image)
+
+        reordered_scheduler = ValidationScheduler(self.upload_area_id, [file2, file1])
+        self.assertIsNone(reordered_scheduler.find_cached_validation_results(image, {}))
+        scheduler = ValidationScheduler(self.upload_area_id, [file1, file2])
+        self.assertIsNotNone(scheduler.find_cached_validation_results(image, {}))
+
+    def test_find_cached_validation_results__for_image_referenced_by_tag__returns_none(self):
+        image = "validator:latest"
+        uploaded_file = self._create_file(self.upload_area, "file2", f"file2_content {uuid.uuid4()}")
+        self._create_completed_validation([uploaded_file], image)
+        scheduler = ValidationScheduler(self.upload_area_id, [uploaded_file])
+
+        self.assertIsNone(scheduler.find_cached_validation_results(image, {}))
+
+    def test_find_cached_validation_results__when_validator_did_not_complete__returns_none(self):
+        image = "validator@sha256:0123456789abcdef"
+        uploaded_file = self._create_file(self.upload_area, "file2", f"file2_content {uuid.uuid4()}")
+        self._create_completed_validation([uploaded_file], image, results_status='timed_out')
+        scheduler = ValidationScheduler(self.upload_area_id, [uploaded_file])
+
+        self.assertIsNone(scheduler.find_cached_validation_results(image, {}))
+
+    def test_record_cached_validation__creates_validated_record_with_results_for_these_files(self):
+        uploaded_file = UploadedFile.create(upload_area=self.upload_area, name="file2",
+                                            content_type="application/octet-stream; dcp-type=data",
+                                            data="file2_content")
+        scheduler = ValidationScheduler(self.upload_area_id, [uploaded_file])
+
+        validation_id, results = scheduler.record_cached_validation("validator@sha256:0123456789abcdef",
+                                                                    {'status': 'completed', 'names': ['other']},
+                                                                    ["file2"], "123456")
+
+        self.assertEqual({'status': 'completed', 'names': ["file2"], 'upload_area_id': self.upload_area_id,
+                          'validation_id': "123456"}, results)
+        record = UploadDB().get_pg_record("validation", validation_id, column='id')
+        self.assertEqual("VALIDATED", record["status"])
+        self.assertEqual(results, record["results"])
+        self.assertEqual("123456", record["original_validation_id"])
+        validation_files_records = UploadDB().get_pg_records("validation_files", validation_id, column='validation_id')
+        self.assertEqual([uploaded_file.db_id], [record['file_id'] for record in validation_files_records])
@@ -1,3 +1,4 @@
+import json
 import unittest
 import uuid
 from unittest.mock import patch
@@ -63,6 +64,44 @@ class TestChecksummerDockerImage(UploadTestCaseUsingMockAWS):
 
         mock_update_checksum_event.assert_called_once_with(status='ABORTED')
 
+    @patch('upload.docker_images.checksummer.checksummer.Checksummer._update_checksum_event')
+    def test_manifest_checksummer__checksums_each_file_and_reports_on_its_own_checksum_event(
+            self, mock_update_checksum_event):
+        test_file = FixtureFile.factory("foo")
+        manifest = []
+        for filename in ('file1', 'file2'):
+            file_s3_key = f"somearea/{filename}"
+            self.create_s3_object(file_s3_key, content=test_file.contents,
+                                  checksum_value={'crc32c': test_file.checksums['crc32c']})
+            manifest.append({'s3_url': f"s3://{self.upload_bucket.name}/{file_s3_key}",
+                             's3_etag': test_file.e_tag,
+                             'checksum_id': str(uuid.uuid4())})
+
+        from upload.docker_images.checksummer.checksummer import ManifestChecksummer
+        self.assertTrue(ManifestChecksummer(['--manifest', json.dumps(manifest)]).checksum_files())
+
+        for filename in ('file1', 'file2'):
+            tagging = boto3.client('s3').get_object_tagging(Bucket=self.upload_bucket.name, Key=f"somearea/{filename}")
+            self.assertEqual(sorted(tagging['TagSet'], key=lambda x: x['Key']), test_file.s3_tagset)
+        self.assertEqual(4, mock_update_checksum_event.call_count)
+
+    @patch('upload.docker_images.checksummer.checksummer.Checksummer._update_checksum_event')
+    def test_manifest_checksummer__when_a_file_fails__checksums_the_others_and_returns_false(
+            self, mock_update_checksum_event):
+        test_file = FixtureFile.factory("foo")
+        self.create_s3_object("somearea/file1", content=test_file.contents,
+                              checksum_value={'crc32c': test_file.checksums['crc32c']})
+        manifest = [{'s3_url': f"s3://{self.upload_bucket.name}/somearea/file1", 's3_etag': test_file.e_tag,
+                     'checksum_id': str(uuid.uuid4())},
+                    {'s3_url': f"s3://{self.upload_bucket.name}/somearea/missing", 's3_etag': test_file.e_tag,
+                     'checksum_id': str(uuid.uuid4())}]
+
+        from upload.docker_images.checksummer.checksummer import ManifestChecksummer
+        self.assertFalse(ManifestChecksummer(['--manifest', json.dumps(manifest)]).checksum_files())
+
+        tagging = boto3.client('s3').get_object_tagging(Bucket=self.upload_bucket.name, Key="somearea/file1")
+        self.assertEqual(sorted(tagging['TagSet'], key=lambda x: x['Key']), test_file.s3_tagset)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,7 @@
 import json
 import os
+import stat
+import threading
 from tempfile import TemporaryDirectory
 
 import responses
@@ -101,6 +103,141 @@ class TestValidatorHarness(UploadTestCaseUsingMockAWS):
 
             self.assertEqual(5, self.mock_download_file_call_count)
 
+    def test__stage_files_to_be_validated__stages_multiple_files_in_the_order_given(self):
+        filenames = ['R1.fastq.gz', 'R2.fastq.gz', 'R3.fastq.gz']
+        for filename in filenames:
+            self.upload_bucket.Object(f"{self.upload_area_id}/{filename}").put(Body=filename)
+        s3_urls = [f"s3://{self.upload_config.bucket_name}/{self.upload_area_id}/{filename}" for filename in filenames]
+
+        with TemporaryDirectory() as staging_dir:
+            harness = ValidatorHarness(path_to_validator=None,
+                                       s3_urls_of_files_to_be_validated=s3_urls,
+                                       staging_folder=staging_dir)
+
+            upload_area_id, file_names = harness._stage_files_to_be_validated()
+
+            self.assertEqual(self.upload_area_id, upload_area_id)
+            self.assertEqual(filenames, file_names)
+            self.assertEqual([f"{staging_dir}/{self.upload_area_id}/{filename}" for filename in filenames],
+                             [str(path) for path in harness.staged_file_paths])
+            for filename in filenames:
+                with open(f"{staging_dir}/{self.upload_area_id}/{filename}", 'r') as fp:
+                    self.assertEqual(filename, fp.read())
+
+    def test__stage_files_to_be_validated__on_retry_does_not_download_files_already_staged(self):
+        other_s3_object_key = f"{self.upload_area_id}/other_file"
+        self.upload_bucket.Object(other_s3_object_key).put(Body="baz\n")
+        other_s3_url = f"s3://{self.upload_config.bucket_name}/{other_s3_object_key}"
+        download_file = ValidatorHarness._download_file_from_bucket_to_filesystem
+        downloaded_keys = []
+
+        def _download_other_file_succeeding_on_the_2nd_try(harness, s3_bucket_name, s3_object_key, staged_file_path):
+            downloaded_keys.append(s3_object_key)
+            if s3_object_key != other_s3_object_key or downloaded_keys.count(s3_object_key) > 1:
+                download_file(harness, s3_bucket_name, s3_object_key, staged_file_path)
+
+        with TemporaryDirectory() as staging_dir:
+            harness = ValidatorHarness(path_to_validator=None,
+                                       s3_urls_of_files_to_be_validated=[self.s3_url, other_s3_url],
+                                       staging_folder=staging_dir)
+            harness._stage_files_to_be_validated.retry.wait = tenacity.wait_none()  # Speed things up
+
+            with patch.object(ValidatorHarness, '_download_file_from_bucket_to_filesystem', autospec=True,
+                              side_effect=_download_other_file_succeeding_on_the_2nd_try):
+                harness._stage_files_to_be_validated()
+
+            self.assertEqual(1, downloaded_keys.count(self.s3_object_key))
+            self.assertEqual(2, downloaded_keys.count(other_s3_object_key))
+            self.assertEqual(2, len(harness.staged_file_paths))
+
+    def test__stage_files_to_be_validated__in_a_retried_job__does_not_download_files_already_staged(self):
+        with TemporaryDirectory() as staging_dir:
+            ValidatorHarness(path_to_validator=None, s3_urls_of_files_to_be_validated=[self.s3_url],
+                             staging_folder=staging_dir)._stage_files_to_be_validated()
+            harness = ValidatorHarness(path_to_validator=None, s3_urls_of_files_to_be_validated=[self.s3_url],
+                                       staging_folder=staging_dir)
+
+            with patch.object(ValidatorHarness, '_download_file_from_bucket_to_filesystem') as mock_download_file:
+                harness._stage_files_to_be_validated()
+
+            mock_download_file.assert_not_called()
+            self.assertEqual(1, len(harness.staged_file_paths))
+
+    def test__stage_files_to_be_validated__downloads_a_staged_file_again_if_its_object_has_changed(self):
+        with TemporaryDirectory() as staging_dir:
+            ValidatorHarness(path_to_validator=None, s3_urls_of_files_to_be_validated=[self.s3_url],
+                             staging_folder=staging_dir)._stage_files_to_be_validated()
+            self.upload_bucket.Object(self.s3_object_key).put(Body="barfoo\n")  # the same size
+            harness = ValidatorHarness(path_to_validator=None, s3_urls_of_files_to_be_validated=[self.s3_url],
+                                       staging_folder=staging_dir)
+
+            harness._stage_files_to_be_validated()
+
+            with open(f"{staging_dir}/{self.upload_area_id}/{self.filename}", 'r') as fp:
+                self.assertEqual("barfoo\n", fp.read())
+
+    def test__stage_files_to_be_validated__in_fifo_mode__creates_fifo_instead_of_downloading(self):
+        with TemporaryDirectory() as staging_dir, EnvironmentSetup({'STAGING_MODE': 'fifo'}):
+            harness = ValidatorHarness(path_to_validator='/bin/true',
+                                       s3_urls_of_files_to_be_validated=[self.s3_url],
+                                       staging_folder=staging_dir)
+
+            harness._stage_files_to_be_validated()
+
+            expected_file_path = f"{staging_dir}/{self.upload_area_id}/{self.filename}"
+            self.assertTrue(stat.S_ISFIFO(os.stat(expected_file_path).st_mode))
+            results = harness._run_validator()
+            harness._finish_streaming(results)  # validator never opened the FIFO, this must not hang
+            self.assertEqual('completed', results['status'])
+
+    def test__stage_files_to_be_validated__in_fifo_mode__on_retry_releases_the_streamers_of_the_last_try(self):
+        other_s3_object_key = f"{self.upload_area_id}/other_file"
+        self.upload_bucket.Object(other_s3_object_key).put(Body="baz\n")
+        other_s3_url = f"s3://{self.upload_config.bucket_name}/{other_s3_object_key}"
+        mkfifo = os.mkfifo
+        mkfifo_calls = []
+
+        def _mkfifo_failing_on_the_2nd_call(path):
+            mkfifo_calls.append(path)
+            if len(mkfifo_calls) == 2:
+                raise OSError("no space left on device")
+            mkfifo(path)
+
+        with TemporaryDirectory() as staging_dir, EnvironmentSetup({'STAGING_MODE': 'fifo'}):
+            harness = ValidatorHarness(path_to_validator='/usr/bin/sum',
+                                       s3_urls_of_files_to_be_validated=[self.s3_url, other_s3_url],
+                                       staging_folder=staging_dir)
+            harness._stage_files_to_be_validated.retry.wait = tenacity.wait_none()  # Speed things up
+
+            with patch('os.mkfifo', side_effect=_mkfifo_failing_on_the_2nd_call):
+                harness._stage_files_to_be_validated()
+
+            self.assertEqual(4, len(mkfifo_calls))
+            self.assertEqual(2, len(harness._streamers))
+            results = harness._run_validator()
+            finisher = threading.Thread(target=harness._finish_streaming, args=(results,), daemon=True)
+            finisher.start()
+            finisher.join(timeout=10)
+            self.assertFalse(finisher.is_alive())
+            self.assertEqual('completed', results['status'])
+            self.assertEqual(0, results['exit_code'])
+
+    def test__run_validator__in_fifo_mode__streams_file_to_validator(self):
+        with TemporaryDirectory() as staging_dir, EnvironmentSetup({'STAGING_MODE': 'fifo'}):
+            harness = ValidatorHarness(path_to_validator='/usr/bin/sum',
+                                       s3_urls_of_files_to_be_validated=[self.s3_url],
+                                       staging_folder=staging_dir)
+            harness._stage_files_to_be_validated()
+
+            results = harness._run_validator()
+            harness._finish_streaming(results)
+
+            self.assertEqual('completed', results['status'])
+            self.assertEqual(0, results['exit_code'])
+            self.assertIn("32883", results['stdout'])
+            harness._unstage_files()
+            self.assertFalse(os.path.exists(f"{staging_dir}/{self.upload_area_id}/{self.filename}"))
+
     def test__unstage_files__removes_staged_file(self):
         with TemporaryDirectory() as staging_dir:
             harness = ValidatorHarness(path_to_validator=None,
@@ -113,6 +250,7 @@ class TestValidatorHarness(UploadTestCaseUsingMockAWS):
             harness._unstage_files()
 
             self.assertFalse(os.path.isfile(expected_file_path))
+            self.assertEqual([], os.listdir(f"{staging_dir}/{self.upload_area_id}"))
 
     def test__run_validator__runs_binary_and_returns_results_dict_for_validator_running_successfully(self):
         with TemporaryDirectory() as staging_dir:
@@ -135,10 +135,8 @@ class TestAreaApi(UploadTestCaseUsingMockAWS):
         self.assertEqual(409, response.status_code)
 
     @mock_sts
-    @patch('upload.common.upload_area.UploadArea._retrieve_upload_area_deletion_lambda_timeout')
-    def test_credentials__with_deleted_upload_area__returns_404(self, mock_area_deletion_timeout):
+    def test_credentials__with_deleted_upload_area__returns_404(self):
         area_uuid = self._create_area()
-        mock_area_deletion_timeout.return_value = 900
         UploadArea(area_uuid).delete()
 
         response = self.client.post(f"/v1/area/{area_uuid}/credentials")
@@ -167,30 +165,26 @@ class TestAreaApi(UploadTestCaseUsingMockAWS):
         record = UploadDB().get_pg_record("upload_area", area_uuid, column='uuid')
         self.assertEqual("DELETION_QUEUED", record["status"])
 
-    @patch('upload.common.upload_area.UploadArea._retrieve_upload_area_deletion_lambda_timeout')
-    def test_upload_area_delete(self, mock_retrieve_lambda_timeout):
+    def test_upload_area_delete(self):
         area_uuid = self._create_area()
         obj = self.upload_bucket.Object(f'{area_uuid}/test_file')
         obj.put(Body="foo")
-        mock_retrieve_lambda_timeout.return_value = 900
 
         area = UploadArea(area_uuid)
-        area.delete()
+        area.delete(get_remaining_time_in_millis=lambda: 900000)
 
         record = UploadDB().get_pg_record("upload_area", area_uuid, column='uuid')
         self.assertEqual("DELETED", record["status"])
         with self.assertRaises(ClientError):
             obj.load()
 
-    @patch('upload.common.upload_area.UploadArea._retrieve_upload_area_deletion_lambda_timeout')
-    def test_upload_area_delete_over_timeout(self, mock_retrieve_lambda_timeout):
+    def test_upload_area_delete_over_timeout(self):
         area_uuid = self._create_area()
         obj = self.upload_bucket.Object(f'{area_uuid}/test_file')
         obj.put(Body="foo")
-        mock_retrieve_lambda_timeout.return_value = 0
 
         area = UploadArea(area_uuid)
-        area.delete()
+        area.delete(get_remaining_time_in_millis=lambda: 0)
 
         record = UploadDB().get_pg_record("upload_area", area_uuid, column='uuid')
         self.assertEqual("DELETION_QUEUED", record["status"])
@@ -258,6 +252,17 @@ class TestAreaApi(UploadTestCaseUsingMockAWS):
         response = self.client.get(f"/v1/area/{area_uuid}/bogofile")
         self.assertEqual(404, response.status_code)
 
+    def test_list_files__with_page_size__returns_a_page_of_files(self):
+        area_uuid = self._create_area()
+        for filename in ['file1.json', 'file2.json', 'file3.json']:
+            self.mock_upload_file_to_s3(area_uuid, filename)
+
+        response = self.client.get(f"/v1/area/{area_uuid}?page_size=2&start_after=file1.json")
+
+        self.assertEqual(200, response.status_code)
+        data = json.loads(response.data)
+        self.assertEqual(['file2.json', 'file3.json'], [file['name'] for file in data['files']])
+
     def test_files_info__for_existing_files__returns_files_info(self):
         area_uuid = self._create_area()
         o1 = self.mock_upload_file_to_s3(area_uuid, 'file1.json',
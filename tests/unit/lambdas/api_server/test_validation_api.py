@@ -6,7 +6,7 @@ import urllib.parse
 from upload.common.upload_area import UploadArea
 from upload.common.uploaded_file import UploadedFile
 from upload.common.validation_event import ValidationEvent
-from upload.common.validation_scheduler import MAX_FILE_SIZE_IN_BYTES
+from upload.common.validation_scheduler import ValidationScheduler, MAX_FILE_SIZE_IN_BYTES
 from upload.common.database import UploadDB
 from upload.common.upload_config import UploadConfig
 
@@ -309,3 +309,37 @@ class TestValidationApi(UploadTestCaseUsingMockAWS):
         validation_record = UploadDB().get_pg_record("validation", validation_id)
         self.assertEqual(validation_record['status'], "SCHEDULING_QUEUED")
         self.assertEqual(validation_record['original_validation_id'], "123456")
+
+    @patch('upload.lambdas.api_server.v1.area.ValidationScheduler.add_to_validation_sqs')
+    @patch('upload.lambdas.api_server.v1.area.IngestNotifier.format_and_send_notification')
+    def test_schedule_file_validation__when_same_content_was_validated_by_same_image__reuses_results(
+            self, mock_format_and_send_notification, mock_add_to_validation_sqs):
+        image = "humancellatlas/upload-validator-example@sha256:0123456789abcdef"
+        area_id = self._create_area()
+        s3obj = self.mock_upload_file_to_s3(area_id, 'foo.json')
+        uploaded_file = UploadedFile(UploadArea(area_id), s3object=s3obj)
+        cache_key = ValidationScheduler(area_id, [uploaded_file]).cache_key(image, {})
+        previous_validation = ValidationEvent(file_ids=[uploaded_file.db_id],
+                                              validation_id=str(uuid.uuid4()),
+                                              job_id='12345',
+                                              status="VALIDATED",
+                                              docker_image=image,
+                                              cache_key=cache_key)
+        previous_validation.results = {'status': 'completed', 'exit_code': 0, 'stdout': "valid"}
+        previous_validation.create_record()
+
+        response = self.client.put(
+            f"/v1/area/{area_id}/foo.json/validate",
+            headers=self.authentication_header,
+            json={"validator_image": image}
+        )
+
+        self.assertEqual(200, response.status_code)
+        mock_add_to_validation_sqs.assert_not_called()
+        validation_id = response.get_json()['validation_id']
+        expected_results = {'status': 'completed', 'exit_code': 0, 'stdout': "valid", 'validation_id': validation_id,
+                            'upload_area_id': area_id, 'names': ['foo.json']}
+        mock_format_and_send_notification.assert_called_once_with(expected_results)
+        record = UploadDB().get_pg_record("validation", validation_id)
+        self.assertEqual("VALIDATED", record["status"])
+        self.assertEqual(expected_results, record["results"])
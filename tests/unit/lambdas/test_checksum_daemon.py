@@ -1,5 +1,9 @@
+import copy
+import hashlib
+import json
 import os
 import sys
+import time
 import uuid
 from unittest.mock import Mock, patch
 
@@ -7,6 +11,8 @@ import boto3
 from sqlalchemy.orm.exc import NoResultFound
 
 from upload.common.database_orm import DBSessionMaker, DbFile, DbChecksum
+from upload.common.dss_checksums import DssChecksums
+from upload.common.exceptions import ChecksumDeadlineExceeded
 from upload.common.upload_area import UploadArea
 from .. import UploadTestCaseUsingMockAWS, EnvironmentSetup
 from ... import FixtureFile
@@ -43,6 +49,8 @@ class ChecksumDaemonTest(UploadTestCaseUsingMockAWS):
         self.upload_area.update_or_create()
         # daemon
         context = Mock()
+        context.get_remaining_time_in_millis.return_value = 900 * 1000
+        context.memory_limit_in_mb = 1500
         self.daemon = ChecksumDaemon(context)
         # File
         self.small_file = FixtureFile.factory('foo')
@@ -70,6 +78,10 @@ class ChecksumDaemonTest(UploadTestCaseUsingMockAWS):
         self.db_session_maker = DBSessionMaker()
         self.db = self.db_session_maker.session()
 
+    def tearDown(self):
+        self.db.close()
+        super().tearDown()
+
 
 class TestChecksumDaemonSeeingS3ObjectsForTheFirstTime(ChecksumDaemonTest):
     """
@@ -190,3 +202,234 @@ class TestChecksumDaemonSeeingS3ObjectsForWhichAFileRecordAlreadyExists(Checksum
             'url': f"s3://{self.upload_config.bucket_name}/{self.area_uuid}/{self.small_file.name}",
             'checksums': self.small_file.checksums
         })
+
+
+class TestChecksumDaemonConsumingABatchOfSqsMessages(ChecksumDaemonTest):
+
+    def _sqs_record(self, message_id, file_key):
+        events = copy.deepcopy(self.events)
+        events['Records'][0]['s3']['object']['key'] = file_key
+        return {'messageId': message_id, 'receiptHandle': f"{message_id}-handle", 'body': json.dumps(events)}
+
+    @patch('upload.lambdas.checksum_daemon.checksum_daemon.IngestNotifier.format_and_send_notification')
+    def test_when_all_messages_succeed__all_files_are_processed(self, mock_fasn):
+        self.upload_bucket.Object(f"{self.area_uuid}/bar").put(Body="bar", ContentType=self.small_file.content_type)
+        records = [self._sqs_record('msg1', self.file_key), self._sqs_record('msg2', f"{self.area_uuid}/bar")]
+
+        response = self.daemon.consume_sqs_records(records)
+
+        self.assertEqual(2, mock_fasn.call_count)
+        self.assertEqual({'batchItemFailures': []}, response)
+
+    @patch('upload.lambdas.checksum_daemon.checksum_daemon.IngestNotifier.format_and_send_notification')
+    def test_when_a_message_fails__only_it_is_reported_as_a_batch_item_failure(self, mock_fasn):
+        records = [self._sqs_record('msg1', self.file_key), self._sqs_record('msg2', f"{self.area_uuid}/missing")]
+
+        response = self.daemon.consume_sqs_records(records)
+
+        mock_fasn.assert_called_once()
+        self.assertEqual({'batchItemFailures': [{'itemIdentifier': 'msg2'}]}, response)
+
+    def test_messages_are_processed_no_more_at_once_than_there_is_memory_for(self):
+        self.assertEqual(7, self.daemon._max_workers(10))  # (1500MB - 256MB) / 160MB
+        self.assertEqual(2, self.daemon._max_workers(2))
+
+        self.daemon.context.memory_limit_in_mb = 256
+
+        self.assertEqual(1, self.daemon._max_workers(10))
+
+
+class TestChecksumDaemonWaitingForDcpTypeInContentType(ChecksumDaemonTest):
+
+    def setUp(self):
+        super().setUp()
+        self.object.put(Key=self.file_key, Body=self.small_file.contents, ContentType='application/octet-stream',
+                        Metadata={'crc32c': self.small_file.crc32c})
+
+    @patch('upload.lambdas.checksum_daemon.checksum_daemon.sqs.send_message')
+    @patch('upload.lambdas.checksum_daemon.checksum_daemon.IngestNotifier.format_and_send_notification')
+    def test_without_dcp_type_in_content_type__event_is_requeued_with_delay(self, mock_fasn, mock_send_message):
+        self.daemon.consume_events(self.events)
+
+        mock_fasn.assert_not_called()
+        mock_send_message.assert_called_once_with(
+            QueueUrl=self.upload_config.csum_upload_q_url,
+            MessageBody=json.dumps({'Records': self.events['Records'], 'content_type_checks': 1}),
+            DelaySeconds=ChecksumDaemon.CHECK_CONTENT_TYPE_INTERVAL)
+
+    @patch('upload.lambdas.checksum_daemon.checksum_daemon.sqs.send_message')
+    @patch('upload.lambdas.checksum_daemon.checksum_daemon.IngestNotifier.format_and_send_notification')
+    def test_after_enough_content_type_checks__ingest_is_notified_anyway(self, mock_fasn, mock_send_message):
+        events = {**self.events, 'content_type_checks': ChecksumDaemon.CHECK_CONTENT_TYPE_TIMES}
+
+        self.daemon.consume_events(events)
+
+        mock_send_message.assert_not_called()
+        mock_fasn.assert_called_once()
+
+
+class TestChecksumDaemonSeeingContentItHasChecksummedBefore(ChecksumDaemonTest):
+    """
+    Scenario: the same content is uploaded again under another name
+    """
+
+    def setUp(self):
+        super().setUp()
+        with patch('upload.lambdas.checksum_daemon.checksum_daemon.IngestNotifier.format_and_send_notification'):
+            self.daemon.consume_events(self.events)
+        self.copy_key = f"{self.area_uuid}/copy_of_{self.small_file.name}"
+        self.upload_bucket.Object(self.copy_key).put(Body=self.small_file.contents,
+                                                     ContentType=self.small_file.content_type)
+        self.copy_events = copy.deepcopy(self.events)
+        self.copy_events['Records'][0]['s3']['object']['key'] = self.copy_key
+
+    @patch('upload.lambdas.checksum_daemon.checksum_daemon.DssChecksums.compute')
+    @patch('upload.lambdas.checksum_daemon.checksum_daemon.IngestNotifier.format_and_send_notification')
+    def test_cached_checksums_are_used_instead_of_computing_them(self, mock_fasn, mock_compute):
+        self.daemon.consume_events(self.copy_events)
+
+        mock_compute.assert_not_called()
+        file_record = self.db.query(DbFile).filter(DbFile.s3_key == self.copy_key).one()
+        self.assertEqual(self.small_file.checksums, file_record.checksums)
+        tagging = boto3.client('s3').get_object_tagging(Bucket=self.upload_config.bucket_name, Key=self.copy_key)
+        self.assertEqual(self.small_file.s3_tagset, sorted(tagging['TagSet'], key=lambda x: x['Key']))
+        checksum_record = self.db.query(DbChecksum).filter(DbChecksum.file_id == file_record.id).one()
+        self.assertEqual("CHECKSUMMED", checksum_record.status)
+        mock_fasn.assert_called_once()
+
+    @patch('upload.lambdas.checksum_daemon.checksum_daemon.ChecksumDaemon._file_is_small_enough_to_checksum_inline',
+           Mock(return_value=False))
+    @patch('upload.lambdas.checksum_daemon.checksum_daemon.ChecksumDaemon._enqueue_batch_job')
+    @patch('upload.lambdas.checksum_daemon.checksum_daemon.IngestNotifier.format_and_send_notification')
+    def test_a_large_copy_of_checksummed_content_is_not_sent_to_batch(self, mock_fasn, mock_enqueue_batch_job):
+        self.copy_events['Records'][0]['eventName'] = 'ObjectCreated:Copy'
+
+        self.daemon.consume_events(self.copy_events)
+
+        mock_enqueue_batch_job.assert_not_called()
+        file_record = self.db.query(DbFile).filter(DbFile.s3_key == self.copy_key).one()
+        self.assertEqual(self.small_file.checksums, file_record.checksums)
+
+
+class TestChecksumDaemonPackingChecksumJobs(ChecksumDaemonTest):
+
+    def _sqs_record(self, message_id, file_key):
+        events = copy.deepcopy(self.events)
+        events['Records'][0]['s3']['object']['key'] = file_key
+        return {'messageId': message_id, 'receiptHandle': f"{message_id}-handle", 'body': json.dumps(events)}
+
+    def test_pack_checksum_jobs__fills_jobs_up_to_their_byte_and_file_limits(self):
+        def file_of_size(size):
+            return Mock(size=size)
+        max_bytes = ChecksumDaemon.MAX_BYTES_PER_CHECKSUM_JOB
+        sizes = (max_bytes * 2, max_bytes // 2, max_bytes // 3, max_bytes // 10)
+        huge, big, medium, small = [file_of_size(size) for size in sizes]
+
+        jobs = self.daemon._pack_checksum_jobs([small, medium, huge, big])
+
+        self.assertEqual([[huge], [big, medium, small]], jobs)
+
+        many_small_files = [file_of_size(1) for _ in range(ChecksumDaemon.MAX_FILES_PER_CHECKSUM_JOB + 1)]
+        jobs = self.daemon._pack_checksum_jobs(many_small_files)
+
+        self.assertEqual([ChecksumDaemon.MAX_FILES_PER_CHECKSUM_JOB, 1], [len(job) for job in jobs])
+
+    @patch('upload.common.upload_area.UploadedFile.size', 20 * 1024 * 1024 * 1024)
+    @patch('upload.lambdas.checksum_daemon.checksum_daemon.ChecksumDaemon._enqueue_batch_job')
+    def test_large_files_from_a_batch_of_messages_are_checksummed_by_one_job(self, mock_enqueue_batch_job):
+        mock_enqueue_batch_job.return_value = "fake-batch-job-id"
+        other_file_key = f"{self.area_uuid}/bar"
+        self.upload_bucket.Object(other_file_key).put(Body="bar", ContentType=self.small_file.content_type)
+        records = [self._sqs_record('msg1', self.file_key), self._sqs_record('msg2', other_file_key)]
+
+        response = self.daemon.consume_sqs_records(records)
+
+        mock_enqueue_batch_job.assert_called_once()
+        command = mock_enqueue_batch_job.call_args[1]['command']
+        self.assertEqual(['python', '/checksummer.py', '--manifest'], command[:3])
+        manifest = json.loads(command[3])
+        self.assertEqual(sorted([f"s3://{self.upload_config.bucket_name}/{self.file_key}",
+                                 f"s3://{self.upload_config.bucket_name}/{other_file_key}"]),
+                         sorted(entry['s3_url'] for entry in manifest))
+        for entry in manifest:
+            checksum_record = self.db.query(DbChecksum).filter(DbChecksum.id == entry['checksum_id']).one()
+            self.assertEqual("SCHEDULED", checksum_record.status)
+            self.assertEqual("fake-batch-job-id", checksum_record.job_id)
+        self.assertEqual({'batchItemFailures': []}, response)
+
+
+class TestChecksumDaemonChoosingBetweenInlineAndBatchChecksumming(ChecksumDaemonTest):
+    """
+    Scenario: recent inline checksums tell us how fast we can checksum in the time the lambda has left
+    """
+
+    GB = 1024 * 1024 * 1024
+
+    @patch('upload.common.upload_area.UploadedFile.size', 20 * 1024 * 1024 * 1024)
+    @patch('upload.lambdas.checksum_daemon.checksum_daemon.ChecksumDaemon._recent_inline_throughput')
+    def test_without_a_throughput_estimate__the_size_limit_is_used(self, mock_throughput):
+        mock_throughput.return_value = None
+        uploaded_file = self.upload_area.uploaded_file(self.small_file.name)
+
+        self.assertFalse(self.daemon._file_is_small_enough_to_checksum_inline(uploaded_file))
+
+    @patch('upload.common.upload_area.UploadedFile.size', 20 * 1024 * 1024 * 1024)
+    @patch('upload.lambdas.checksum_daemon.checksum_daemon.ChecksumDaemon._recent_inline_throughput')
+    def test_a_file_that_can_be_checksummed_in_the_time_left_is_checksummed_inline(self, mock_throughput):
+        mock_throughput.return_value = self.GB / 10  # 200 seconds for 20GB, with 900 left
+        uploaded_file = self.upload_area.uploaded_file(self.small_file.name)
+
+        self.assertTrue(self.daemon._file_is_small_enough_to_checksum_inline(uploaded_file))
+
+        self.daemon.context.get_remaining_time_in_millis.return_value = 300 * 1000
+
+        self.assertFalse(self.daemon._file_is_small_enough_to_checksum_inline(uploaded_file))
+
+    @patch('upload.lambdas.checksum_daemon.checksum_daemon.DssChecksums.compute')
+    @patch('upload.lambdas.checksum_daemon.checksum_daemon.ChecksumDaemon._enqueue_batch_job')
+    def test_when_inline_checksumming_runs_out_of_time__it_is_handed_to_batch(self, mock_enqueue_batch_job,
+                                                                              mock_compute):
+        mock_compute.side_effect = ChecksumDeadlineExceeded("checksumming foo ran out of time")
+        mock_enqueue_batch_job.return_value = "fake-batch-job-id"
+
+        self.daemon.consume_events(self.events)
+
+        mock_enqueue_batch_job.assert_called_once()
+        file_record = self.db.query(DbFile).filter(DbFile.s3_key == self.file_key,
+                                                   DbFile.s3_etag == self.small_file.e_tag).one()
+        statuses = sorted(record.status for record in
+                          self.db.query(DbChecksum).filter(DbChecksum.file_id == file_record.id))
+        self.assertEqual(["ABORTED", "SCHEDULED"], statuses)
+
+    @patch('upload.common.dss_checksums.get_s3_multipart_chunk_size', Mock(return_value=5))
+    @patch('upload.lambdas.checksum_daemon.checksum_daemon.ChecksumDaemon._enqueue_batch_job')
+    def test_when_inline_checksumming_runs_out_of_time__the_batch_job_resumes_where_it_left_off(
+            self, mock_enqueue_batch_job):
+        mock_enqueue_batch_job.return_value = "fake-batch-job-id"
+        contents = uuid.uuid4().hex[:20]  # parts start at 0, 5, 10 and 15
+        self.object.put(Body=contents, ContentType=self.small_file.content_type)
+        # Leave 0.5s to checksum in, but make the third part take longer than that to arrive.
+        self.daemon.context.get_remaining_time_in_millis.return_value = \
+            (ChecksumDaemon.INLINE_HANDOFF_MARGIN + 0.5) * 1000
+        checksum_part = DssChecksums.ChecksumComputer._checksum_part
+
+        def slow_third_part(computer, start, end, part_size, part_queue, aborted):
+            if start == 10:
+                time.sleep(1)
+            return checksum_part(computer, start, end, part_size, part_queue, aborted)
+
+        with patch.object(DssChecksums.ChecksumComputer, '_checksum_part', slow_third_part):
+            self.daemon.consume_events(self.events)
+
+        mock_enqueue_batch_job.assert_called_once()
+        command = mock_enqueue_batch_job.call_args[1]['command']
+        from upload.docker_images.checksummer.checksummer import Checksummer
+        with EnvironmentSetup({'AWS_BATCH_JOB_ID': '1', 'CHECKSUM_ID': str(uuid.uuid4())}), \
+                patch.object(Checksummer, '_update_checksum_event'), \
+                patch.object(DssChecksums.ChecksumComputer, '_checksum_part', autospec=True,
+                             side_effect=checksum_part) as mock_checksum_part:
+            checksummer = Checksummer(command[2:])
+
+        self.assertEqual([10, 15], [call[0][1] for call in mock_checksum_part.call_args_list])
+        self.assertEqual(hashlib.sha256(contents.encode()).hexdigest(), checksummer.checksums['sha256'])
+        self.assertEqual(hashlib.sha1(contents.encode()).hexdigest(), checksummer.checksums['sha1'])
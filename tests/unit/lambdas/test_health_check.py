@@ -7,6 +7,9 @@ from mock import patch, Mock
 
 from .. import UploadTestCaseUsingMockAWS
 
+from upload.common.database import UploadDB
+from upload.common.ingest_notifier import IngestNotifier
+from upload.common.upload_area import UploadArea
 from upload.lambdas.health_check.health_check import HealthCheck
 
 
@@ -364,6 +367,78 @@ class TestHealthCheckDaemon(UploadTestCaseUsingMockAWS):
         assert area_count == 1
         mock_run_query.assert_called_once_with("SELECT COUNT(*) FROM checksum ")
 
+    def test_reconcile_area_status_counts__corrects_drifted_counts(self):
+        db_area = self.create_upload_area()
+        upload_area = UploadArea(db_area.uuid)
+        self.mock_upload_file_to_s3(db_area.uuid, 'file1')
+        upload_area.uploaded_file('file1')
+        UploadDB().run_query_with_params("UPDATE area_status_counts SET file_count = 7 WHERE upload_area_id = %s;",
+                                         (db_area.id,))
+
+        drifted_area_count = self.health_check.reconcile_area_status_counts()
+
+        self.assertGreaterEqual(drifted_area_count, 1)
+        self.assertEqual(1, upload_area.retrieve_file_count_for_upload_area())
+
+    def test_requeue_stale_notifications__queues_notifications_left_delivering(self):
+        db_area = self.create_upload_area()
+        upload_area = UploadArea(db_area.uuid)
+        uploaded_file = upload_area.store_file("file1", "file1_content", "application/json; dcp-type=data")
+        notifier = IngestNotifier("file_validated", file_id=uploaded_file.db_id)
+        with patch.object(IngestNotifier, 'queue_for_delivery'):
+            stale_id = notifier.format_and_send_notification({'upload_area_id': db_area.uuid})
+            recent_id = notifier.format_and_send_notification({'upload_area_id': db_area.uuid})
+        UploadDB().run_query_with_params("UPDATE notification SET updated_at = %s WHERE id = %s",
+                                         (datetime.datetime.utcnow() - datetime.timedelta(hours=2), stale_id))
+
+        with patch.object(IngestNotifier, 'queue_for_delivery', autospec=True) as mock_queue_for_delivery:
+            self.health_check.requeue_stale_notifications()
+
+        queued = {args[1]: args[0] for args, _ in mock_queue_for_delivery.call_args_list}
+        self.assertIn(stale_id, queued)
+        self.assertNotIn(recent_id, queued)
+        self.assertEqual("file_validated", queued[stale_id].notification_type)
+        self.assertEqual(uploaded_file.db_id, queued[stale_id].file_id)
+
+    def _create_area_with_drifted_counts(self, counts_last_updated_at=None):
+        db_area = self.create_upload_area()
+        upload_area = UploadArea(db_area.uuid)
+        self.mock_upload_file_to_s3(db_area.uuid, 'file1')
+        upload_area.uploaded_file('file1')
+        UploadDB().run_query_with_params("UPDATE area_status_counts SET file_count = 7 WHERE upload_area_id = %s;",
+                                         (db_area.id,))
+        if counts_last_updated_at:
+            UploadDB().run_query_with_params(
+                "UPDATE area_status_counts SET updated_at = %s WHERE upload_area_id = %s;",
+                (counts_last_updated_at, db_area.id))
+        return upload_area
+
+    def test_reconcile_area_status_counts__skips_areas_whose_counts_have_not_changed_recently(self):
+        upload_area = self._create_area_with_drifted_counts(
+            counts_last_updated_at=datetime.datetime.utcnow() - datetime.timedelta(days=30))
+
+        self.health_check.reconcile_area_status_counts()
+
+        self.assertEqual(7, upload_area.retrieve_file_count_for_upload_area())
+
+    def test_reconcile_area_status_counts__reconciles_negative_counts_however_old(self):
+        upload_area = self._create_area_with_drifted_counts(
+            counts_last_updated_at=datetime.datetime.utcnow() - datetime.timedelta(days=30))
+        UploadDB().run_query_with_params("UPDATE area_status_counts SET file_count = -1 WHERE upload_area_id = %s;",
+                                         (upload_area.db_id,))
+
+        self.health_check.reconcile_area_status_counts()
+
+        self.assertEqual(1, upload_area.retrieve_file_count_for_upload_area())
+
+    def test_reconcile_area_status_counts__when_out_of_time__stops(self):
+        upload_area = self._create_area_with_drifted_counts()
+
+        self.health_check.reconcile_area_status_counts(
+            get_remaining_time_in_millis=lambda: HealthCheck.RECONCILIATION_TIME_MARGIN * 1000 - 1)
+
+        self.assertEqual(7, upload_area.retrieve_file_count_for_upload_area())
+
 
 class MockIt:
     def fetchall(self):
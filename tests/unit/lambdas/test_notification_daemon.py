@@ -0,0 +1,77 @@
+import json
+import uuid
+from unittest.mock import Mock, patch
+
+from upload.common.database import UploadDB
+from upload.common.ingest_notifier import IngestNotifier
+from upload.common.upload_area import UploadArea
+from upload.lambdas.notification_daemon import NotificationDaemon
+from upload.lambdas.notification_daemon.notification_daemon import _notifier
+from .. import UploadTestCaseUsingMockAWS
+
+
+class TestNotificationDaemon(UploadTestCaseUsingMockAWS):
+
+    def setUp(self):
+        super().setUp()
+        self.area_uuid = str(uuid.uuid4())
+        upload_area = UploadArea(self.area_uuid)
+        upload_area.update_or_create()
+        self.file = upload_area.store_file("test_file_name", "test_file_content", "application/json; dcp-type=data")
+        self.daemon = NotificationDaemon(Mock())
+        self.daemon.BACKOFF_BASE = 0
+        _notifier.cache_clear()
+
+    def _queue_notification(self):
+        notifier = IngestNotifier("file_uploaded", file_id=self.file.db_id)
+        notification_id = notifier.format_and_send_notification({'upload_area_id': self.area_uuid})
+        body = json.dumps({'notification_id': notification_id, 'notification_type': "file_uploaded"})
+        return notification_id, {'messageId': notification_id, 'body': body}
+
+    def _status(self, notification_id):
+        return UploadDB().get_pg_record("notification", notification_id)['status']
+
+    @patch('upload.lambdas.notification_daemon.notification_daemon.IngestNotifier.send_notification')
+    def test_consume_sqs_records__marks_sent_notifications_delivered(self, mock_send_notification):
+        mock_send_notification.return_value = True
+        notification1_id, record1 = self._queue_notification()
+        notification2_id, record2 = self._queue_notification()
+
+        self.daemon.consume_sqs_records([record1, record2])
+
+        self.assertEqual(2, mock_send_notification.call_count)
+        self.assertEqual("DELIVERED", self._status(notification1_id))
+        self.assertEqual("DELIVERED", self._status(notification2_id))
+
+    @patch('upload.lambdas.notification_daemon.notification_daemon.IngestNotifier.send_notification')
+    def test_consume_sqs_records__retries_then_marks_undeliverable_notifications_failed(self, mock_send_notif):
+        mock_send_notif.return_value = None
+        notification_id, record = self._queue_notification()
+
+        self.daemon.consume_sqs_records([record])
+
+        self.assertEqual(NotificationDaemon.DELIVERY_ATTEMPTS, mock_send_notif.call_count)
+        self.assertEqual("FAILED", self._status(notification_id))
+
+    @patch('upload.lambdas.notification_daemon.notification_daemon.IngestNotifier.send_notification')
+    def test_consume_sqs_records__skips_notifications_that_were_already_delivered(self, mock_send_notification):
+        mock_send_notification.return_value = True
+        notification_id, record = self._queue_notification()
+        self.daemon.consume_sqs_records([record])
+
+        self.daemon.consume_sqs_records([record])
+
+        self.assertEqual(1, mock_send_notification.call_count)
+
+    @patch('upload.lambdas.notification_daemon.notification_daemon.IngestNotifier.send_notification')
+    def test_consume_sqs_records__reuses_one_notifier_per_notification_type(self, mock_send_notification):
+        mock_send_notification.return_value = True
+        records = [self._queue_notification()[1] for _ in range(3)]
+
+        with patch('upload.lambdas.notification_daemon.notification_daemon.IngestNotifier.__init__',
+                   return_value=None) as mock_init:
+            self.daemon.consume_sqs_records(records)
+
+        self.assertEqual(3, mock_send_notification.call_count)
+        self.assertEqual(1, mock_init.call_count)
+        _notifier.cache_clear()
@@ -1,8 +1,10 @@
 import hashlib
 import json
 import os
+import re
 
 import boto3
+from botocore.exceptions import ClientError
 
 from .retry import retry_on_aws_too_many_requests
 
@@ -11,6 +13,9 @@ batch = boto3.client('batch')
 
 class JobDefinition:
 
+    # ARNs of the job definitions we have found or created, by job definition name, for the life of the process.
+    _arn_cache = {}
+
     @classmethod
     def clear_all(cls):
         deleted_count = 0
@@ -26,18 +31,46 @@ class JobDefinition:
         self.metadata = metadata
         self.docker_image = docker_image if docker_image else metadata['containerProperties']['image']
         self.name = self._job_definition_name() if docker_image else metadata['jobDefinitionName']
+        self.arn = arn
         if not arn:
             if metadata:
                 self.arn = metadata['jobDefinitionArn']
         print(f"Job definition {self.name} for {self.docker_image}:")
 
     def find_or_create(self, job_role_arn):
-        if self.load():
+        if self.name in self._arn_cache:
+            self.arn = self._arn_cache[self.name]
+        elif self.load():
             print(f"\tfound {self.arn}")
         else:
             self.create(job_role_arn)
+        self._arn_cache[self.name] = self.arn
         return self
 
+    def forget(self):
+        """ Remove this job definition from the cache, so the next find_or_create() looks it up again. """
+        self._arn_cache.pop(self.name, None)
+
+    def submit_job(self, job_role_arn, **submit_job_args):
+        """
+        Submit a job that uses this job definition.  If Batch no longer recognizes the job definition
+        (e.g. it has been deregistered since we cached it), find or create it again and resubmit.
+        """
+        try:
+            return batch.submit_job(jobDefinition=self.arn, **submit_job_args)
+        except ClientError as e:
+            if not self._is_unknown_job_definition_error(e):
+                raise e
+            print(f"Job definition {self.arn} is not usable, looking it up again: {e}")
+            self.forget()
+            self.find_or_create(job_role_arn)
+            return batch.submit_job(jobDefinition=self.arn, **submit_job_args)
+
+    @staticmethod
+    def _is_unknown_job_definition_error(error):
+        return error.response['Error']['Code'] == 'ClientException' and \
+            re.search("job ?definition", error.response['Error'].get('Message', ''), re.IGNORECASE) is not None
+
     def load(self):
         jobdefs = self._describe_job_definitions(jobDefinitionName=self.name, status='ACTIVE')['jobDefinitions']
         if len(jobdefs) > 0:
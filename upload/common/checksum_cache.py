@@ -0,0 +1,49 @@
+import json
+import os
+
+from dcplib.s3_multipart import get_s3_multipart_chunk_size
+
+from .logging import get_logger
+if not os.environ.get("CONTAINER"):
+    from .database import UploadDB
+
+logger = get_logger(__name__)
+
+
+class ChecksumCache:
+    """
+    The checksums of content we have checksummed before, keyed by S3 ETag, size and multipart part size,
+    so that the same content uploaded again (to any upload area) doesn't have to be downloaded and checksummed again.
+
+    Only checksums we computed ourselves should be stored, never ones read from tags, which anyone who can
+    write to an upload area can set.  Even so they are only cached if their own s3_etag matches the object's ETag,
+    i.e. they were demonstrably computed from this content.  That s3_etag is computed for parts of
+    get_s3_multipart_chunk_size(), so that is the part size of any multipart object whose checksums we cache.
+    """
+
+    @classmethod
+    def lookup(cls, uploaded_file):
+        """
+        :return: the cached checksums of this file's content, or None
+        """
+        query_result = UploadDB().run_query_with_params(
+            "SELECT checksums FROM checksum_cache WHERE s3_etag = %s AND size = %s AND part_size = %s;",
+            (uploaded_file.s3_etag, uploaded_file.size, cls._part_size(uploaded_file)))
+        row = query_result.fetchone()
+        return row[0] if row else None
+
+    @classmethod
+    def store(cls, uploaded_file, checksums):
+        if checksums.get('s3_etag') != uploaded_file.s3_etag:
+            logger.debug(f"Not caching checksums of {uploaded_file.s3_key}: their s3_etag is not the object's")
+            return
+        UploadDB().run_query_with_params(
+            "INSERT INTO checksum_cache (s3_etag, size, part_size, checksums) VALUES (%s, %s, %s, %s::jsonb) "
+            "ON CONFLICT DO NOTHING;",
+            (uploaded_file.s3_etag, uploaded_file.size, cls._part_size(uploaded_file), json.dumps(dict(checksums))))
+
+    @staticmethod
+    def _part_size(uploaded_file):
+        if '-' not in uploaded_file.s3_etag:
+            return 0
+        return get_s3_multipart_chunk_size(uploaded_file.size)
@@ -0,0 +1,77 @@
+import base64
+import json
+import platform
+
+from botocore.exceptions import ClientError
+
+from .logging import get_logger
+from .resumable_hash import ResumableHash
+
+logger = get_logger(__name__)
+
+
+class ChecksumCheckpoint:
+    """
+    How far checksumming an S3 object has got, saved to S3 so that when a checksummer dies part way through a huge
+    file (e.g. its Batch job's spot instance is reclaimed) the next attempt carries on from there.
+
+    A checkpoint is taken at the end of a part.  It holds the crc32c and MD5 of every part up to there, and the state
+    of the sha1 and sha256 hashers after them.  It lives in the upload bucket under KEY_PREFIX, outside any upload
+    area, and is only used if it was taken with the object's current ETag and the same part size, on the same
+    architecture (hasher states are native structs).  The checksum daemon saves one when it runs out of time to
+    checksum a file inline, for the Batch job it hands the file to.
+    """
+
+    KEY_PREFIX = "_checksum_checkpoints/"
+    HASH_FUNCTIONS = ('sha1', 'sha256')
+
+    @staticmethod
+    def is_supported():
+        return ResumableHash.is_available()
+
+    @classmethod
+    def new_hashers(cls):
+        return {name: ResumableHash(name) for name in cls.HASH_FUNCTIONS}
+
+    def __init__(self, s3obj):
+        self._s3obj = s3obj
+        self._s3client = s3obj.meta.client
+        self.key = f"{self.KEY_PREFIX}{s3obj.key}"
+
+    def load(self, part_size):
+        """
+        :return: (part_checksums, hashers) of the parts checksummed so far, or None if there is no usable checkpoint
+        """
+        try:
+            response = self._s3client.get_object(Bucket=self._s3obj.bucket_name, Key=self.key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+        checkpoint = json.loads(response['Body'].read())
+        if checkpoint['e_tag'] != self._s3obj.e_tag or checkpoint['part_size'] != part_size:
+            logger.info(f"Ignoring checkpoint {self.key}, it was taken for other contents or part size")
+            return None
+        if checkpoint.get('machine') != platform.machine():
+            logger.info(f"Ignoring checkpoint {self.key}, it was taken on a {checkpoint.get('machine')} machine")
+            return None
+        part_checksums = [{'crc32c': part['crc32c'], 'md5': bytes.fromhex(part['md5'])}
+                          for part in checkpoint['parts']]
+        hashers = {name: ResumableHash(name, state=base64.b64decode(state))
+                   for name, state in checkpoint['hashers'].items()}
+        logger.info(f"Resuming checksumming of {self._s3obj.key} after {len(part_checksums)} parts")
+        return part_checksums, hashers
+
+    def save(self, part_size, part_checksums, hashers):
+        checkpoint = {
+            'e_tag': self._s3obj.e_tag,
+            'part_size': part_size,
+            'machine': platform.machine(),
+            'parts': [{'crc32c': part['crc32c'], 'md5': part['md5'].hex()} for part in part_checksums],
+            'hashers': {name: base64.b64encode(hasher.state()).decode('ascii') for name, hasher in hashers.items()}
+        }
+        self._s3client.put_object(Bucket=self._s3obj.bucket_name, Key=self.key, Body=json.dumps(checkpoint))
+        logger.info(f"Checkpointed checksumming of {self._s3obj.key} after {len(part_checksums)} parts")
+
+    def delete(self):
+        self._s3client.delete_object(Bucket=self._s3obj.bucket_name, Key=self.key)
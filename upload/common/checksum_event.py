@@ -20,11 +20,18 @@ class ChecksumEvent:
             status=prop_vals_dict['status']
         )
 
+    @classmethod
+    def create_records(cls, checksum_events):
+        """ Create records for many checksum events atomically, in one round trip """
+        if checksum_events:
+            UploadDB().create_pg_records([("checksum", [event._format_prop_vals_dict() for event in checksum_events])])
+
     def __init__(self, **kwargs):
         self.job_id = kwargs.get("job_id")
         self.id = kwargs["checksum_id"]
         self.file_id = kwargs.get("file_id")
         self.status = kwargs.get("status")
+        self.bytes_per_second = kwargs.get("bytes_per_second")
         if not os.environ.get('CONTAINER'):
             self.db = UploadDB()
 
@@ -40,6 +47,8 @@ class ChecksumEvent:
             vals_dict["checksum_started_at"] = datetime.utcnow()
         elif self.status == "CHECKSUMMED":
             vals_dict["checksum_ended_at"] = datetime.utcnow()
+        if self.bytes_per_second is not None:
+            vals_dict["bytes_per_second"] = self.bytes_per_second
 
         return vals_dict
 
@@ -0,0 +1,58 @@
+"""
+Combine CRC32C values of consecutive blocks of data without re-reading the data:
+
+    crc32c_combine(crc32c(a), crc32c(b), len(b)) == crc32c(a + b)
+
+This is zlib's crc32_combine() algorithm, using the (reflected) Castagnoli polynomial.
+It lets us checksum the parts of a file in parallel, then stitch the results together.
+"""
+
+CRC32C_POLYNOMIAL = 0x82F63B78
+
+
+def crc32c_combine(crc1, crc2, len2, polynomial=CRC32C_POLYNOMIAL):
+    """
+    :param crc1: CRC of the first block of data
+    :param crc2: CRC of the second block of data
+    :param len2: length in bytes of the second block of data
+    :return: CRC of the concatenation of the two blocks
+    """
+    if len2 <= 0:
+        return crc1
+
+    # Operator for one zero bit, then two zero bits, then four zero bits.
+    odd = [polynomial] + [1 << n for n in range(31)]
+    even = _gf2_matrix_square(odd)
+    odd = _gf2_matrix_square(even)
+
+    # Apply len2 zero bytes to crc1, squaring the operator for each bit of len2.
+    while True:
+        even = _gf2_matrix_square(odd)
+        if len2 & 1:
+            crc1 = _gf2_matrix_times(even, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+        odd = _gf2_matrix_square(even)
+        if len2 & 1:
+            crc1 = _gf2_matrix_times(odd, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+
+    return crc1 ^ crc2
+
+
+def _gf2_matrix_times(matrix, vector):
+    total = 0
+    row = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[row]
+        vector >>= 1
+        row += 1
+    return total
+
+
+def _gf2_matrix_square(matrix):
+    return [_gf2_matrix_times(matrix, matrix[n]) for n in range(32)]
@@ -1,33 +1,193 @@
+import os
 import re
+import threading
+import time
 from datetime import datetime
 
 import requests
-from sqlalchemy import create_engine, MetaData
-from sqlalchemy.exc import OperationalError, IntegrityError, DatabaseError
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, BigInteger, Float, String, DateTime, bindparam
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import OperationalError, InterfaceError, IntegrityError
+from sqlalchemy.pool import QueuePool
 
 from .exceptions import UploadException
 from .upload_config import UploadDbConfig
 
+# Static definitions of the tables created by the migrations in database/versions, so that we don't need to
+# reflect the schema (several catalog queries) every time a Lambda starts.  Keep these in sync with the migrations.
+# Status columns are Postgres enums, but are declared as strings here so new enum values need no change.
+
+metadata = MetaData()
+
+upload_area_table = Table(
+    'upload_area', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('uuid', String, nullable=False, unique=True),
+    Column('bucket_name', String, nullable=False),
+    Column('status', String, nullable=False),
+    Column('created_at', DateTime(timezone=True), nullable=False),
+    Column('updated_at', DateTime(timezone=True), nullable=False)
+)
+
+file_table = Table(
+    'file', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('s3_key', String, nullable=False),
+    Column('s3_etag', String, nullable=False),
+    Column('upload_area_id', Integer, nullable=False),
+    Column('name', String, nullable=False),
+    Column('size', BigInteger, nullable=False),
+    Column('checksums', postgresql.JSONB),
+    Column('content_type', String),
+    Column('created_at', DateTime(timezone=True), nullable=False),
+    Column('updated_at', DateTime(timezone=True), nullable=False)
+)
+
+checksum_table = Table(
+    'checksum', metadata,
+    Column('id', String, primary_key=True),
+    Column('file_id', Integer, nullable=False),
+    Column('job_id', String),
+    Column('status', String, nullable=False),
+    Column('checksum_started_at', DateTime(timezone=True)),
+    Column('checksum_ended_at', DateTime(timezone=True)),
+    Column('bytes_per_second', Float),
+    Column('created_at', DateTime(timezone=True), nullable=False),
+    Column('updated_at', DateTime(timezone=True), nullable=False)
+)
+
+notification_table = Table(
+    'notification', metadata,
+    Column('id', String, primary_key=True),
+    Column('file_id', Integer, nullable=False),
+    Column('status', String, nullable=False),
+    Column('payload', postgresql.JSONB, nullable=False),
+    Column('notification_type', String),
+    Column('created_at', DateTime(timezone=True), nullable=False),
+    Column('updated_at', DateTime(timezone=True), nullable=False)
+)
+
+validation_table = Table(
+    'validation', metadata,
+    Column('id', String, primary_key=True),
+    Column('job_id', String),
+    Column('status', String, nullable=False),
+    Column('results', postgresql.JSONB),
+    Column('validation_started_at', DateTime(timezone=True)),
+    Column('validation_ended_at', DateTime(timezone=True)),
+    Column('docker_image', String),
+    Column('original_validation_id', String),
+    Column('cache_key', String),
+    Column('created_at', DateTime(timezone=True), nullable=False),
+    Column('updated_at', DateTime(timezone=True), nullable=False)
+)
+
+validation_files_table = Table(
+    'validation_files', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('validation_id', String, nullable=False),
+    Column('file_id', Integer, nullable=False),
+    Column('created_at', DateTime(timezone=True), nullable=False),
+    Column('updated_at', DateTime(timezone=True), nullable=False)
+)
+
+# Maintained by triggers on file, checksum, validation and validation_files (see migration d71b1d26c164).
+area_status_counts_table = Table(
+    'area_status_counts', metadata,
+    Column('upload_area_id', Integer, primary_key=True),
+    Column('file_count', Integer, nullable=False),
+    Column('checksum_counts', postgresql.JSONB, nullable=False),
+    Column('validation_counts', postgresql.JSONB, nullable=False),
+    Column('updated_at', DateTime(timezone=True), nullable=False)
+)
+
+checksum_cache_table = Table(
+    'checksum_cache', metadata,
+    Column('s3_etag', String, primary_key=True),
+    Column('size', BigInteger, primary_key=True),
+    Column('part_size', BigInteger, primary_key=True),
+    Column('checksums', postgresql.JSONB, nullable=False),
+    Column('created_at', DateTime(timezone=True), nullable=False)
+)
+
+
+class MonitoredQueuePool(QueuePool):
+    """
+    A QueuePool that keeps count of checkouts and of how long callers waited for a connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _do_get(self):
+        start_time = time.time()
+        connection = super()._do_get()
+        wait_seconds = time.time() - start_time
+        with self._stats_lock:
+            self.checkouts += 1
+            self.total_wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+        return connection
+
+    def recreate(self):
+        new_pool = super().recreate()
+        new_pool.checkouts = self.checkouts
+        new_pool.total_wait_seconds = self.total_wait_seconds
+        new_pool.max_wait_seconds = self.max_wait_seconds
+        return new_pool
+
 
 class UploadDB:
+    """
+    All users of the database in a process, including DBSessionMaker's ORM sessions, share one engine and so
+    one connection pool.  The pool can be configured with these environment variables:
+
+        UPLOAD_DB_POOL_SIZE, UPLOAD_DB_MAX_OVERFLOW, UPLOAD_DB_POOL_RECYCLE (seconds), UPLOAD_DB_POOL_PRE_PING
+    """
+
+    POOL_SIZE = 5
+    MAX_OVERFLOW = 10
+    POOL_RECYCLE = 300  # seconds, shorter than pgbouncer's idle client timeout
+    POOL_PRE_PING = True
 
     _engine = None
-    _record_type_table_map = None
+    _engine_lock = threading.Lock()
+    _record_type_table_map = {table.name: table for table in metadata.sorted_tables}
 
     def __init__(self):
-        if self.__class__._record_type_table_map is None:
-            config = UploadDbConfig()
-            self.__class__._engine = create_engine(config.pgbouncer_uri, pool_size=1)
-            meta = MetaData(self.engine)
-            meta.reflect()
-            self.__class__._record_type_table_map = {
-                "upload_area": meta.tables['upload_area'],
-                "file": meta.tables['file'],
-                "notification": meta.tables['notification'],
-                "validation": meta.tables['validation'],
-                "checksum": meta.tables['checksum'],
-                "validation_files": meta.tables['validation_files']
-            }
+        if self.__class__._engine is None:
+            with self.__class__._engine_lock:
+                if self.__class__._engine is None:
+                    self.__class__._engine = self._create_engine()
+
+    @classmethod
+    def _create_engine(cls):
+        config = UploadDbConfig()
+        return create_engine(config.pgbouncer_uri,
+                             poolclass=MonitoredQueuePool,
+                             pool_size=int(os.environ.get('UPLOAD_DB_POOL_SIZE', cls.POOL_SIZE)),
+                             max_overflow=int(os.environ.get('UPLOAD_DB_MAX_OVERFLOW', cls.MAX_OVERFLOW)),
+                             pool_recycle=int(os.environ.get('UPLOAD_DB_POOL_RECYCLE', cls.POOL_RECYCLE)),
+                             pool_pre_ping=os.environ.get('UPLOAD_DB_POOL_PRE_PING',
+                                                          str(cls.POOL_PRE_PING)).lower() == 'true')
+
+    def pool_stats(self):
+        """
+        :return: dict of connection pool statistics, for monitoring
+        """
+        pool = self.engine.pool
+        return {
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+            'checkouts': pool.checkouts,
+            'total_wait_seconds': pool.total_wait_seconds,
+            'max_wait_seconds': pool.max_wait_seconds
+        }
 
     @property
     def engine(self):
@@ -56,6 +216,74 @@ class UploadDB:
             else:
                 raise e
 
+    def create_pg_records(self, records_by_type):
+        """
+        Insert many records, into one or more tables, atomically with one multi-row INSERT per table.
+        Tables are written in the order given, so list parent records before the records that reference them.
+
+        :param records_by_type: list of (record_type, list of prop_vals_dicts) tuples
+        """
+        now = datetime.utcnow()
+
+        def insert_records(connection):
+            for record_type, prop_vals_dicts in records_by_type:
+                if prop_vals_dicts:
+                    rows = [{**prop_vals_dict, "created_at": now, "updated_at": now}
+                            for prop_vals_dict in prop_vals_dicts]
+                    connection.execute(self.table(table_name=record_type).insert().values(rows))
+        try:
+            self.run_in_transaction(insert_records)
+        except IntegrityError as e:
+            if re.search("duplicate key value violates unique constraint", e.orig.pgerror):
+                raise UploadException(status=requests.codes.conflict,
+                                      title="Record Already Exists",
+                                      detail=e.orig.pgerror)
+            else:
+                raise e
+
+    def update_pg_records(self, record_type, prop_vals_dicts, column='id'):
+        """
+        Update many records atomically.  Records that set the same columns are updated with one executemany.
+        """
+        now = datetime.utcnow()
+        table = self.table(table_name=record_type)
+        updates_by_columns = {}
+        for prop_vals_dict in prop_vals_dicts:
+            params = {f"_{key}": value for key, value in prop_vals_dict.items()}
+            params["_updated_at"] = now
+            updates_by_columns.setdefault(tuple(sorted(params.keys())), []).append(params)
+
+        def update_records(connection):
+            for param_names, params_list in updates_by_columns.items():
+                update = table.update() \
+                    .where(table.columns[column] == bindparam(f"_{column}")) \
+                    .values({name[1:]: bindparam(name) for name in param_names if name != f"_{column}"})
+                connection.execute(update, params_list)
+        self.run_in_transaction(update_records)
+
+    def find_or_create_pg_records(self, record_type, prop_vals_dicts, unique_columns, refresh_columns=()):
+        """
+        Create records, or find the existing records that match them on unique_columns, in a single statement.
+        Existing records are left unchanged, except that their refresh_columns are set to the values given.
+        Records in prop_vals_dicts must not share unique_columns values.
+
+        :return: list of dicts, one per record found or created, in no particular order
+        """
+        if not prop_vals_dicts:
+            return []
+        now = datetime.utcnow()
+        table = self.table(table_name=record_type)
+        upsert = postgresql.insert(table).values([{**prop_vals_dict, "created_at": now, "updated_at": now}
+                                                  for prop_vals_dict in prop_vals_dicts])
+        # ON CONFLICT DO NOTHING would not return existing records, so do an update that changes nothing
+        # (but refresh_columns).
+        upsert = upsert.on_conflict_do_update(index_elements=unique_columns,
+                                              set_={column: upsert.excluded[column]
+                                                    for column in [*unique_columns, *refresh_columns]})
+        result = self.run_query(upsert.returning(*table.columns))
+        column_keys = result.keys()
+        return [dict(zip(column_keys, row)) for row in result.fetchall()]
+
     def update_pg_record(self, record_type, prop_vals_dict, column='id'):
         record_id = prop_vals_dict[column]
         del prop_vals_dict[column]
@@ -107,11 +335,13 @@ class UploadDB:
     # a long idle timeout. Sometimes its difficult to determine how long AWS actually
     # keeps old lambda containers warmed up and waiting. This code path should not be
     # followed often, but it is a good protective measure.
+    # Only connection errors are retried.  Others, e.g. IntegrityError, would fail again, and disposing of the
+    # engine would close every connection in the process's shared pool.
 
     def run_query(self, query):
         try:
             results = self.engine.execute(query)
-        except (OperationalError, DatabaseError) as e:
+        except (OperationalError, InterfaceError):
             self.engine.dispose()
             results = self.engine.execute(query)
         return results
@@ -119,7 +349,19 @@ class UploadDB:
     def run_query_with_params(self, query, params):
         try:
             results = self.engine.execute(query, params)
-        except (OperationalError, DatabaseError) as e:
+        except (OperationalError, InterfaceError):
             self.engine.dispose()
             results = self.engine.execute(query, params)
         return results
+
+    def run_in_transaction(self, func):
+        """
+        Call func(connection) inside a transaction, which is committed if func returns and rolled back if it raises.
+        """
+        try:
+            with self.engine.begin() as connection:
+                return func(connection)
+        except (OperationalError, InterfaceError):
+            self.engine.dispose()
+            with self.engine.begin() as connection:
+                return func(connection)
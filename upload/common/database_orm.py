@@ -1,10 +1,10 @@
 from datetime import datetime
 
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, Float, String, DateTime, ForeignKey, JSON
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 
-from upload.common.upload_config import UploadDbConfig
+from upload.common.database import UploadDB
 
 
 Base = declarative_base()
@@ -29,6 +29,7 @@ class DbFile(Base):
     name = Column(String(), nullable=False)
     size = Column(Integer(), nullable=False)
     checksums = Column(JSON(), nullable=False)
+    content_type = Column(String(), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, nullable=False, onupdate=datetime.utcnow)
 
@@ -43,6 +44,7 @@ class DbChecksum(Base):
     status = Column(String(), nullable=False)
     checksum_started_at = Column(DateTime(), nullable=False)
     checksum_ended_at = Column(DateTime(), nullable=False)
+    bytes_per_second = Column(Float(), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, nullable=False, onupdate=datetime.utcnow)
 
@@ -57,6 +59,7 @@ class DbValidation(Base):
     results = Column(String(), nullable=False)
     validation_started_at = Column(DateTime(), nullable=False)
     validation_ended_at = Column(DateTime(), nullable=False)
+    cache_key = Column(String(), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, nullable=False, onupdate=datetime.utcnow)
 
@@ -67,6 +70,7 @@ class DbNotification(Base):
     file_id = Column(String(), ForeignKey('file.id'), nullable=False)
     status = Column(String(), nullable=False)
     payload = Column(JSON(), nullable=False)
+    notification_type = Column(String(), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, nullable=False, onupdate=datetime.utcnow)
 
@@ -86,7 +90,8 @@ DbFile.notifications = relationship('DbNotification',
 class DBSessionMaker:
 
     def __init__(self):
-        engine = create_engine(UploadDbConfig().database_uri)
+        # Share UploadDB's engine, so the ORM and Core use the same connection pool.
+        engine = UploadDB().engine
         Base.metadata.bind = engine
         self.session_maker = sessionmaker()
         self.session_maker.bind = engine
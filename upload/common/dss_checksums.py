@@ -1,20 +1,30 @@
 import collections.abc
+import hashlib
+import queue
+import threading
 import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from functools import reduce
 
-import boto3
-from boto3.s3.transfer import TransferConfig
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
 from dcplib.checksumming_io import ChecksummingSink
-from dcplib.s3_multipart import get_s3_multipart_chunk_size, MULTIPART_THRESHOLD
+from dcplib.s3_multipart import get_s3_multipart_chunk_size
 from tenacity import retry, wait_fixed, stop_after_attempt
+from urllib3.exceptions import ProtocolError
 
-from .exceptions import UploadException
+from .crc32c_combine import crc32c_combine
+from .exceptions import UploadException, ChecksumDeadlineExceeded
 from .logging import get_logger
 
 logger = get_logger(__name__)
 
 
+def _client_of(s3obj):
+    """ Use the S3 object's own client: clients are thread-safe, but creating them in many threads at once isn't. """
+    return s3obj.meta.client if s3obj is not None else None
+
+
 class DssChecksums(collections.abc.MutableMapping):
     """
     Encapsulates code for dealing with DSS checksums:
@@ -38,7 +48,6 @@ class DssChecksums(collections.abc.MutableMapping):
                  checksums=None  # only used during testing
                  ):
         self._s3obj = s3_object
-        self._s3client = boto3.client('s3')
         self._tagger = self.Tagger(s3_object)
         self._checksums = self._tagger.read_checksums_from_object() or checksums or {}
         self._validator = self.Validator(s3_object, self.CLIENTSIDE_CHECKSUM_NAMES)
@@ -67,11 +76,29 @@ class DssChecksums(collections.abc.MutableMapping):
     def are_present(self):
         return sorted(self.keys()) == sorted(self.CHECKSUM_NAMES)
 
-    def compute(self, report_progress=False):
+    def compute(self, report_progress=False, deadline=None, checkpoint=None):
+        """
+        :param deadline: time.time() by which to finish, else ChecksumDeadlineExceeded is raised
+        :param checkpoint: a ChecksumCheckpoint to resume from and periodically save progress to
+        """
         computer = self.ChecksumComputer(s3obj=self._s3obj)
-        self._checksums = computer.compute(report_progress)
+        self._checksums = computer.compute(report_progress, deadline=deadline, checkpoint=checkpoint)
         return self
 
+    @staticmethod
+    def compute_for_data(data):
+        """
+        Compute the checksums of data we are holding in memory, e.g. because we are about to upload it,
+        with one pass over it.  As in ChecksumComputer, s3_etag is that of an upload in parts of
+        get_s3_multipart_chunk_size(), which for data smaller than one part is the ETag of a single PUT.
+
+        :param data: bytes or a memoryview
+        """
+        with ChecksummingSink(get_s3_multipart_chunk_size(len(data)), hash_functions=DssChecksums.CHECKSUM_NAMES) \
+                as sink:
+            sink.write(data)
+            return sink.get_checksums()
+
     def save_as_tags_on_s3_object(self):
         self._validator.validate_clientside_checksum_against_serverside_checksum(self._checksums)
         self._tagger.save_tags(self)
@@ -82,7 +109,7 @@ class DssChecksums(collections.abc.MutableMapping):
 
         def __init__(self, s3obj, clientside_checksum_hash_functions):
             self._s3obj = s3obj
-            self._s3client = boto3.client('s3')
+            self._s3client = _client_of(s3obj)
             self._clientside_checksum_hash_functions = clientside_checksum_hash_functions
 
         @retry(reraise=True, wait=wait_fixed(2), stop=stop_after_attempt(3))
@@ -111,7 +138,7 @@ class DssChecksums(collections.abc.MutableMapping):
 
         def __init__(self, s3obj):
             self._s3obj = s3obj
-            self._s3client = boto3.client('s3')
+            self._s3client = _client_of(s3obj)
 
         def read_checksums_from_object(self):
             if not self._s3obj:
@@ -147,12 +174,23 @@ class DssChecksums(collections.abc.MutableMapping):
                                       title=f"Tags {tags} did not stick to {self._s3obj.key}",
                                       detail=f"tried to apply tags {tags}")
 
+        @classmethod
+        def checksums_from_tagset(cls, tags: list) -> dict:
+            # [ {'Key':'hca-dss-sha1', 'Value':'b'}, {'Key':'other', 'Value':'d'} ] -> { 'sha1':'b' }
+            return cls._cut_off_tag_prefix_for_dss_tags(cls._decode_s3_tagset(tags))
+
         @staticmethod
         def _cut_off_tag_prefix_for_dss_tags(tags_dict):
             return {
                 k[len(DssChecksums.TAG_PREFIX):]: v for k, v in tags_dict.items() if k in DssChecksums.CHECKSUM_TAGS
             }
 
+        @staticmethod
+        def encode_tagging_header(checksums) -> str:
+            # { 'sha1':'b', 'crc32c':'d'} -> 'hca-dss-sha1=b&hca-dss-crc32c=d', as PutObject's Tagging parameter
+            return urllib.parse.urlencode({f"{DssChecksums.TAG_PREFIX}{csum_name}": csum
+                                           for csum_name, csum in checksums.items()})
+
         @staticmethod
         def _encode_s3_tagset(tags: dict) -> list:
             # { 'a':'b', 'c':'d'} -> [ { 'Key':'a', 'Value':'b'}, {'Key':'c', 'Value':'d'} ]
@@ -167,15 +205,33 @@ class DssChecksums(collections.abc.MutableMapping):
             return reduce(lambda x, y: dict(x, **y), simplified_dicts)
 
     class ChecksumComputer:
+        """
+        Computes checksums by fetching the object's S3 parts with concurrent ranged GETs.
+
+        Each worker computes crc32c and MD5 (for s3_etag) of its own part, which are combined once all parts are
+        done.  sha1 and sha256 cannot be combined, so the workers also hand their data, in blocks, to this thread
+        which feeds it to those hashers in order.  Each part has a small bounded queue, which bounds memory use.
+
+        Given a ChecksumCheckpoint, progress is saved at the first part boundary after every CHECKPOINT_INTERVAL
+        seconds, and at the last part boundary reached when the deadline passes.  Checksumming starts from the part
+        after the last checkpoint.  Objects of a single part have no boundary to checkpoint at, so don't use one.
+        """
+
+        PART_DOWNLOAD_CONCURRENCY = 8
+        BLOCK_SIZE = 4 * 1024 * 1024
+        BLOCKS_QUEUED_PER_PART = 4
+        PART_DOWNLOAD_ATTEMPTS = 3
+        MAX_BUFFERED_BYTES = PART_DOWNLOAD_CONCURRENCY * (BLOCKS_QUEUED_PER_PART + 1) * BLOCK_SIZE
+        CHECKPOINT_INTERVAL = 300
 
         def __init__(self, s3obj):
             self._s3obj = s3obj
-            self._s3client = boto3.client('s3')
+            self._s3client = _client_of(s3obj)
             self.bytes_checksummed = 0
             self.start_time = None
             self.last_diag_output_time = None
 
-        def compute(self, report_progress=False):
+        def compute(self, report_progress=False, deadline=None, checkpoint=None):
             if report_progress:
                 self.bytes_checksummed = 0
                 self.start_time = time.time()
@@ -184,20 +240,133 @@ class DssChecksums(collections.abc.MutableMapping):
             else:
                 progress_callback = None
 
-            return self._compute_checksums(progress_callback=progress_callback)
-
-        def _compute_checksums(self, progress_callback=None):
-            multipart_chunksize = get_s3_multipart_chunk_size(self._s3obj.content_length)
-            with ChecksummingSink(multipart_chunksize) as sink:
-                self._s3client.download_fileobj(self._s3obj.bucket_name,
-                                                self._s3obj.key, sink,
-                                                Callback=progress_callback,
-                                                Config=self._transfer_config())
-                checksums = sink.get_checksums()
-                if len(DssChecksums.CHECKSUM_NAMES) != len(checksums):
-                    error = f"checksums {checksums} for {self._s3obj.key} do not meet requirements"
-                    raise UploadException(status=500, title=error, detail=str(checksums))
-                return checksums
+            return self._compute_checksums(progress_callback=progress_callback, deadline=deadline,
+                                           checkpoint=checkpoint)
+
+        def _compute_checksums(self, progress_callback=None, deadline=None, checkpoint=None):
+            size = self._s3obj.content_length
+            part_size = get_s3_multipart_chunk_size(size)
+            parts = [(start, min(start + part_size, size)) for start in range(0, size, part_size)]
+            if len(parts) < 2:
+                checkpoint = None
+            part_checksums, hashers = self._starting_point(checkpoint, part_size)
+            parts_done_at_start = len(part_checksums)
+            # The hashers as they were at the end of the last part, to checkpoint from when the deadline passes.
+            part_boundary_hashers = self._copy_of(hashers) if checkpoint else None
+            remaining_parts = parts[len(part_checksums):]
+            part_queues = [queue.Queue(maxsize=self.BLOCKS_QUEUED_PER_PART) for _ in remaining_parts]
+            aborted = threading.Event()
+            last_checkpoint_time = time.time()
+            with ThreadPoolExecutor(max_workers=self.PART_DOWNLOAD_CONCURRENCY) as executor:
+                futures = [executor.submit(self._checksum_part, start, end, part_size, part_queue, aborted)
+                           for (start, end), part_queue in zip(remaining_parts, part_queues)]
+                try:
+                    for future, part_queue in zip(futures, part_queues):
+                        for block in iter(part_queue.get, None):
+                            if isinstance(block, Exception):
+                                raise block
+                            for hasher in hashers.values():
+                                hasher.update(block)
+                            if progress_callback:
+                                progress_callback(len(block))
+                            if deadline and time.time() > deadline:
+                                if checkpoint and len(part_checksums) > parts_done_at_start:
+                                    checkpoint.save(part_size, part_checksums, part_boundary_hashers)
+                                raise ChecksumDeadlineExceeded(f"checksumming {self._s3obj.key} ran out of time")
+                        part_checksums.append(future.result())
+                        if checkpoint:
+                            part_boundary_hashers = self._copy_of(hashers)
+                        if checkpoint and time.time() - last_checkpoint_time > self.CHECKPOINT_INTERVAL:
+                            checkpoint.save(part_size, part_checksums, hashers)
+                            last_checkpoint_time = time.time()
+                except Exception:
+                    aborted.set()
+                    for future in futures:
+                        future.cancel()
+                    raise
+
+            checksums = {
+                'sha1': hashers['sha1'].hexdigest(),
+                'sha256': hashers['sha256'].hexdigest(),
+                'crc32c': format(self._combine_crc32cs(part_checksums, parts), '08x'),
+                's3_etag': self._combine_etags(part_checksums)
+            }
+            if len(DssChecksums.CHECKSUM_NAMES) != len(checksums):
+                error = f"checksums {checksums} for {self._s3obj.key} do not meet requirements"
+                raise UploadException(status=500, title=error, detail=str(checksums))
+            if checkpoint:
+                checkpoint.delete()
+            return checksums
+
+        @staticmethod
+        def _copy_of(hashers):
+            return {name: hasher.copy() for name, hasher in hashers.items()}
+
+        @staticmethod
+        def _starting_point(checkpoint, part_size):
+            """ :return: (part_checksums, hashers) to start from """
+            if checkpoint:
+                return checkpoint.load(part_size) or ([], checkpoint.new_hashers())
+            return [], {'sha1': hashlib.sha1(), 'sha256': hashlib.sha256()}
+
+        def _checksum_part(self, start, end, part_size, part_queue, aborted):
+            """ Returns the part's checksums, while passing its data to part_queue in order, then a None. """
+            try:
+                with ChecksummingSink(part_size, hash_functions=('crc32c', 's3_etag')) as sink:
+                    offset = start
+                    attempts = 0
+                    while offset < end:
+                        if attempts == self.PART_DOWNLOAD_ATTEMPTS:
+                            raise UploadException(status=500, title="Failed to download part",
+                                                  detail=f"part {start}-{end} of {self._s3obj.key} stopped at {offset}")
+                        attempts += 1
+                        try:
+                            body = self._s3client.get_object(Bucket=self._s3obj.bucket_name,
+                                                             Key=self._s3obj.key,
+                                                             IfMatch=self._s3obj.e_tag,
+                                                             Range=f"bytes={offset}-{end - 1}")['Body']
+                            for block in iter(lambda: body.read(self.BLOCK_SIZE), b''):
+                                sink.write(block)
+                                offset += len(block)
+                                self._put_block(part_queue, block, aborted)
+                        except (BotoCoreError, ProtocolError) as e:
+                            # Resume this part from where we got to.
+                            logger.warning(f"retrying part {start}-{end} of {self._s3obj.key} at {offset}: {e}")
+                    self._put_block(part_queue, None, aborted)
+                    part_checksums = sink.get_checksums()
+                return {'crc32c': int(part_checksums['crc32c'], 16),
+                        'md5': bytes.fromhex(part_checksums['s3_etag'])}
+            except Exception as e:
+                if not aborted.is_set():
+                    self._put_block(part_queue, e, aborted)
+                raise
+
+        @staticmethod
+        def _put_block(part_queue, block, aborted):
+            while not aborted.is_set():
+                try:
+                    part_queue.put(block, timeout=1)
+                    return
+                except queue.Full:
+                    pass
+            raise RuntimeError("checksumming aborted")
+
+        @staticmethod
+        def _combine_crc32cs(part_checksums, parts):
+            crc = 0
+            for part_checksum, (start, end) in zip(part_checksums, parts):
+                crc = crc32c_combine(crc, part_checksum['crc32c'], end - start)
+            return crc
+
+        @staticmethod
+        def _combine_etags(part_checksums):
+            if len(part_checksums) == 0:
+                return hashlib.md5().hexdigest()
+            elif len(part_checksums) == 1:
+                return part_checksums[0]['md5'].hex()
+            else:
+                digests = b"".join(part_checksum['md5'] for part_checksum in part_checksums)
+                return f"{hashlib.md5(digests).hexdigest()}-{len(part_checksums)}"
 
         def _compute_checksums_progress_callback(self, bytes_transferred):
             self.bytes_checksummed += bytes_transferred
@@ -205,8 +374,3 @@ class DssChecksums(collections.abc.MutableMapping):
                 logger.info("elapsed=%0.1f bytes_checksummed=%d" %
                             (time.time() - self.start_time, self.bytes_checksummed))
                 self.last_diag_output_time = time.time()
-
-        def _transfer_config(self) -> TransferConfig:
-            multipart_chunksize = get_s3_multipart_chunk_size(self._s3obj.content_length)
-            return TransferConfig(multipart_threshold=MULTIPART_THRESHOLD,
-                                  multipart_chunksize=multipart_chunksize)
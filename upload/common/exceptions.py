@@ -4,3 +4,8 @@ class UploadException(Exception):
         self.status = status
         self.title = title
         self.detail = detail
+
+
+class ChecksumDeadlineExceeded(Exception):
+    """ Raised when checksumming is given a deadline that it cannot meet. """
+    pass
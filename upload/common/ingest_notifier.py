@@ -3,8 +3,11 @@ import os
 import uuid
 import time
 import base64
+import threading
+from functools import lru_cache
 
 import requests
+from dcplib.aws.sqs_handler import SQSHandler
 from jwt import encode
 from tenacity import retry, stop_after_attempt, wait_fixed
 
@@ -15,16 +18,46 @@ from .upload_config import UploadConfig, UploadOutgoingIngestAuthConfig
 
 logger = get_logger(__name__)
 
+# Shared by all notifiers in this process, so that notifications re-use connections to Ingest.
+http_session = requests.Session()
+
+
+@lru_cache(maxsize=1)
+def _upload_config():
+    return UploadConfig()
+
+
+@lru_cache(maxsize=1)
+def _outgoing_ingest_auth_config():
+    return UploadOutgoingIngestAuthConfig()
+
+
+@lru_cache(maxsize=4)
+def _decode_service_acct_creds(encoded_creds):
+    return json.loads(base64.b64decode(encoded_creds).decode())
+
 
 class IngestNotifier:
 
     INGEST_ENDPOINTS = {"file_uploaded": "messaging/fileUploadInfo",
                         "file_validated": "messaging/fileValidationResult"}
 
+    # Keep the notification daemon's retries of a hung request within its Lambda's timeout.
+    CONNECT_TIMEOUT = 3.05
+    READ_TIMEOUT = 10
+
+    JWT_LIFETIME = 3600
+    JWT_REFRESH_MARGIN = 300  # seconds before expiry at which we sign a new JWT
+
+    # Signed JWTs are shared by all notifiers in this process, keyed by issuer and audience.
+    _jwt_cache = {}
+    _jwt_cache_lock = threading.Lock()
+
     def __init__(self, notification_type, file_id):
-        self.upload_config = UploadConfig()
+        self.upload_config = _upload_config()
+        self.notification_type = notification_type
         self.file_id = file_id
-        self.outgoing_ingest_auth_config = UploadOutgoingIngestAuthConfig()
+        self.outgoing_ingest_auth_config = _outgoing_ingest_auth_config()
         self.ingest_notification_url = f"https://{self.ingest_api_host}/{self.INGEST_ENDPOINTS[notification_type]}"
         self.db = UploadDB()
 
@@ -39,32 +72,32 @@ class IngestNotifier:
     @property
     def gcp_service_acct_creds(self):
         encoded_creds = self.outgoing_ingest_auth_config.gcp_service_acct_creds
-        return json.loads(base64.b64decode(encoded_creds).decode())
+        return _decode_service_acct_creds(encoded_creds)
 
     def format_and_send_notification(self, payload):
+        """
+        Record the notification in the database and queue it for delivery by the notification daemon.
+        Delivery (and retrying) happens asynchronously, so this does not wait for Ingest.
+        """
         self._validate_payload(payload)
         notification_id = str(uuid.uuid4())
-        self._create_or_update_db_notification(notification_id, "DELIVERING", payload)
-        notification_successful = False
-        attempts = 0
-        while not notification_successful and attempts < 15:
-            attempts += 1
-            if self._send_notification(notification_id, payload):
-                self._create_or_update_db_notification(notification_id, "DELIVERED", payload)
-                notification_successful = True
-            else:
-                time.sleep(2)
-        if not notification_successful:
-            self._create_or_update_db_notification(notification_id, "FAILED", payload)
+        self.db.create_pg_record("notification", self._format_notification_props(notification_id, "DELIVERING",
+                                                                                 payload))
+        self.queue_for_delivery(notification_id)
         return notification_id
 
-    def _send_notification(self, notification_id, payload):
+    def queue_for_delivery(self, notification_id):
+        message = {'notification_id': notification_id, 'notification_type': self.notification_type}
+        SQSHandler(queue_url=self.upload_config.notification_q_url).add_message_to_queue(message)
+
+    def send_notification(self, notification_id, payload):
         try:
             logger.info(f"attempting notification_id:{notification_id}, payload:{payload}, \
                           url:{self.ingest_notification_url}")
             jwt_token = self.get_service_jwt()
             headers = {'Authorization': f"Bearer {jwt_token}"}
-            response = requests.post(self.ingest_notification_url, headers=headers, json=payload)
+            response = http_session.post(self.ingest_notification_url, headers=headers, json=payload,
+                                         timeout=(self.CONNECT_TIMEOUT, self.READ_TIMEOUT))
             if not response.status_code == requests.codes.ok:
                 logger.info(f"failed to send notification_id:{notification_id}, payload:{payload}, \
                               response:{str(response.json())}, url:{self.ingest_notification_url}")
@@ -78,37 +111,43 @@ class IngestNotifier:
             return None
 
     def get_service_jwt(self):
+        """ Return a signed JWT, re-using the one we signed earlier unless it is close to expiry. """
+        creds = self.gcp_service_acct_creds
+        cache_key = (creds["client_email"], creds["private_key_id"], self.dcp_auth0_audience)
+        with self._jwt_cache_lock:
+            cached = self._jwt_cache.get(cache_key)
+            if cached and time.time() < cached['exp'] - self.JWT_REFRESH_MARGIN:
+                return cached['jwt']
+            iat = time.time()
+            exp = iat + self.JWT_LIFETIME
+            signed_jwt = self._sign_service_jwt(creds, iat, exp)
+            self._jwt_cache[cache_key] = {'jwt': signed_jwt, 'exp': exp}
+            return signed_jwt
+
+    def _sign_service_jwt(self, creds, iat, exp):
         # This function is taken directly from auth best practice docs in hca gitlab
         # https://allspark.dev.data.humancellatlas.org/dcp-ops/docs/wikis/Security/Authentication%20and%20Authorization/Setting%20up%20DCP%20Auth
-        iat = time.time()
-        exp = iat + 3600
-        payload = {'iss': self.gcp_service_acct_creds["client_email"],
-                   'sub': self.gcp_service_acct_creds["client_email"],
+        payload = {'iss': creds["client_email"],
+                   'sub': creds["client_email"],
                    'aud': self.dcp_auth0_audience,
                    'iat': iat,
                    'exp': exp,
-                   'https://auth.data.humancellatlas.org/email': self.gcp_service_acct_creds["client_email"],
+                   'https://auth.data.humancellatlas.org/email': creds["client_email"],
                    'https://auth.data.humancellatlas.org/group': 'hca',
                    'scope': ["openid", "email", "offline_access"]
                    }
-        additional_headers = {'kid': self.gcp_service_acct_creds["private_key_id"]}
-        signed_jwt = encode(payload, self.gcp_service_acct_creds["private_key"],
+        additional_headers = {'kid': creds["private_key_id"]}
+        signed_jwt = encode(payload, creds["private_key"],
                             headers=additional_headers, algorithm='RS256').decode()
         return signed_jwt
 
-    def _create_or_update_db_notification(self, notification_id, status, payload):
-        notification_props = self._format_notification_props(notification_id, status, payload)
-        if self.db.get_pg_record("notification", notification_id):
-            self.db.update_pg_record("notification", notification_props)
-        else:
-            self.db.create_pg_record("notification", notification_props)
-
     def _format_notification_props(self, notification_id, status, payload):
         notification_props = {
             "id": notification_id,
             "file_id": self.file_id,
             "payload": payload,
-            "status": status
+            "status": status,
+            "notification_type": self.notification_type
         }
         return notification_props
 
@@ -0,0 +1,90 @@
+"""
+SHA-1 and SHA-256 hashers whose state can be saved and restored, which hashlib's can't.
+
+They call libcrypto's SHA1_* and SHA256_* functions through ctypes.  Their contexts are plain structs of
+integers and buffered input, so a context's bytes are its state.  SHA_CTX and SHA256_CTX are public structs whose
+layout OpenSSL has kept the same across releases, so a state can be carried on by another libcrypto build (e.g.
+saved by a Lambda and resumed by a Batch job), as long as it runs on the same architecture.
+
+    h = ResumableHash('sha256')
+    h.update(b"first half")
+    state = h.state()
+    ...
+    h = ResumableHash('sha256', state=state)
+    h.update(b"second half")
+    h.hexdigest() == hashlib.sha256(b"first halfsecond half").hexdigest()
+"""
+
+import ctypes
+import ctypes.util
+
+_ALGORITHMS = {
+    # name: (function name prefix, context size, digest size)
+    'sha1': ('SHA1', 96, 20),
+    'sha256': ('SHA256', 112, 32),
+}
+
+
+def _load_libcrypto():
+    """
+    Fall back on the library hashlib itself is linked against, as find_library() finds nothing on some
+    systems (e.g. Alpine).  Symbol lookup on a library handle also searches the libraries it depends on.
+    """
+    try:
+        library_path = ctypes.util.find_library('crypto')
+        if library_path is None:
+            import _hashlib
+            library_path = _hashlib.__file__
+        libcrypto = ctypes.CDLL(library_path)
+        for prefix, _, _ in _ALGORITHMS.values():
+            for function_name in (f"{prefix}_Init", f"{prefix}_Update", f"{prefix}_Final"):
+                getattr(libcrypto, function_name).restype = ctypes.c_int
+        return libcrypto
+    except (ImportError, OSError, AttributeError):
+        return None
+
+
+_libcrypto = _load_libcrypto()
+
+
+class ResumableHash:
+
+    @staticmethod
+    def is_available():
+        return _libcrypto is not None
+
+    def __init__(self, name, state=None):
+        """
+        :param name: 'sha1' or 'sha256'
+        :param state: bytes returned by state() of a hasher of the same name, to carry on from
+        """
+        prefix, context_size, self.digest_size = _ALGORITHMS[name]
+        self.name = name
+        self._update = getattr(_libcrypto, f"{prefix}_Update")
+        self._final = getattr(_libcrypto, f"{prefix}_Final")
+        if state is None:
+            self._context = ctypes.create_string_buffer(context_size)
+            getattr(_libcrypto, f"{prefix}_Init")(self._context)
+        else:
+            if len(state) != context_size:
+                raise ValueError(f"{name} state must be {context_size} bytes, not {len(state)}")
+            self._context = ctypes.create_string_buffer(bytes(state), context_size)
+
+    def update(self, data):
+        self._update(self._context, data, ctypes.c_size_t(len(data)))
+
+    def state(self):
+        return self._context.raw
+
+    def copy(self):
+        return ResumableHash(self.name, state=self.state())
+
+    def digest(self):
+        # Finalize a copy, so that hashing may continue as with hashlib.
+        context = ctypes.create_string_buffer(self._context.raw, len(self._context))
+        digest = ctypes.create_string_buffer(self.digest_size)
+        self._final(digest, context)
+        return digest.raw
+
+    def hexdigest(self):
+        return self.digest().hex()
@@ -1,14 +1,18 @@
 import json
 import os
+import threading
 import time
 import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
+from botocore.exceptions import ClientError
 from dcplib.aws.sqs_handler import SQSHandler
 from dcplib.media_types import DcpMediaType
 
+from .checksum_cache import ChecksumCache
 from .checksum_event import ChecksumEvent
-from .client_side_checksum_handler import ClientSideChecksumHandler
 from .dss_checksums import DssChecksums
 from .exceptions import UploadException
 from .logging import get_logger
@@ -21,36 +25,112 @@ if not os.environ.get("CONTAINER"):
 LOGGER = get_logger(__name__)
 
 S3 = boto3.resource('s3')
-LAMBDA_CLIENT = boto3.client('lambda')
+
+
+class AreaRecordCache:
+    """
+    A small per-process LRU cache of upload_area records, so that heavily polled API endpoints don't
+    query the database every time.  Entries expire after TTL seconds, and are refreshed whenever this
+    process writes the record.  Areas that were not found are not cached.
+    """
+
+    MAX_SIZE = 1024
+    TTL = 10
+
+    def __init__(self):
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, area_uuid):
+        with self._lock:
+            entry = self._records.get(area_uuid)
+            if entry is None:
+                return None
+            expires_at, record = entry
+            if time.time() > expires_at:
+                del self._records[area_uuid]
+                return None
+            self._records.move_to_end(area_uuid)
+            return record
+
+    def put(self, area_uuid, record):
+        with self._lock:
+            self._records[area_uuid] = (time.time() + self.TTL, record)
+            self._records.move_to_end(area_uuid)
+            while len(self._records) > self.MAX_SIZE:
+                self._records.popitem(last=False)
+
+    def forget(self, area_uuid):
+        with self._lock:
+            self._records.pop(area_uuid, None)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+
+area_record_cache = AreaRecordCache()
 
 
 class UploadArea:
+    """
+    UploadArea objects are cheap to create: the database record, S3 bucket and SQS queues are only
+    loaded or connected to when first used.
+    """
 
     def __init__(self, uuid):
-        self.config = self._get_and_check_config()
-        self.db_id = None
+        self.config = UploadConfig()
         self.uuid = uuid
-        self.status = None
         self.key_prefix = f"{self.uuid}/"
         self.key_prefix_length = len(self.key_prefix)
-        self._bucket = S3.Bucket(self.bucket_name)
         self.db = UploadDB()
-        self._db_load()
-        self.checksum_queue = SQSHandler(queue_url=self.config.csum_upload_q_url)
-        self.deletion_queue = SQSHandler(queue_url=self.config.area_deletion_q_url)
+        self._db_id = None
+        self._status = None
+        self._db_loaded = False
+        self._bucket = None
+        self._checksum_queue = None
+        self._deletion_queue = None
 
     def __str__(self):
         return f"UploadArea(id={self.db_id}, uuid={self.uuid}, status={self.status})"
 
-    @staticmethod
-    def _get_and_check_config():
-        config = UploadConfig()
-        assert config.bucket_name is not None, "bucket_name is not in config"
-        assert config.csum_upload_q_url is not None, "csum_upload_q_url is not in config"
-        assert config.area_deletion_q_url is not None, "area_deletion_q_url is not in config"
-        assert config.area_deletion_lambda_name is not None, "area_deletion_lambda_name is not in config"
-        assert config.upload_submitter_role_arn is not None, "upload_submitter_role_arn is not in config"
-        return config
+    @property
+    def db_id(self):
+        self._ensure_db_loaded()
+        return self._db_id
+
+    @db_id.setter
+    def db_id(self, value):
+        self._ensure_db_loaded()
+        self._db_id = value
+
+    @property
+    def status(self):
+        self._ensure_db_loaded()
+        return self._status
+
+    @status.setter
+    def status(self, value):
+        self._ensure_db_loaded()
+        self._status = value
+
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            self._bucket = S3.Bucket(self.bucket_name)
+        return self._bucket
+
+    @property
+    def checksum_queue(self):
+        if self._checksum_queue is None:
+            self._checksum_queue = SQSHandler(queue_url=self.config.csum_upload_q_url)
+        return self._checksum_queue
+
+    @property
+    def deletion_queue(self):
+        if self._deletion_queue is None:
+            self._deletion_queue = SQSHandler(queue_url=self.config.area_deletion_q_url)
+        return self._deletion_queue
 
     @property
     def bucket_name(self):
@@ -68,7 +148,7 @@ class UploadArea:
 
     @property
     def uri(self):
-        return f"s3://{self._bucket.name}/{self.key_prefix}"
+        return f"s3://{self.bucket_name}/{self.key_prefix}"
 
     def update_or_create(self):
         self._db_load()
@@ -79,7 +159,6 @@ class UploadArea:
             self.db_id = self._db_create()
 
     def is_extant(self) -> bool:
-        self._db_load()
         return bool(self.db_id and self.status != 'DELETED')
 
     def credentials(self):
@@ -134,16 +213,40 @@ class UploadArea:
         creds = response['Credentials']
         return creds
 
-    def delete(self):
-        # This is currently invoked by scheduled deletions in sqs
+    def delete(self, start_after=None, get_remaining_time_in_millis=None):
+        """
+        This is currently invoked by scheduled deletions in sqs.
+        :param start_after: checkpoint from a previous invocation; keys up to and including it are already deleted
+        :param get_remaining_time_in_millis: the Lambda context's method of that name.  If given, deletion is
+                                             re-enqueued to continue in a new invocation before time runs out.
+        """
         self.status = "DELETING"
         self._db_update()
-        area_status = self._empty_upload_area()
+        area_status = self._empty_upload_area(start_after=start_after,
+                                              get_remaining_time_in_millis=get_remaining_time_in_millis)
         self.status = area_status
         self._db_update()
 
-    def ls(self):
-        return {'files': [file.info() for file in self._file_list()]}
+    def ls(self, page_size=None, start_after=None):
+        """
+        List a page of the files in this upload area.
+
+        Listing is driven by list_objects_v2 metadata, joined against one query of the file table.
+        Objects are only HEADed for a content type if they have no file record, and their tags are only
+        read if they have no checksums in the DB.
+
+        :param page_size: return at most this many files (default LS_PAGE_SIZE)
+        :param start_after: return files whose names sort after this name
+        :return: {'files': [...]}, plus a 'next_start_after' marker when more files remain
+        """
+        list_args = {'Bucket': self.bucket_name, 'Prefix': self.key_prefix, 'MaxKeys': page_size or self.LS_PAGE_SIZE}
+        if start_after:
+            list_args['StartAfter'] = f"{self.key_prefix}{start_after}"
+        page = S3.meta.client.list_objects_v2(**list_args)
+        files = self._file_info_for_listed_objects(page.get('Contents', []))
+        if page['IsTruncated']:
+            return {'files': files, 'next_start_after': files[-1]['name']}
+        return {'files': files}
 
     def lock(self):
         self.status = "LOCKED"
@@ -154,7 +257,7 @@ class UploadArea:
         self._db_update()
 
     def s3_object_for_file(self, filename):
-        return self._bucket.Object(self.key_prefix + filename)
+        return self.bucket.Object(self.key_prefix + filename)
 
     def store_file(self, filename, content, content_type):
         media_type = DcpMediaType.from_string(content_type)
@@ -163,36 +266,34 @@ class UploadArea:
                                   detail="Content-Type is missing parameter 'dcp-type',"
                                          " e.g. 'application/json; dcp-type=\"metadata/sample\"'.")
 
-        # Compute client-side checksums for the file being uploaded
-        checksum_handler = ClientSideChecksumHandler(data=content)
-        clientside_checksums = checksum_handler.get_checksum_metadata_tag()
+        # Compute all the checksums up front, in one pass over the body, so they can be tagged onto the object by
+        # the same PUT that stores it, rather than downloading it again afterwards to checksum it.
+        data = content.encode() if isinstance(content, str) else content
+        checksums = DssChecksums.compute_for_data(memoryview(data))
+        clientside_checksums = {name: checksums[name] for name in DssChecksums.CLIENTSIDE_CHECKSUM_NAMES}
         file = UploadedFile.create(upload_area=self, checksums=clientside_checksums, name=filename,
-                                   content_type=str(media_type), data=content)
+                                   content_type=str(media_type), data=data, dss_checksums=checksums)
         if file.recently_uploaded:
-            checksum_id = str(uuid.uuid4())
+            if file.checksums != checksums:
+                file.checksums = checksums
+            ChecksumCache.store(file, checksums)
             checksum_event = ChecksumEvent(file_id=file.db_id,
-                                           checksum_id=checksum_id,
-                                           status="CHECKSUMMING")
+                                           checksum_id=str(uuid.uuid4()),
+                                           status="CHECKSUMMED")
             checksum_event.create_record()
 
-            checksums = DssChecksums(s3_object=file.s3object)
-            checksums.compute(report_progress=True)
-            checksums.save_as_tags_on_s3_object()
-            file.checksums = dict(checksums)
-
-            checksum_event.status = "CHECKSUMMED"
-            checksum_event.update_record()
-
         return file
 
-    def add_to_delete_sqs(self):
+    def add_to_delete_sqs(self, start_after=None):
         """ Add itself to theupload area deletion queue to be deleted and sets the status based on the status of the
-        queue. """
+        queue.  start_after is the key deletion should resume after, if this is a continuation. """
         self.status = "DELETION_QUEUED"
         self._db_update()
         payload = {
             'area_uuid': f"{self.uuid}"
         }
+        if start_after:
+            payload['start_after'] = start_after
         self.deletion_queue.add_message_to_queue(payload)
         return self.status
 
@@ -218,87 +319,237 @@ class UploadArea:
         key = f"{self.key_prefix}{filename}"
         return UploadedFile.from_s3_key(self, key)
 
+    def uploaded_files(self, filenames):
+        keys = [f"{self.key_prefix}{filename}" for filename in filenames]
+        return UploadedFile.from_s3_keys(self, keys)
+
     def retrieve_file_checksum_statuses_for_upload_area(self):
+        file_count, checksum_counts, _ = self._retrieve_status_counts()
         checksum_status = {
-            'TOTAL_NUM_FILES': self.retrieve_file_count_for_upload_area(),
+            'TOTAL_NUM_FILES': file_count,
             'CHECKSUMMING': 0,
             'CHECKSUMMED': 0,
-            'CHECKSUMMING_UNSCHEDULED': 0
+            'CHECKSUMMING_UNSCHEDULED': 0,
+            **checksum_counts
         }
-        query_result = self.db.run_query_with_params(
-            "SELECT status, COUNT(DISTINCT checksum.file_id) "
-            "FROM checksum "
-            "INNER JOIN file ON checksum.file_id = file.id "
-            "WHERE file.upload_area_id = %s GROUP BY status;", (self.db_id,))
-        results = query_result.fetchall()
-        checksumming_file_count = 0
-        if results:
-            for status in results:
-                checksum_status[status[0]] = status[1]
-                checksumming_file_count += status[1]
+        checksumming_file_count = sum(checksum_counts.values())
         checksum_status['CHECKSUMMING_UNSCHEDULED'] = checksum_status['TOTAL_NUM_FILES'] - checksumming_file_count
         return checksum_status
 
     def retrieve_file_validation_statuses_for_upload_area(self):
-        query_result = self.db.run_query_with_params(
-            "SELECT status, COUNT(validation.id) "
-            "FROM validation "
-            "INNER JOIN validation_files ON validation.id = validation_files.validation_id  "
-            "INNER JOIN file ON validation_files.file_id = file.id "
-            "WHERE file.upload_area_id = %s GROUP BY status;", (self.db_id,))
-        results = query_result.fetchall()
-        validation_status_dict = {
+        _, _, validation_counts = self._retrieve_status_counts()
+        return {
             'VALIDATING': 0,
             'VALIDATED': 0,
-            'SCHEDULED': 0
+            'SCHEDULED': 0,
+            **validation_counts
         }
-        if results:
-            for status in results:
-                validation_status_dict[status[0]] = status[1]
-        return validation_status_dict
 
     def retrieve_file_count_for_upload_area(self):
-        query_result = self.db.run_query_with_params("SELECT COUNT(DISTINCT name) FROM file WHERE upload_area_id=%s",
-                                                     self.db_id)
-        results = query_result.fetchall()
-        return results[0][0]
-
-    def _file_list(self):
-        """ Returns a list UploadedFile objects representing files that exists in the current bucket."""
-        file_list = []
-        paginator = S3.meta.client.get_paginator('list_objects')
-        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=self.key_prefix):
-            if 'Contents' in page:
-                for o in page['Contents']:
-                    file = UploadedFile.from_s3_key(self, o['Key'])
-                    file_list.append(file)
-        return file_list
-
-    def _empty_upload_area(self):
-        LOGGER.info(f"starting deletion of area {self.uuid}")
-        lambda_timeout = self._retrieve_upload_area_deletion_lambda_timeout() - 30
-        deletion_start_time = time.time()
-        paginator = S3.meta.client.get_paginator('list_objects')
-        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=self.uuid):
-            if 'Contents' in page:
-                for o in page['Contents']:
-                    elapsed_time = time.time() - deletion_start_time
-                    if elapsed_time > lambda_timeout:
-                        self.add_to_delete_sqs()
+        file_count, _, _ = self._retrieve_status_counts()
+        return file_count
+
+    def _retrieve_status_counts(self):
+        """
+        Returns (file_count, checksum_counts, validation_counts) from the area_status_counts row that triggers
+        on the file, checksum, validation and validation_files tables keep up to date.
+        An area that has never had a file has no row.
+        """
+        query_result = self.db.run_query_with_params(
+            "SELECT file_count, checksum_counts, validation_counts FROM area_status_counts "
+            "WHERE upload_area_id = %s;", (self.db_id,))
+        row = query_result.fetchone()
+        if row is None:
+            return 0, {}, {}
+        return row[0], row[1], row[2]
+
+    LS_CONCURRENCY = 32
+    LS_PAGE_SIZE = 1000  # the most list_objects_v2 returns at once
+
+    def files_info(self, filenames):
+        """
+        Build file info for the named files, in the order given.  Checksums for all of them come from one
+        query on the file table, and the HEADs for their remaining metadata are made LS_CONCURRENCY at a time.
+        """
+        keys = [f"{self.key_prefix}{filename}" for filename in filenames]
+        if not keys:
+            return []
+        db_file_props = self._db_file_props_for_keys(keys)
+
+        def file_info(key):
+            try:
+                head = S3.meta.client.head_object(Bucket=self.bucket_name, Key=key)
+            except ClientError as e:
+                if e.response['Error']['Code'] == '404':
+                    raise UploadException(status=404, title="No such file",
+                                          detail="No such file in that upload area")
+                raise e
+            checksums, _ = db_file_props.get((key, head['ETag'].strip('"')), (None, None))
+            return self._file_info(key, head['ContentLength'], head['LastModified'], head['ContentType'], checksums)
+
+        with ThreadPoolExecutor(max_workers=min(self.LS_CONCURRENCY, len(keys))) as executor:
+            return list(executor.map(file_info, keys))
+
+    def _file_info_for_listed_objects(self, listed_objects):
+        """ Build file info for one page of list_objects_v2 results, without instantiating UploadedFiles. """
+        if not listed_objects:
+            return []
+        db_file_props = self._db_file_props_for_keys([o['Key'] for o in listed_objects])
+
+        def file_info(listed_object):
+            key = listed_object['Key']
+            checksums, content_type = db_file_props.get((key, listed_object['ETag'].strip('"')), (None, None))
+            if content_type is None:
+                # Listings do not include content types.
+                content_type = S3.meta.client.head_object(Bucket=self.bucket_name, Key=key)['ContentType']
+            return self._file_info(key, listed_object['Size'], listed_object['LastModified'], content_type,
+                                   checksums)
+
+        with ThreadPoolExecutor(max_workers=min(self.LS_CONCURRENCY, len(listed_objects))) as executor:
+            return list(executor.map(file_info, listed_objects))
+
+    def _file_info(self, key, size, last_modified, content_type, checksums):
+        if checksums is None:
+            # boto3 clients are thread-safe, but creating them (as Tagger does) is not.
+            tagging = S3.meta.client.get_object_tagging(Bucket=self.bucket_name, Key=key)
+            checksums = DssChecksums.Tagger.checksums_from_tagset(tagging.get('TagSet'))
+            if sorted(checksums.keys()) != sorted(DssChecksums.CHECKSUM_NAMES):
+                checksums = None
+        return {
+            'upload_area_id': self.uuid,
+            'name': key[self.key_prefix_length:],
+            'size': size,
+            'content_type': content_type,
+            'url': f"s3://{self.bucket_name}/{key}",
+            'checksums': checksums,
+            'last_modified': last_modified.isoformat()
+        }
+
+    def _db_file_props_for_keys(self, s3_keys):
+        """
+        Returns {(s3_key, s3_etag): (checksums, content_type)} for file records in this area with the given keys.
+        Either may be None.
+        """
+        query_result = self.db.run_query_with_params(
+            "SELECT s3_key, s3_etag, checksums, content_type FROM file "
+            "WHERE upload_area_id = %s AND s3_key = ANY(%s);", (self.db_id, s3_keys))
+        return {(row[0], row[1]): (row[2], row[3]) for row in query_result.fetchall()}
+
+    DELETE_BATCH_SIZE = 1000  # S3 DeleteObjects limit
+    DELETION_CONCURRENCY = 8
+    DELETION_TIME_MARGIN = 20  # seconds kept in reserve to re-enqueue
+    FILE_RECORD_DELETE_BATCH_SIZE = 1000
+
+    def _empty_upload_area(self, start_after=None, get_remaining_time_in_millis=None):
+        """
+        Delete the area's objects in DeleteObjects batches, up to DELETION_CONCURRENCY batches at a time.
+        After each round the last deleted key is our checkpoint.
+
+        Each round claims as many batches as the rate we have been deleting at says we can finish in the time
+        we have left.  When not even one batch would fit we re-enqueue ourselves with the checkpoint, so the
+        next invocation resumes listing from there.  The same goes for deleting the file records afterwards:
+        an invocation that resumes after the last key finds no more objects and carries on with the records.
+        """
+        LOGGER.info(f"starting deletion of area {self.uuid} after key {start_after}")
+        checkpoint = start_after
+        keys_deleted = 0
+        seconds_deleting = 0.0
+        list_args = {'Bucket': self.bucket_name, 'Prefix': self.key_prefix,
+                     'PaginationConfig': {'PageSize': self.DELETE_BATCH_SIZE}}
+        if start_after:
+            list_args['StartAfter'] = start_after
+        pages = iter(S3.meta.client.get_paginator('list_objects_v2').paginate(**list_args))
+        with ThreadPoolExecutor(max_workers=self.DELETION_CONCURRENCY) as executor:
+            while True:
+                batches_to_claim = self.DELETION_CONCURRENCY
+                if get_remaining_time_in_millis:
+                    seconds_left = get_remaining_time_in_millis() / 1000 - self.DELETION_TIME_MARGIN
+                    if seconds_deleting:
+                        keys_per_second = keys_deleted / seconds_deleting
+                        batches_to_claim = min(batches_to_claim,
+                                               int(seconds_left * keys_per_second / self.DELETE_BATCH_SIZE))
+                    elif seconds_left <= 0:
+                        batches_to_claim = 0
+                    if batches_to_claim < 1:
+                        self.add_to_delete_sqs(start_after=checkpoint)
                         return self.status
-                    S3.meta.client.delete_object(Bucket=self.bucket_name, Key=o['Key'])
+                round_start_time = time.time()
+                batches = []
+                for page in pages:
+                    if page.get('Contents'):
+                        batches.append([o['Key'] for o in page['Contents']])
+                    if len(batches) == batches_to_claim:
+                        break
+                if not batches:
+                    break
+                list(executor.map(self._delete_objects, batches))
+                seconds_deleting += time.time() - round_start_time
+                keys_deleted += sum(len(batch) for batch in batches)
+                checkpoint = batches[-1][-1]
+                LOGGER.info(f"deleted {sum(len(batch) for batch in batches)} objects up to {checkpoint}")
+        if not self._db_delete_file_records(get_remaining_time_in_millis):
+            self.add_to_delete_sqs(start_after=checkpoint)
+            return self.status
         LOGGER.info(f"completed deletion of area {self.uuid}")
         return "DELETED"
 
-    def _retrieve_upload_area_deletion_lambda_timeout(self):
-        response = LAMBDA_CLIENT.get_function(FunctionName=self.config.area_deletion_lambda_name)
-        return response['Configuration']['Timeout']
+    def _delete_objects(self, keys):
+        response = S3.meta.client.delete_objects(Bucket=self.bucket_name,
+                                                 Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True})
+        if response.get('Errors'):
+            raise UploadException(status=500, title="Failed to delete objects",
+                                  detail=f"{len(response['Errors'])} objects in {self.uuid} could not be deleted, "
+                                         f"e.g. {response['Errors'][0]}")
+
+    def _db_delete_file_records(self, get_remaining_time_in_millis=None):
+        """
+        Delete the area's validation records, then its file records, FILE_RECORD_DELETE_BATCH_SIZE at a time.
+        Deleting files cascades to their checksum, notification and validation_files records, whose triggers fire
+        for every row, so a large area cannot be deleted in one statement in the time we are left with.
+        :return: False if time ran out first, in which case the remaining records are still there
+        """
+        batch_queries = [
+            "DELETE FROM validation WHERE id IN ("
+            "SELECT DISTINCT validation_files.validation_id FROM validation_files "
+            "INNER JOIN file ON validation_files.file_id = file.id "
+            "WHERE file.upload_area_id = %s LIMIT %s);",
+            "DELETE FROM file WHERE id IN (SELECT id FROM file WHERE upload_area_id = %s LIMIT %s);"
+        ]
+        longest_batch_seconds = 0.0
+        for query in batch_queries:
+            records_deleted = self.FILE_RECORD_DELETE_BATCH_SIZE
+            while records_deleted == self.FILE_RECORD_DELETE_BATCH_SIZE:
+                if get_remaining_time_in_millis:
+                    seconds_left = get_remaining_time_in_millis() / 1000 - self.DELETION_TIME_MARGIN
+                    if seconds_left <= longest_batch_seconds:
+                        return False
+                batch_start_time = time.time()
+                records_deleted = self.db.run_query_with_params(
+                    query, (self.db_id, self.FILE_RECORD_DELETE_BATCH_SIZE)).rowcount
+                longest_batch_seconds = max(longest_batch_seconds, time.time() - batch_start_time)
+        return True
+
+    def _ensure_db_loaded(self):
+        if not self._db_loaded:
+            record = area_record_cache.get(self.uuid)
+            if record:
+                self._db_apply_record(record)
+            else:
+                self._db_load()
 
     def _db_load(self):
         data = self.db.get_pg_record('upload_area', self.uuid, column='uuid')
         if data:
-            self.db_id = data['id']
-            self.status = data['status']
+            self._db_apply_record(data)
+            area_record_cache.put(self.uuid, {'id': self._db_id, 'status': self._status})
+        else:
+            self._db_loaded = True
+            area_record_cache.forget(self.uuid)
+
+    def _db_apply_record(self, record):
+        self._db_id = record['id']
+        self._status = record['status']
+        self._db_loaded = True
 
     def _db_serialize(self):
         data = {
@@ -313,8 +564,10 @@ class UploadArea:
     def _db_create(self):
         prop_vals_dict = self._db_serialize()
         new_row_id = self.db.create_pg_record("upload_area", prop_vals_dict)
+        area_record_cache.put(self.uuid, {'id': new_row_id, 'status': self._status})
         return new_row_id
 
     def _db_update(self):
         prop_vals_dict = self._db_serialize()
         self.db.update_pg_record("upload_area", prop_vals_dict)
+        area_record_cache.put(self.uuid, {'id': self._db_id, 'status': self._status})
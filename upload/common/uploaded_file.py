@@ -1,8 +1,8 @@
+import base64
 import os
 
 import boto3
 from botocore.exceptions import ClientError
-from sqlalchemy.sql import and_
 from tenacity import retry, stop_after_attempt, wait_fixed
 
 from .dss_checksums import DssChecksums
@@ -21,8 +21,12 @@ class UploadedFile:
     """
 
     @classmethod
-    def create(cls, upload_area, checksums={}, name=None, content_type=None, data=None):
-        """ Check if the file exists already and if so, return it. """
+    def create(cls, upload_area, checksums={}, name=None, content_type=None, data=None, dss_checksums=None):
+        """
+        Check if the file exists already and if so, return it.
+        checksums are stored as object metadata.  If dss_checksums are given they are stored as tags by the same
+        PUT, and S3 verifies the data it receives against their s3_etag.
+        """
         obj_key = f"{upload_area.uuid}/{name}"
 
         found_file = None
@@ -39,8 +43,13 @@ class UploadedFile:
         if found_file:
             return UploadedFile.from_s3_key(upload_area, obj_key)
 
+        put_args = {}
+        if dss_checksums:
+            put_args['Tagging'] = DssChecksums.Tagger.encode_tagging_header(dss_checksums)
+            if '-' not in dss_checksums['s3_etag']:
+                put_args['ContentMD5'] = base64.b64encode(bytes.fromhex(dss_checksums['s3_etag'])).decode()
         s3_client.put_object(Body=data, ContentType=content_type, Bucket=upload_area.bucket_name, Key=obj_key,
-                             Metadata=checksums)
+                             Metadata=checksums, **put_args)
         s3_object = upload_area.s3_object_for_file(name)
         return cls(upload_area, s3object=s3_object, recently_uploaded=True)
 
@@ -49,6 +58,14 @@ class UploadedFile:
         s3object = s3.Bucket(upload_area.bucket_name).Object(s3_key)
         return cls(upload_area, s3object=s3object, recently_uploaded=False)
 
+    @classmethod
+    def from_s3_keys(cls, upload_area, s3_keys):
+        """ Like from_s3_key(), but finds or creates the DB records for all the files in one query. """
+        bucket = s3.Bucket(upload_area.bucket_name)
+        files = [cls(upload_area, s3object=bucket.Object(s3_key), defer_db_upsert=True) for s3_key in s3_keys]
+        cls._db_upsert(files)
+        return files
+
     @classmethod
     def from_db_id(cls, db_id):
         db = UploadDB()
@@ -59,11 +76,11 @@ class UploadedFile:
         s3object = upload_area.s3_object_for_file(file_props['name'])
         return cls(upload_area, s3object=s3object)
 
-    def __init__(self, upload_area, s3object, recently_uploaded=False):
+    def __init__(self, upload_area, s3object, recently_uploaded=False, defer_db_upsert=False):
         """
         The object of init() is to:
         - populate properties from the S3 object
-        - create a DB record for this file of one does not exist
+        - create a DB record for this file of one does not exist (unless defer_db_upsert, see from_s3_keys())
         - initialize a DssChecksums object
         """
         self.upload_area = upload_area
@@ -77,7 +94,8 @@ class UploadedFile:
             "upload_area_id": upload_area.db_id,
             "name": None,
             "size": None,
-            "checksums": None
+            "checksums": None,
+            "content_type": None
         }
 
         if recently_uploaded:
@@ -91,9 +109,8 @@ class UploadedFile:
         self._populate_properties_from_s3_object()
 
         self._db = UploadDB()
-        e_tag = self.s3object.e_tag.strip('\"')
-        if self._db_load(self.s3object.key, e_tag) is None:
-            self._db_create()
+        if not defer_db_upsert:
+            self._db_upsert([self])
 
     def __str__(self):
         return f"UploadedFile(id={self.db_id}, s3_key={self.s3_key}, etag={self.s3_etag})"
@@ -125,7 +142,7 @@ class UploadedFile:
     @checksums.setter
     def checksums(self, newval):
         self._properties['checksums'] = newval
-        self._db_update()
+        self._db.update_pg_record("file", {'id': self.db_id, 'checksums': newval})
 
     @property
     def s3url(self):
@@ -155,28 +172,49 @@ class UploadedFile:
         self.s3object.reload()
 
     def retrieve_latest_file_validation_status_and_results(self):
-        status = "UNSCHEDULED"
-        results = "N/A"
-        query_results = self._db.run_query_with_params(
-            "SELECT status, results->>'stdout' "
-            "FROM validation "
-            "INNER JOIN validation_files ON validation.id = validation_files.validation_id  "
-            "INNER JOIN file ON validation_files.file_id = file.id "
-            "WHERE file.id = %s;", (self.db_id,))
-        rows = query_results.fetchall()
-        if rows:
-            status = rows[0][0]
-            results = rows[0][1]
-        return status, results
+        return self.retrieve_latest_validation_statuses_and_results([self.db_id])[self.db_id]
 
     def retrieve_latest_file_checksum_status_and_values(self):
-        status = "UNSCHEDULED"
-        query_results = self._db.run_query_with_params("SELECT status FROM checksum \
-            WHERE file_id = %s ORDER BY created_at DESC LIMIT 1;", (self.db_id,))
-        rows = query_results.fetchall()
-        if rows:
-            status = rows[0][0]
-        return status, self.checksums
+        return self.retrieve_latest_checksum_statuses([self.db_id])[self.db_id], self.checksums
+
+    @staticmethod
+    def retrieve_latest_validation_statuses_and_results(file_ids):
+        """
+        Find the status and results of the latest validation of each of these files, with one query.
+        Each file's latest validation is found with a single probe of validation_files_file_id_created_at_index.
+
+        :return: dict of file_id: (status, results), where status is "UNSCHEDULED" for files never validated
+        """
+        query_results = UploadDB().run_query_with_params(
+            "SELECT requested.file_id, latest.status, latest.stdout "
+            "FROM unnest(%s::integer[]) AS requested(file_id) "
+            "LEFT JOIN LATERAL ("
+            "    SELECT validation.status, validation.results->>'stdout' AS stdout "
+            "    FROM validation_files "
+            "    INNER JOIN validation ON validation_files.validation_id = validation.id "
+            "    WHERE validation_files.file_id = requested.file_id "
+            "    ORDER BY validation_files.created_at DESC, validation_files.id DESC LIMIT 1"
+            ") AS latest ON true;", (list(file_ids),))
+        return {file_id: (status, results) if status else ("UNSCHEDULED", "N/A")
+                for file_id, status, results in query_results.fetchall()}
+
+    @staticmethod
+    def retrieve_latest_checksum_statuses(file_ids):
+        """
+        Find the status of the latest checksum of each of these files, with one query.
+        Each file's latest checksum is found with a single probe of checksum_file_id_created_at_index.
+
+        :return: dict of file_id: status, where status is "UNSCHEDULED" for files never checksummed
+        """
+        query_results = UploadDB().run_query_with_params(
+            "SELECT requested.file_id, latest.status "
+            "FROM unnest(%s::integer[]) AS requested(file_id) "
+            "LEFT JOIN LATERAL ("
+            "    SELECT checksum.status FROM checksum "
+            "    WHERE checksum.file_id = requested.file_id "
+            "    ORDER BY checksum.created_at DESC LIMIT 1"
+            ") AS latest ON true;", (list(file_ids),))
+        return {file_id: status or "UNSCHEDULED" for file_id, status in query_results.fetchall()}
 
     @retry(reraise=True, wait=wait_fixed(2), stop=stop_after_attempt(3))
     def _s3_load(self):
@@ -208,46 +246,43 @@ class UploadedFile:
             's3_etag': self.s3object.e_tag.strip('\"'),
             'name': self.s3object.key[self.upload_area.key_prefix_length:],  # cut off upload-area-id/
             'size': self.s3object.content_length,
-            'checksums': dict(checksums) if checksums.are_present() else None
+            'checksums': dict(checksums) if checksums.are_present() else None,
+            'content_type': self.s3object.content_type
         }
 
-    def _db_load(self, s3_key, s3_etag):
-        sql_table = self._db.table('file')
-        query = sql_table.select().where(and_(sql_table.columns['s3_key'] == s3_key,
-                                              sql_table.columns['s3_etag'] == s3_etag))
-        result = self._db.run_query(query)
-        rows = result.fetchall()
-        if not rows:
-            return None
-        if len(rows) > 1:
-            raise UploadException(status=500, title=">1 match for File query",
-                                  detail=f"{len(rows)} matched query for {s3_key} {s3_etag}")
-        else:
-            if self.s3object:
-                # Sanity checks:
-                assert rows[0][result.keys().index('name')] == os.path.basename(s3_key)  # Yes, !Windows :)
-                assert rows[0][result.keys().index('size')] == self.s3object.content_length
-            self._properties = {
-                **self._properties,
-                'id': rows[0][result.keys().index('id')],
-                's3_key': s3_key,
-                's3_etag': s3_etag,
-                'name': rows[0][result.keys().index('name')],
-                'size': rows[0][result.keys().index('size')],
-                'checksums': rows[0][result.keys().index('checksums')]
-            }
-            return True
+    @staticmethod
+    def _db_upsert(files):
+        """
+        Find or create the DB records for these files with one INSERT ... ON CONFLICT DO UPDATE ... RETURNING.
+        This is also safe when the same file is being registered concurrently, e.g. by simultaneous uploads.
+        If a record already exists its properties (e.g. checksums) take precedence over those read from S3, except
+        for content_type: copying an object onto itself can change that without changing its ETag.
+        """
+        if not files:
+            return
+        files_by_key = {(file.s3_key, file.s3_etag): file for file in files}
+        records = files[0]._db.find_or_create_pg_records("file",
+                                                         [file._db_serialize() for file in files_by_key.values()],
+                                                         unique_columns=['s3_key', 's3_etag'],
+                                                         refresh_columns=['content_type'])
+        records_by_key = {(record['s3_key'], record['s3_etag']): record for record in records}
+        for file in files:
+            file._db_apply_record(records_by_key[(file.s3_key, file.s3_etag)])
+
+    def _db_apply_record(self, record):
+        # Sanity checks:
+        assert record['name'] == self.name
+        assert record['size'] == self.s3object.content_length
+        self._properties = {
+            **self._properties,
+            'id': record['id'],
+            'name': record['name'],
+            'size': record['size'],
+            'checksums': record['checksums']
+        }
 
     def _db_serialize(self):
         prop_vals_dict = self._properties.copy()
         if prop_vals_dict['id'] is None:
             del prop_vals_dict['id']
         return prop_vals_dict
-
-    def _db_create(self):
-        prop_vals_dict = self._db_serialize()
-        self._properties['id'] = self._db.create_pg_record("file", prop_vals_dict)
-
-    def _db_update(self):
-        prop_vals_dict = self._db_serialize()
-        self._db.update_pg_record("file", prop_vals_dict)
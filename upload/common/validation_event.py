@@ -37,6 +37,7 @@ class ValidationEvent:
         self.results = None
         self.docker_image = kwargs.get("docker_image")
         self.original_validation_id = kwargs.get("original_validation_id")
+        self.cache_key = kwargs.get("cache_key")
         if not os.environ.get("CONTAINER"):
             self.db = UploadDB()
 
@@ -57,15 +58,16 @@ class ValidationEvent:
             vals_dict["docker_image"] = self.docker_image
         if self.original_validation_id:
             vals_dict["original_validation_id"] = self.original_validation_id
+        if self.cache_key:
+            vals_dict["cache_key"] = self.cache_key
 
         return vals_dict
 
     def create_record(self):
         prop_vals_dict = self._format_prop_vals_dict()
-        self.db.create_pg_record("validation", prop_vals_dict)
-        for file_id in self.file_ids:
-            validation_files_props = {'file_id': file_id, 'validation_id': self.id}
-            self.db.create_pg_record("validation_files", validation_files_props)
+        validation_files_props = [{'file_id': file_id, 'validation_id': self.id} for file_id in self.file_ids]
+        self.db.create_pg_records([("validation", [prop_vals_dict]),
+                                   ("validation_files", validation_files_props)])
 
     def update_record(self):
         prop_vals_dict = self._format_prop_vals_dict()
@@ -1,3 +1,4 @@
+import hashlib
 import json
 import os
 import re
@@ -9,13 +10,13 @@ from tenacity import retry, wait_fixed, stop_after_attempt
 
 from .uploaded_file import UploadedFile
 from .batch import JobDefinition
+from .database import UploadDB
 from .retry import retry_on_aws_too_many_requests
 from .validation_event import ValidationEvent
 from .upload_config import UploadConfig
 from .exceptions import UploadException
 from .logging import get_logger
 
-batch = boto3.client('batch')
 sqs = boto3.resource('sqs')
 # 1tb volume limit for staging files from s3 during validation process
 KB = 1000
@@ -23,6 +24,9 @@ MB = KB * KB
 GB = MB * KB
 TB = GB * KB
 MAX_FILE_SIZE_IN_BYTES = TB
+# Validations whose environment sets STAGING_MODE to this stream files to the validator instead,
+# so they don't use the staging volume (see ValidatorHarness.FIFO_STAGING_MODE).
+FIFO_STAGING_MODE = 'fifo'
 
 logger = get_logger(__name__)
 
@@ -56,12 +60,71 @@ class ValidationScheduler:
     def file_db_ids(self):
         return [file.db_id for file in self.files]
 
-    def check_files_can_be_validated(self):
+    def check_files_can_be_validated(self, env: dict = None):
+        if env and env.get('STAGING_MODE') == FIFO_STAGING_MODE:
+            return True
         files_size = 0
         for file in self.files:
             files_size += file.size
         return files_size < MAX_FILE_SIZE_IN_BYTES
 
+    def cache_key(self, validator_image: str, env: dict):
+        """
+        Validations with the same key run the same validator, with the same environment, on files with the same
+        contents (s3_etags) in the same order, so one's results can stand in for the other's.
+
+        Only images referenced by digest are cached, as a tag may be moved to a different image.
+        STAGING_MODE is left out of the environment, as it doesn't change what the validator sees.
+
+        :return: the key, or None if validations with this image can't be cached
+        """
+        if '@sha256:' not in validator_image:
+            return None
+        inputs = {
+            'image': validator_image,
+            'environment': {name: value for name, value in (env or {}).items() if name != 'STAGING_MODE'},
+            's3_etags': [file.s3_etag for file in self.files]
+        }
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf8')).hexdigest()
+
+    def find_cached_validation_results(self, validator_image: str, env: dict):
+        """
+        Find the results of a validation with our cache_key that ran to completion,
+        so they can be re-used instead of running the validator again.
+
+        :return: the cached results, or None
+        """
+        cache_key = self.cache_key(validator_image, env)
+        if cache_key is None:
+            return None
+        query_results = UploadDB().run_query_with_params(
+            "SELECT results FROM validation "
+            "WHERE cache_key = %s AND status = 'VALIDATED' AND results->>'status' = 'completed' "
+            "ORDER BY validation_ended_at DESC LIMIT 1;", (cache_key,))
+        row = query_results.fetchone()
+        return row[0] if row else None
+
+    def record_cached_validation(self, validator_image: str, cached_results: dict, filenames: list,
+                                 orig_val_id=None):
+        """
+        Record a validation of our files that is already VALIDATED, with results copied from cached_results.
+        :return: the new validation's id, and its results
+        """
+        validation_id = str(uuid.uuid4())
+        results = dict(cached_results,
+                       validation_id=orig_val_id or validation_id,
+                       upload_area_id=self.upload_area_uuid,
+                       names=filenames)
+        validation_event = ValidationEvent(file_ids=self.file_db_ids,
+                                           validation_id=validation_id,
+                                           status="VALIDATED",
+                                           docker_image=validator_image,
+                                           original_validation_id=orig_val_id)
+        validation_event.results = results
+        validation_event.create_record()
+        logger.info(f"re-used cached validation results for files {self.file_keys}")
+        return validation_id, results
+
     @retry(reraise=True, wait=wait_fixed(2), stop=stop_after_attempt(5))
     def add_to_validation_sqs(self, filenames: list, validator_image: str, env: dict, orig_val_id=None):
         validation_id = str(uuid.uuid4())
@@ -73,7 +136,8 @@ class ValidationScheduler:
             'environment': env,
             'orig_validation_id': orig_val_id
         }
-        self._create_validation_event(validator_image, validation_id, orig_val_id)
+        self._create_validation_event(validator_image, validation_id, orig_val_id,
+                                      cache_key=self.cache_key(validator_image, env))
         response = sqs.meta.client.send_message(QueueUrl=self.config.validation_q_url,
                                                 MessageBody=json.dumps(payload))
         status = response['ResponseMetadata']['HTTPStatusCode']
@@ -104,12 +168,14 @@ class ValidationScheduler:
         self._update_validation_event(docker_image, validation_id, orig_val_id)
         return validation_id
 
-    def _create_validation_event(self, validator_docker_image, validation_id, orig_val_id, status="SCHEDULING_QUEUED"):
+    def _create_validation_event(self, validator_docker_image, validation_id, orig_val_id, status="SCHEDULING_QUEUED",
+                                 cache_key=None):
         validation_event = ValidationEvent(file_ids=self.file_db_ids,
                                            validation_id=validation_id,
                                            status=status,
                                            docker_image=validator_docker_image,
-                                           original_validation_id=orig_val_id)
+                                           original_validation_id=orig_val_id,
+                                           cache_key=cache_key)
         validation_event.create_record()
         return validation_event
 
@@ -125,20 +191,16 @@ class ValidationScheduler:
 
     def _find_or_create_job_definition_for_image(self, validator_docker_image):
         job_defn = JobDefinition(docker_image=validator_docker_image, deployment=os.environ['DEPLOYMENT_STAGE'])
-        if job_defn.load():
-            return job_defn
-        else:
-            job_defn.create(job_role_arn=self.config.validation_job_role_arn)
-        return job_defn
+        return job_defn.find_or_create(job_role_arn=self.config.validation_job_role_arn)
 
     @retry_on_aws_too_many_requests
     def _enqueue_batch_job(self, job_defn, command, environment, validation_id):
         job_name = "-".join(["validation", os.environ['DEPLOYMENT_STAGE'], self.upload_area_uuid, validation_id])
         job_name = re.sub(self.JOB_NAME_ALLOWABLE_CHARS, "", job_name)[0:128]
-        job = batch.submit_job(
+        job = job_defn.submit_job(
+            self.config.validation_job_role_arn,
             jobName=job_name,
             jobQueue=self.config.validation_job_q_arn,
-            jobDefinition=job_defn.arn,
             containerOverrides={
                 'command': command,
                 'environment': [dict(name=k, value=v) for k, v in environment.items()]
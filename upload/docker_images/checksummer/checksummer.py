@@ -1,20 +1,29 @@
 #!/usr/bin/env python
 
 import argparse
+import json
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from urllib3.util import parse_url
 
 import boto3
+from botocore.config import Config
 
 from upload.common.logging import get_logger
 from upload.common.dss_checksums import DssChecksums
+from upload.common.checksum_checkpoint import ChecksumCheckpoint
 from upload.common.checksum_event import ChecksumEvent
 from upload.common.upload_api_client import update_event
 from upload.common.upload_config import UploadConfig
 
 logger = get_logger(f"CHECKSUMMER [{os.environ.get('AWS_BATCH_JOB_ID')}]")
 
+MANIFEST_CONCURRENCY = 4
+# One resource (and client) shared by all the files of a manifest, with connections for all their part downloads.
+S3 = boto3.resource('s3', config=Config(
+    max_pool_connections=MANIFEST_CONCURRENCY * DssChecksums.ChecksumComputer.PART_DOWNLOAD_CONCURRENCY))
+
 
 class Checksummer:
 
@@ -25,11 +34,10 @@ class Checksummer:
         self.file_name = None
         UploadConfig.use_env = True  # AWS Secrets are not available to batch jobs, use environment
         self._parse_args(argv)
-        s3 = boto3.resource('s3')
-        s3obj = s3.Bucket(self.bucket_name).Object(self.s3_object_key)
+        s3obj = S3.Bucket(self.bucket_name).Object(self.s3_object_key)
         self.checksums = DssChecksums(s3obj)
 
-        self.checksum_event = ChecksumEvent(checksum_id=os.environ['CHECKSUM_ID'],
+        self.checksum_event = ChecksumEvent(checksum_id=self.args.checksum_id,
                                             job_id=os.environ['AWS_BATCH_JOB_ID'])
 
         if self._object_contents_are_not_what_we_expect(s3obj):
@@ -43,7 +51,7 @@ class Checksummer:
         else:
             logger.info(f"Checksumming {self.s3_object_key}...")
             self._update_checksum_event(status="CHECKSUMMING")
-            self.checksums.compute(report_progress=True)
+            self.checksums.compute(report_progress=True, checkpoint=self._checkpoint(s3obj))
             self.checksums.save_as_tags_on_s3_object()
             self._update_checksum_event(status="CHECKSUMMED")
             logger.info(f"Checksums {dict(self.checksums)} used to tag file {self.s3_object_key}")
@@ -53,6 +61,8 @@ class Checksummer:
         parser.add_argument('s3_url', metavar="S3_URL", help="S3 URL of file to checksum")
         parser.add_argument('s3_etag', metavar="S3_ETAG", help="Expected Etag of file we are checksumming")
         parser.add_argument('-t', '--test', action='store_true', help="Test only, do not submit results to Upload API")
+        parser.add_argument('-c', '--checksum-id', default=os.environ.get('CHECKSUM_ID'),
+                            help="ID of the checksum event to report to (default: $CHECKSUM_ID)")
         self.args = parser.parse_args(args=argv)
         url_bits = parse_url(self.args.s3_url)
         if url_bits.scheme != 's3':
@@ -66,6 +76,14 @@ class Checksummer:
             url=self.args.s3_url, bucket=self.bucket_name, key=self.s3_object_key, area=self.upload_area_id,
             filename=self.file_name))
 
+    @staticmethod
+    def _checkpoint(s3obj):
+        """ Checkpoint progress, so that if this job dies a retry can carry on where it left off. """
+        if ChecksumCheckpoint.is_supported():
+            return ChecksumCheckpoint(s3obj)
+        logger.warning("Hash state cannot be saved here, checksumming without checkpoints")
+        return None
+
     def _object_contents_are_not_what_we_expect(self, s3obj):
         return s3obj.e_tag.strip('\"') != self.args.s3_etag
 
@@ -77,6 +95,46 @@ class Checksummer:
                                                'checksums': dict(self.checksums)})
 
 
+class ManifestChecksummer:
+    """
+    Checksum several files in one job, MANIFEST_CONCURRENCY at a time, reporting on each one's checksum event
+    as a single-file job would.  The manifest is a JSON list of {"s3_url", "s3_etag", "checksum_id"} objects.
+    When a job is retried, files it already checksummed are reported CHECKSUMMED again, which the API does not
+    pass on to Ingest a second time.
+    """
+
+    def __init__(self, argv):
+        parser = argparse.ArgumentParser()
+        parser.add_argument('--manifest', required=True, help="JSON list of files to checksum")
+        parser.add_argument('-t', '--test', action='store_true', help="Test only, do not submit results to Upload API")
+        self.args = parser.parse_args(args=argv)
+        self.manifest = json.loads(self.args.manifest)
+
+    def checksum_files(self):
+        """
+        :return: True if every file was checksummed (or aborted because it had been overwritten)
+        """
+        with ThreadPoolExecutor(max_workers=MANIFEST_CONCURRENCY) as executor:
+            outcomes = list(executor.map(self._checksum_file, self.manifest))
+        return all(outcomes)
+
+    def _checksum_file(self, entry):
+        argv = [entry['s3_url'], entry['s3_etag'], '--checksum-id', entry['checksum_id']]
+        if self.args.test:
+            argv.append('--test')
+        try:
+            Checksummer(argv)
+            return True
+        except Exception as e:
+            logger.exception(f"Checksumming {entry['s3_url']} failed: {e}")
+            return False
+
+
 if __name__ == '__main__':
     logger.info(f"STARTED with argv: {sys.argv}")
-    Checksummer(sys.argv[1:])
+    if '--manifest' in sys.argv:
+        # Exit non-zero if any file failed, so that Batch retries the job.  Files that were checksummed
+        # are tagged, so a retry only re-reads those that weren't.
+        sys.exit(0 if ManifestChecksummer(sys.argv[1:]).checksum_files() else 1)
+    else:
+        Checksummer(sys.argv[1:])
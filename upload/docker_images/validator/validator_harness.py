@@ -3,10 +3,13 @@ import os
 import pathlib
 import subprocess
 import sys
+import threading
 import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
+from boto3.s3.transfer import TransferConfig
 from tenacity import retry, stop_after_attempt, before_log, before_sleep_log, wait_exponential
 from urllib3.util import parse_url
 
@@ -21,12 +24,24 @@ logger = get_logger(f"CHECKSUMMER [{os.environ.get('AWS_BATCH_JOB_ID')}]")
 class ValidatorHarness:
     DEFAULT_STAGING_AREA = "/data"
     TIMEOUT = 3600  # kill job after 1 hour
+    STAGING_CONCURRENCY = 4  # files downloaded at once
+    TRANSFER_CONFIG = TransferConfig(multipart_threshold=64 * 1024 * 1024,
+                                     multipart_chunksize=64 * 1024 * 1024,
+                                     max_concurrency=10)
+    # Set STAGING_MODE=fifo in a validation's environment to stream files to the validator through named pipes,
+    # rather than downloading them to the staging volume first.  The validator must read each file sequentially.
+    FIFO_STAGING_MODE = 'fifo'
+    STREAMING_CHUNK_SIZE = 8 * 1024 * 1024
 
     def __init__(self, path_to_validator, s3_urls_of_files_to_be_validated, staging_folder=None):
         self.path_to_validator = path_to_validator
         self.s3_file_urls = s3_urls_of_files_to_be_validated
         self.staged_file_paths = []
         self.staging_folder = staging_folder or self.DEFAULT_STAGING_AREA
+        self.staging_mode = os.environ.get('STAGING_MODE')
+        self._streamers = []
+        self._streaming_errors = []
+        self._s3_client = boto3.client('s3')
         self.version = self._find_version()
         self.job_id = os.environ['AWS_BATCH_JOB_ID']
         self.validation_id = os.environ['VALIDATION_ID']
@@ -46,6 +61,8 @@ class ValidatorHarness:
             update_event(validation_event, {"upload_area_id": upload_area_id, "names": file_names})
 
         results = self._run_validator()
+        if self.staging_mode == self.FIFO_STAGING_MODE:
+            self._finish_streaming(results)
 
         results["upload_area_id"] = upload_area_id
         results["names"] = file_names
@@ -62,33 +79,125 @@ class ValidatorHarness:
            before=before_log(logger, logging.DEBUG),
            before_sleep=before_sleep_log(logger, logging.ERROR))
     def _stage_files_to_be_validated(self):
+        """
+        Download the files to be validated, STAGING_CONCURRENCY at a time.
+        Files staged by an earlier attempt, or an earlier try of this Batch job on the same staging volume, that
+        still match their S3 object are not downloaded again.  See _etag_file_path().
+        In FIFO staging mode files are not downloaded here, instead each is given a named pipe to be streamed into.
+        """
         upload_area_id = None
         file_names = []
+        objects_to_stage = []
         for s3_file_url in self.s3_file_urls:
             url_bits = parse_url(s3_file_url)
             s3_bucket_name = url_bits.netloc
             s3_object_key = urllib.parse.unquote(url_bits.path.lstrip('/'))
             key_parts = s3_object_key.split('/')
             upload_area_id = key_parts.pop(0)
-            file_name = "/".join(key_parts)
-            file_names.append(file_name)
-            staged_file_path = pathlib.Path(self.staging_folder, s3_object_key)
-            self._log("Staging s3://{bucket}/{key} at {file_path}".format(bucket=s3_bucket_name,
-                                                                          key=s3_object_key,
-                                                                          file_path=staged_file_path))
-            staged_file_path.parent.mkdir(parents=True, exist_ok=True)
-            self._download_file_from_bucket_to_filesystem(s3_bucket_name, s3_object_key, staged_file_path)
-            if not staged_file_path.is_file():
-                raise UploadException(status=500, title="Staged file path is not a file",
-                                      detail=f"Attempting to stage file path {staged_file_path} failed because it is "
-                                      f"not a file.")
-            self.staged_file_paths.append(staged_file_path)
+            file_names.append("/".join(key_parts))
+            objects_to_stage.append((s3_bucket_name, s3_object_key))
+        if self.staging_mode == self.FIFO_STAGING_MODE:
+            # A retry replaces the FIFOs of the try before it, so stop anything still streaming into those first.
+            self._release_streamers()
+            self._streaming_errors = []
+            self.staged_file_paths = [self._create_fifo(*obj) for obj in objects_to_stage]
+            return upload_area_id, file_names
+        with ThreadPoolExecutor(max_workers=self.STAGING_CONCURRENCY) as executor:
+            self.staged_file_paths = list(executor.map(lambda obj: self._stage_file(*obj), objects_to_stage))
         return upload_area_id, file_names
 
+    def _stage_file(self, s3_bucket_name, s3_object_key):
+        staged_file_path = pathlib.Path(self.staging_folder, s3_object_key)
+        head = self._s3_client.head_object(Bucket=s3_bucket_name, Key=s3_object_key)
+        etag, size = head['ETag'], head['ContentLength']
+        etag_file_path = self._etag_file_path(staged_file_path)
+        if etag_file_path.is_file() and etag_file_path.read_text() == etag and staged_file_path.is_file() \
+                and staged_file_path.stat().st_size == size:
+            self._log(f"Already staged s3://{s3_bucket_name}/{s3_object_key} at {staged_file_path}")
+            return staged_file_path
+        self._log("Staging s3://{bucket}/{key} at {file_path}".format(bucket=s3_bucket_name,
+                                                                      key=s3_object_key,
+                                                                      file_path=staged_file_path))
+        staged_file_path.parent.mkdir(parents=True, exist_ok=True)
+        if etag_file_path.exists():
+            etag_file_path.unlink()
+        start_time = time.time()
+        self._download_file_from_bucket_to_filesystem(s3_bucket_name, s3_object_key, staged_file_path)
+        if not staged_file_path.is_file():
+            raise UploadException(status=500, title="Staged file path is not a file",
+                                  detail=f"Attempting to stage file path {staged_file_path} failed because it is "
+                                  f"not a file.")
+        duration = max(time.time() - start_time, 0.001)
+        self._log(f"Staged {size} bytes of s3://{s3_bucket_name}/{s3_object_key} in {duration:.1f}s "
+                  f"({size / duration:.0f} bytes/s)")
+        etag_file_path.write_text(etag)
+        return staged_file_path
+
+    @staticmethod
+    def _etag_file_path(staged_file_path):
+        """
+        The ETag of the object a file was staged from is written next to it once it has been downloaded in full,
+        so that it survives the harness (e.g. when Batch retries the job).
+        """
+        return staged_file_path.with_name(f".{staged_file_path.name}.etag")
+
     def _download_file_from_bucket_to_filesystem(self, s3_bucket_name, s3_object_key, staged_file_path):
-        s3 = boto3.resource('s3')
-        bucket = s3.Bucket(s3_bucket_name)
-        bucket.download_file(s3_object_key, str(staged_file_path))
+        self._s3_client.download_file(s3_bucket_name, s3_object_key, str(staged_file_path),
+                                      Config=self.TRANSFER_CONFIG)
+
+    def _create_fifo(self, s3_bucket_name, s3_object_key):
+        fifo_path = pathlib.Path(self.staging_folder, s3_object_key)
+        self._log(f"Streaming s3://{s3_bucket_name}/{s3_object_key} through FIFO {fifo_path}")
+        fifo_path.parent.mkdir(parents=True, exist_ok=True)
+        if fifo_path.exists():
+            fifo_path.unlink()
+        os.mkfifo(str(fifo_path))
+        streamer = threading.Thread(target=self._stream_object_into_fifo,
+                                    args=(s3_bucket_name, s3_object_key, fifo_path),
+                                    daemon=True)
+        streamer.start()
+        self._streamers.append((streamer, fifo_path))
+        return fifo_path
+
+    def _stream_object_into_fifo(self, s3_bucket_name, s3_object_key, fifo_path):
+        bytes_streamed = 0
+        try:
+            # Opening a FIFO for writing blocks until the validator opens it for reading.
+            with open(str(fifo_path), 'wb') as fifo:
+                start_time = time.time()
+                body = self._s3_client.get_object(Bucket=s3_bucket_name, Key=s3_object_key)['Body']
+                for chunk in body.iter_chunks(self.STREAMING_CHUNK_SIZE):
+                    fifo.write(chunk)
+                    bytes_streamed += len(chunk)
+            duration = max(time.time() - start_time, 0.001)
+            self._log(f"Streamed {bytes_streamed} bytes of s3://{s3_bucket_name}/{s3_object_key} in {duration:.1f}s "
+                      f"({bytes_streamed / duration:.0f} bytes/s)")
+        except BrokenPipeError:
+            self._log(f"validator stopped reading {fifo_path} after {bytes_streamed} bytes")
+        except Exception as e:
+            self._log(f"streaming s3://{s3_bucket_name}/{s3_object_key} failed: {e}")
+            self._streaming_errors.append(f"streaming s3://{s3_bucket_name}/{s3_object_key} failed: {e}")
+
+    def _finish_streaming(self, results):
+        """
+        Wait for all streamers to finish, and abort the results if a file could not be streamed in full.
+        """
+        self._release_streamers()
+        if self._streaming_errors:
+            results['status'] = 'aborted'
+            results['exception'] = "; ".join(self._streaming_errors)
+
+    def _release_streamers(self):
+        """
+        Release streamers still waiting for a reader to open their FIFO, by opening and closing it ourselves,
+        then wait for them all to finish.  A streamer may not have reached its open() when we first release it,
+        so keep at it until it has gone.  This must happen before a FIFO is unlinked, or its streamer is stuck.
+        """
+        for streamer, fifo_path in self._streamers:
+            while streamer.is_alive():
+                os.close(os.open(str(fifo_path), os.O_RDONLY | os.O_NONBLOCK))
+                streamer.join(timeout=0.1)
+        self._streamers = []
 
     def _run_validator(self):
         command = [self.path_to_validator]
@@ -133,6 +242,9 @@ class ValidatorHarness:
         for staged_file_path in self.staged_file_paths:
             self._log("removing file {}".format(staged_file_path))
             staged_file_path.unlink()
+            etag_file_path = self._etag_file_path(staged_file_path)
+            if etag_file_path.exists():
+                etag_file_path.unlink()
 
     def _find_version(self):
         try:
@@ -1,8 +1,11 @@
 import requests
 
 from upload.common.database import UploadDB
+from upload.common.logging import get_logger
 from upload.lambdas.api_server import return_exceptions_as_http_errors
 
+logger = get_logger(__name__)
+
 
 @return_exceptions_as_http_errors
 def health():
@@ -12,5 +15,7 @@ def health():
     Running a simple query confirms that ecs pgbouncer is up running and talking to rds.
     """
     db_health_check_query = "SELECT count(*) from upload_area;"
-    UploadDB().run_query(db_health_check_query)
+    db = UploadDB()
+    db.run_query(db_health_check_query)
+    logger.info(f"DB connection pool: {db.pool_stats()}")
     return requests.codes.ok
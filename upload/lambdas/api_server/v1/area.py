@@ -7,6 +7,7 @@ from ....common.validation_scheduler import ValidationScheduler
 from ....common.upload_area import UploadArea
 from ....common.uploaded_file import UploadedFile
 from ....common.dss_checksums import DssChecksums
+from ....common.checksum_cache import ChecksumCache
 from ....common.checksum_event import ChecksumEvent
 from ....common.validation_event import ValidationEvent
 from ....common.exceptions import UploadException
@@ -30,6 +31,12 @@ def area_exists(upload_area_uuid: str):
     return None, requests.codes.ok
 
 
+@return_exceptions_as_http_errors
+def list_files(upload_area_uuid: str, page_size: int = None, start_after: str = None):
+    upload_area = _load_upload_area(upload_area_uuid)
+    return upload_area.ls(page_size=page_size, start_after=start_after), requests.codes.ok
+
+
 @return_exceptions_as_http_errors
 def credentials(upload_area_uuid: str):
     upload_area = _load_upload_area(upload_area_uuid)
@@ -71,9 +78,9 @@ def schedule_file_validation(upload_area_uuid: str, filename: str, json_request_
     orig_val_id = body.get('original_validation_id')
     image = body['validator_image']
     validation_scheduler = ValidationScheduler(upload_area_uuid, files)
-    if not validation_scheduler.check_files_can_be_validated():
+    if not validation_scheduler.check_files_can_be_validated(env):
         raise UploadException(status=requests.codes.bad_request, title="File too large for validation")
-    validation_id = validation_scheduler.add_to_validation_sqs([filename], image, env, orig_val_id)
+    validation_id = _schedule_validation(validation_scheduler, [filename], image, env, orig_val_id)
     return {'validation_id': validation_id}, requests.codes.ok
 
 
@@ -85,15 +92,12 @@ def schedule_validation(upload_area_uuid: str, json_request_body: str):
     orig_val_id = body.get('original_validation_id')
     image = body['validator_image']
     env = body['environment'] if 'environment' in body else {}
-    files = []
     file_names = body['files']
-    for file_name in file_names:
-        unquoted_file_name = urllib.parse.unquote(file_name)
-        files.append(upload_area.uploaded_file(unquoted_file_name))
+    files = upload_area.uploaded_files([urllib.parse.unquote(file_name) for file_name in file_names])
     validation_scheduler = ValidationScheduler(upload_area_uuid, files)
-    if not validation_scheduler.check_files_can_be_validated():
+    if not validation_scheduler.check_files_can_be_validated(env):
         raise UploadException(status=requests.codes.bad_request, title="File too large for validation")
-    validation_id = validation_scheduler.add_to_validation_sqs(file_names, image, env, orig_val_id)
+    validation_id = _schedule_validation(validation_scheduler, file_names, image, env, orig_val_id)
     return {'validation_id': validation_id}, requests.codes.ok
 
 
@@ -135,12 +139,15 @@ def update_checksum_event(upload_area_uuid: str, checksum_id: str, body: str):
     payload = body["payload"]
 
     checksum_event = ChecksumEvent.load(db_id=checksum_id)
+    # A retried Batch job reports files it has already checksummed as CHECKSUMMED again.
+    already_checksummed = checksum_event.status == "CHECKSUMMED"
     checksum_event.status = body['status']
     checksum_event.job_id = body['job_id']
 
-    if checksum_event.status == "CHECKSUMMED":
+    if checksum_event.status == "CHECKSUMMED" and not already_checksummed:
         uploaded_file = UploadedFile.from_db_id(checksum_event.file_id)
         uploaded_file.checksums = payload['checksums']
+        ChecksumCache.store(uploaded_file, payload['checksums'])
 
         """
         Do a last minute check to see if the S3 object for this file still has checksum
@@ -187,11 +194,7 @@ def file_info(upload_area_uuid: str, filename: str):
 def files_info(upload_area_uuid: str, body: str):
     filename_list = json.loads(body)
     upload_area = _load_upload_area(upload_area_uuid)
-    response_data = []
-    for filename in filename_list:
-        uploaded_file = upload_area.uploaded_file(filename)
-        response_data.append(uploaded_file.info())
-    return response_data, requests.codes.ok
+    return upload_area.files_info(filename_list), requests.codes.ok
 
 
 def _load_upload_area(upload_area_uuid: str):
@@ -201,6 +204,21 @@ def _load_upload_area(upload_area_uuid: str):
     return upload_area
 
 
+def _schedule_validation(validation_scheduler, file_names, image, env, orig_val_id):
+    """
+    Queue the files for validation, unless they have already been validated by this image,
+    in which case record and notify Ingest of a validation with the same results straight away.
+    """
+    cached_results = validation_scheduler.find_cached_validation_results(image, env)
+    if cached_results is None:
+        return validation_scheduler.add_to_validation_sqs(file_names, image, env, orig_val_id)
+    validation_id, results = validation_scheduler.record_cached_validation(image, cached_results, file_names,
+                                                                           orig_val_id)
+    for file_id in validation_scheduler.file_db_ids:
+        _notify_ingest(file_id, results, "file_validated")
+    return validation_id
+
+
 def _notify_ingest(file_id, payload, notification_type):
     status = IngestNotifier(notification_type, file_id).format_and_send_notification(payload)
     logger.info(f"Notified Ingest: payload={payload}, status={status}")
@@ -1,16 +1,22 @@
 import json
 import os
 import re
+import threading
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 from six.moves import urllib
 
 from ...common.batch import JobDefinition
+from ...common.checksum_cache import ChecksumCache
+from ...common.checksum_checkpoint import ChecksumCheckpoint
 from ...common.checksum_event import ChecksumEvent
 from ...common.database_orm import DBSessionMaker, DbChecksum
+from ...common.database import UploadDB
 from ...common.dss_checksums import DssChecksums
+from ...common.exceptions import ChecksumDeadlineExceeded
 from ...common.ingest_notifier import IngestNotifier
 from ...common.logging import get_logger
 from ...common.retry import retry_on_aws_too_many_requests
@@ -23,7 +29,7 @@ KB = 1024
 MB = KB * KB
 GB = MB * KB
 
-batch = boto3.client('batch')
+sqs = boto3.client('sqs')
 
 
 class ChecksumDaemon:
@@ -33,126 +39,307 @@ class ChecksumDaemon:
         'ObjectCreated:CompleteMultipartUpload',
         'ObjectCreated:Copy'
     )
+    # Files are checksummed inline if recent inline checksums say they will finish with INLINE_TIME_MARGIN seconds
+    # of the invocation to spare.  Until there are enough measurements we fall back on a size limit.
     USE_BATCH_IF_FILE_LARGER_THAN = 10 * GB
+    INLINE_TIME_MARGIN = 120
+    INLINE_HANDOFF_MARGIN = 30  # seconds left in which to hand a checksum that is running late over to Batch
+    THROUGHPUT_SAMPLE_MIN_FILE_SIZE = 64 * MB  # smaller files' throughput is dominated by latency
+    THROUGHPUT_SAMPLES = 100
+    THROUGHPUT_MIN_SAMPLES = 10
+    THROUGHPUT_PERCENTILE = 0.1
+    # Files to be checksummed in Batch are packed into jobs of up to this many bytes / files.
+    MAX_BYTES_PER_CHECKSUM_JOB = 200 * GB
+    MAX_FILES_PER_CHECKSUM_JOB = 16
+    # Messages are processed concurrently, but no more at once than there is memory for each to be checksumming
+    # a file inline, after leaving this much for everything else.
+    MEMORY_RESERVED_FOR_LAMBDA = 256 * MB
 
     def __init__(self, context):
+        self.context = context
         self.request_id = context.aws_request_id
         logger.debug(f"Ahm ahliiivvve! request_id={self.request_id}")
         self.config = UploadConfig()
         self.upload_service_version = UploadVersion().upload_service_version
         logger.debug("UPLOAD_SERVICE_VERSION: {}".format(self.upload_service_version))
         self._read_environment()
-        self.upload_area = None
-        self.uploaded_file = None
+        self._upload_areas = {}
+        self._upload_areas_lock = threading.Lock()
+        self._files_to_schedule = []  # (UploadedFile, SQS message ID) pairs
+        self._files_to_schedule_lock = threading.Lock()
+        self._job_defn = None
+        self._inline_throughput = None
+        self._inline_throughput_lock = threading.Lock()
 
     def _read_environment(self):
         self.deployment_stage = os.environ['DEPLOYMENT_STAGE']
         self.docker_image = os.environ['CSUM_DOCKER_IMAGE']
         self.api_host = os.environ["API_HOST"]
 
+    def consume_sqs_records(self, sqs_records):
+        """
+        Process a batch of SQS messages, each of which contains S3 events, concurrently.
+        Files that must be checksummed in Batch are then scheduled together, packed into as few jobs as we can.
+
+        :return: a partial batch response listing the messages that failed, which are all that Lambda returns to
+                 the queue (the event source mapping has ReportBatchItemFailures enabled)
+        """
+        with ThreadPoolExecutor(max_workers=self._max_workers(len(sqs_records))) as executor:
+            outcomes = list(executor.map(self._consume_sqs_record, sqs_records))
+        unscheduled_message_ids = self._schedule_checksumming()
+        failed = [record['messageId'] for record, success in zip(sqs_records, outcomes)
+                  if not success or record['messageId'] in unscheduled_message_ids]
+        if failed:
+            logger.warning(f"{len(failed)} of {len(sqs_records)} messages failed: {failed}")
+        return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed]}
+
+    def _max_workers(self, record_count):
+        memory = int(self.context.memory_limit_in_mb) * MB - self.MEMORY_RESERVED_FOR_LAMBDA
+        return max(1, min(record_count, memory // DssChecksums.ChecksumComputer.MAX_BUFFERED_BYTES))
+
+    def _consume_sqs_record(self, sqs_record):
+        try:
+            self._consume_events(json.loads(sqs_record['body']), message_id=sqs_record['messageId'])
+            return True
+        except Exception as e:
+            logger.exception(f"Failed to process message {sqs_record['messageId']}: {e}")
+            return False
+
     def consume_events(self, events):
+        self._consume_events(events)
+        if self._schedule_checksumming():
+            raise RuntimeError("Failed to schedule checksumming")
+
+    def _consume_events(self, events, message_id=None):
+        content_type_checks = events.get('content_type_checks', 0)
         for event in events['Records']:
-            if event['eventName'] in self.RECOGNIZED_S3_EVENTS:
-                self._consume_event(event)
+            if event['s3']['object']['key'].startswith(ChecksumCheckpoint.KEY_PREFIX):
+                logger.debug(f"Ignoring checksum checkpoint {event['s3']['object']['key']}")
+            elif event['eventName'] in self.RECOGNIZED_S3_EVENTS:
+                self._consume_event(event, content_type_checks, message_id)
             else:
                 logger.warning(f"Unexpected event: {event['eventName']}")
 
-    def _consume_event(self, event):
+    def _consume_event(self, event, content_type_checks=0, message_id=None):
         file_key = event['s3']['object']['key']
-        self._get_file_record(file_key)
+        uploaded_file = self._get_file_record(file_key)
+        if not uploaded_file.checksums:
+            self._use_cached_checksums(uploaded_file)
 
-        if self.uploaded_file.checksums:
-            checksums = DssChecksums(s3_object=self.uploaded_file.s3object, checksums=self.uploaded_file.checksums)
+        will_notify_ingest = uploaded_file.checksums or self._file_is_small_enough_to_checksum_inline(uploaded_file)
+        if will_notify_ingest and self._defer_if_content_type_is_incomplete(uploaded_file, event, content_type_checks):
+            return
+
+        if uploaded_file.checksums:
+            checksums = DssChecksums(s3_object=uploaded_file.s3object, checksums=uploaded_file.checksums)
             checksums.save_as_tags_on_s3_object()
-            self._notify_ingest()
+            self._notify_ingest(uploaded_file)
         else:
-            if self._file_is_small_enough_to_checksum_inline():
-                checksums = self._compute_checksums()
+            checksums = None
+            if self._file_is_small_enough_to_checksum_inline(uploaded_file):
+                checksums = self._compute_checksums(uploaded_file)
+            if checksums:
                 checksums.save_as_tags_on_s3_object()
-                self.uploaded_file.checksums = dict(checksums)  # saves to DB
-                self._notify_ingest()
+                uploaded_file.checksums = dict(checksums)  # saves to DB
+                ChecksumCache.store(uploaded_file, checksums)
+                self._notify_ingest(uploaded_file)
             else:
-                self._schedule_checksumming()
+                with self._files_to_schedule_lock:
+                    self._files_to_schedule.append((uploaded_file, message_id))
 
     def _get_file_record(self, file_key):
         logger.debug(f"file_key={file_key}")
         area_uuid = file_key.split('/')[0]
         filename = urllib.parse.unquote(file_key[len(area_uuid) + 1:])
-        self.upload_area = UploadArea(area_uuid)
-        logger.debug(self.upload_area)
-        self.uploaded_file = self.upload_area.uploaded_file(filename)
-        logger.debug(self.uploaded_file)
-        logger.debug(f"UploadedFile checksums={self.uploaded_file.checksums}")
-
-    def _file_is_small_enough_to_checksum_inline(self):
-        return self.uploaded_file.size <= self.USE_BATCH_IF_FILE_LARGER_THAN
-
-    def _notify_ingest(self):
-        self._check_content_type()
-        file_info = self.uploaded_file.info()
-        notifier = IngestNotifier('file_uploaded', file_id=self.uploaded_file.db_id)
+        upload_area = self._upload_area(area_uuid)
+        logger.debug(upload_area)
+        uploaded_file = upload_area.uploaded_file(filename)
+        logger.debug(uploaded_file)
+        logger.debug(f"UploadedFile checksums={uploaded_file.checksums}")
+        return uploaded_file
+
+    def _upload_area(self, area_uuid):
+        """ Files in the same batch often share an upload area, so load each area only once. """
+        with self._upload_areas_lock:
+            if area_uuid not in self._upload_areas:
+                self._upload_areas[area_uuid] = UploadArea(area_uuid)
+            return self._upload_areas[area_uuid]
+
+    def _use_cached_checksums(self, uploaded_file):
+        """ If we have checksummed this content before, give the file those checksums instead of computing them. """
+        cached_checksums = ChecksumCache.lookup(uploaded_file)
+        if not cached_checksums:
+            return
+        logger.info(f"Using cached checksums for {uploaded_file.s3_key}")
+        uploaded_file.checksums = cached_checksums  # saves to DB
+        ChecksumEvent(checksum_id=str(uuid.uuid4()),
+                      file_id=uploaded_file.db_id,
+                      status="CHECKSUMMED").create_record()
+
+    def _file_is_small_enough_to_checksum_inline(self, uploaded_file):
+        throughput = self._recent_inline_throughput()
+        if throughput is None:
+            return uploaded_file.size <= self.USE_BATCH_IF_FILE_LARGER_THAN
+        return uploaded_file.size / throughput <= self._seconds_left() - self.INLINE_TIME_MARGIN
+
+    def _seconds_left(self):
+        return self.context.get_remaining_time_in_millis() / 1000
+
+    def _recent_inline_throughput(self):
+        """
+        A pessimistic (THROUGHPUT_PERCENTILE) estimate of inline checksumming throughput in bytes/second,
+        from the most recent inline checksums of large enough files.  None if there are too few of those.
+        """
+        with self._inline_throughput_lock:
+            if self._inline_throughput is None:
+                query_result = UploadDB().run_query_with_params(
+                    "SELECT count(*), percentile_cont(%s) WITHIN GROUP (ORDER BY bytes_per_second) "
+                    "FROM (SELECT bytes_per_second FROM checksum WHERE bytes_per_second IS NOT NULL "
+                    "      ORDER BY created_at DESC LIMIT %s) AS recent;",
+                    (self.THROUGHPUT_PERCENTILE, self.THROUGHPUT_SAMPLES))
+                sample_count, throughput = query_result.fetchone()
+                self._inline_throughput = throughput if sample_count >= self.THROUGHPUT_MIN_SAMPLES else False
+            return self._inline_throughput or None
+
+    def _notify_ingest(self, uploaded_file):
+        file_info = uploaded_file.info()
+        notifier = IngestNotifier('file_uploaded', file_id=uploaded_file.db_id)
         status = notifier.format_and_send_notification(file_info)
         logger.info(f"Notified Ingest: file_info={file_info}, status={status}")
 
     CHECK_CONTENT_TYPE_INTERVAL = 6
     CHECK_CONTENT_TYPE_TIMES = 5
 
-    """
-    If the file's content_type doesn't have a 'dcp-type' suffix, refresh it a few times
-    to see if it acquires one.  Due to AWSCLI/S3 failing to correctly apply content_type,
-    we occasionally have to add it after the fact.  If it doesn't appear, proceed anyway.
-    """
-    def _check_content_type(self):
-        naps_left = self.CHECK_CONTENT_TYPE_TIMES
-        while naps_left > 0 and '; dcp-type=' not in self.uploaded_file.content_type:
-            logger.debug(f"No dcp-type in content_type of file {self.uploaded_file.s3_key},"
-                         f" checking {naps_left} more times")
-            time.sleep(self.CHECK_CONTENT_TYPE_INTERVAL)
-            naps_left -= 1
-            self.uploaded_file.refresh()
-        if '; dcp-type=' not in self.uploaded_file.content_type:
-            logger.warning(f"Still no dcp-type in content_type of file {self.uploaded_file.s3_key} after 30s")
-
-    def _compute_checksums(self):
+    def _defer_if_content_type_is_incomplete(self, uploaded_file, event, content_type_checks):
+        """
+        If the file's content_type doesn't have a 'dcp-type' suffix, put the event back on the queue, delayed,
+        to see if it acquires one.  Due to AWSCLI/S3 failing to correctly apply content_type, we occasionally
+        have to add it after the fact.  If it doesn't appear after a few checks, proceed anyway.
+        Returns True if the event was deferred.
+        """
+        if '; dcp-type=' in uploaded_file.content_type:
+            return False
+        if content_type_checks >= self.CHECK_CONTENT_TYPE_TIMES:
+            logger.warning(f"Still no dcp-type in content_type of file {uploaded_file.s3_key} "
+                           f"after {content_type_checks} checks")
+            return False
+        logger.debug(f"No dcp-type in content_type of file {uploaded_file.s3_key}, "
+                     f"checking again in {self.CHECK_CONTENT_TYPE_INTERVAL}s")
+        sqs.send_message(QueueUrl=self.config.csum_upload_q_url,
+                         MessageBody=json.dumps({'Records': [event], 'content_type_checks': content_type_checks + 1}),
+                         DelaySeconds=self.CHECK_CONTENT_TYPE_INTERVAL)
+        return True
+
+    def _compute_checksums(self, uploaded_file):
+        """
+        Returns the file's checksums, or None if it could not be checksummed with time to spare to hand it over
+        to Batch instead.  In that case progress is checkpointed, and the Batch job carries on from there.
+        """
         checksum_event = ChecksumEvent(checksum_id=str(uuid.uuid4()),
-                                       file_id=self.uploaded_file.db_id,
+                                       file_id=uploaded_file.db_id,
                                        status="CHECKSUMMING")
         checksum_event.create_record()
 
-        checksums = DssChecksums(s3_object=self.uploaded_file.s3object)
-        checksums.compute(report_progress=True)
+        checksums = DssChecksums(s3_object=uploaded_file.s3object)
+        start_time = time.time()
+        try:
+            checksums.compute(report_progress=True,
+                              deadline=start_time + self._seconds_left() - self.INLINE_HANDOFF_MARGIN,
+                              checkpoint=self._checkpoint(uploaded_file))
+        except ChecksumDeadlineExceeded as e:
+            logger.warning(f"{e}, handing {uploaded_file.s3_key} over to Batch")
+            checksum_event.status = "ABORTED"
+            checksum_event.update_record()
+            return None
 
+        if uploaded_file.size >= self.THROUGHPUT_SAMPLE_MIN_FILE_SIZE:
+            checksum_event.bytes_per_second = uploaded_file.size / max(time.time() - start_time, 0.001)
         checksum_event.status = "CHECKSUMMED"
         checksum_event.update_record()
 
         return checksums
 
+    @staticmethod
+    def _checkpoint(uploaded_file):
+        if ChecksumCheckpoint.is_supported():
+            return ChecksumCheckpoint(uploaded_file.s3object)
+        logger.warning("Hash state cannot be saved here, checksumming without checkpoints")
+        return None
+
     def _schedule_checksumming(self):
-        logger.debug("Scheduling checksumming batch job")
-        checksum_id = str(uuid.uuid4())
-        command = ['python', '/checksummer.py', self.uploaded_file.s3url, self.uploaded_file.s3_etag]
+        """
+        Schedule Batch jobs to checksum the files that have been set aside for it, packed into jobs by size.
+        :return: the IDs of the SQS messages whose files could not be scheduled
+        """
+        with self._files_to_schedule_lock:
+            files_to_schedule, self._files_to_schedule = self._files_to_schedule, []
+        files_by_id = {}
+        message_ids_by_file_id = {}
+        for uploaded_file, message_id in files_to_schedule:
+            files_by_id[uploaded_file.db_id] = uploaded_file
+            message_ids_by_file_id.setdefault(uploaded_file.db_id, set()).add(message_id)
+        unscheduled_message_ids = set()
+        for job_files in self._pack_checksum_jobs(files_by_id.values()):
+            try:
+                self._schedule_checksum_job(job_files)
+            except Exception as e:
+                logger.exception(f"Failed to schedule checksumming of {[file.s3_key for file in job_files]}: {e}")
+                for file in job_files:
+                    unscheduled_message_ids |= message_ids_by_file_id[file.db_id]
+        return unscheduled_message_ids
+
+    def _pack_checksum_jobs(self, uploaded_files):
+        """
+        Pack files into jobs of up to MAX_BYTES_PER_CHECKSUM_JOB and MAX_FILES_PER_CHECKSUM_JOB, largest first,
+        each into the first job it fits in.  Files larger than MAX_BYTES_PER_CHECKSUM_JOB get a job to themselves.
+        """
+        jobs = []
+        for uploaded_file in sorted(uploaded_files, key=lambda file: file.size, reverse=True):
+            for job in jobs:
+                if len(job) < self.MAX_FILES_PER_CHECKSUM_JOB and \
+                        sum(file.size for file in job) + uploaded_file.size <= self.MAX_BYTES_PER_CHECKSUM_JOB:
+                    job.append(uploaded_file)
+                    break
+            else:
+                jobs.append([uploaded_file])
+        return jobs
+
+    def _schedule_checksum_job(self, uploaded_files):
+        logger.debug(f"Scheduling checksumming batch job for {len(uploaded_files)} files")
+        checksum_ids = [str(uuid.uuid4()) for _ in uploaded_files]
         environment = {
             'API_HOST': self.api_host,
-            'CHECKSUM_ID': checksum_id,
             'CONTAINER': 'DOCKER'
         }
-        job_name = "-".join([
-            "csum", self.deployment_stage, self.uploaded_file.upload_area.uuid, self.uploaded_file.name])
+        if len(uploaded_files) == 1:
+            uploaded_file = uploaded_files[0]
+            command = ['python', '/checksummer.py', uploaded_file.s3url, uploaded_file.s3_etag]
+            environment['CHECKSUM_ID'] = checksum_ids[0]
+            job_name = "-".join([
+                "csum", self.deployment_stage, uploaded_file.upload_area.uuid, uploaded_file.name])
+        else:
+            manifest = [{'s3_url': file.s3url, 's3_etag': file.s3_etag, 'checksum_id': checksum_id}
+                        for file, checksum_id in zip(uploaded_files, checksum_ids)]
+            command = ['python', '/checksummer.py', '--manifest', json.dumps(manifest)]
+            job_name = "-".join(["csum", self.deployment_stage, f"{len(uploaded_files)}files", checksum_ids[0]])
         job_id = self._enqueue_batch_job(queue_arn=self.config.csum_job_q_arn,
                                          job_name=job_name,
                                          command=command,
                                          environment=environment)
 
-        checksum_event = ChecksumEvent(file_id=self.uploaded_file.db_id,
-                                       checksum_id=checksum_id,
-                                       job_id=job_id,
-                                       status="SCHEDULED")
-        checksum_event.create_record()
+        ChecksumEvent.create_records([ChecksumEvent(file_id=uploaded_file.db_id,
+                                                    checksum_id=checksum_id,
+                                                    job_id=job_id,
+                                                    status="SCHEDULED")
+                                      for uploaded_file, checksum_id in zip(uploaded_files, checksum_ids)])
 
     def _find_or_create_job_definition(self):
-        job_defn = JobDefinition(docker_image=self.docker_image, deployment=self.deployment_stage)
-        job_defn.find_or_create(self.config.csum_job_role_arn)
-        return job_defn
+        """ Jobs scheduled by this daemon all use the same job definition, so only look it up once. """
+        if not self._job_defn:
+            job_defn = JobDefinition(docker_image=self.docker_image, deployment=self.deployment_stage)
+            job_defn.find_or_create(self.config.csum_job_role_arn)
+            self._job_defn = job_defn
+        return self._job_defn
 
     JOB_NAME_ALLOWABLE_CHARS = '[^\w-]'
 
@@ -160,10 +347,10 @@ class ChecksumDaemon:
     def _enqueue_batch_job(self, queue_arn, job_name, command, environment):
         job_name = re.sub(self.JOB_NAME_ALLOWABLE_CHARS, "", job_name)[0:128]
         job_defn = self._find_or_create_job_definition()
-        job = batch.submit_job(
+        job = job_defn.submit_job(
+            self.config.csum_job_role_arn,
             jobName=job_name,
             jobQueue=queue_arn,
-            jobDefinition=job_defn.arn,
             containerOverrides={
                 'command': command,
                 'environment': [dict(name=k, value=v) for k, v in environment.items()]
@@ -6,6 +6,7 @@ import boto3
 import requests
 
 from upload.common.database import UploadDB
+from upload.common.ingest_notifier import IngestNotifier
 from upload.common.logging import get_logger
 from upload.common.upload_config import UploadConfig
 
@@ -15,6 +16,8 @@ client = boto3.client('cloudwatch')
 
 
 class HealthCheck:
+    RECONCILIATION_TIME_MARGIN = 30  # seconds of the Lambda's time left unused by reconciliation
+
     def __init__(self):
         self.env = os.environ['DEPLOYMENT_STAGE']
         self.db = UploadDB()
@@ -40,6 +43,23 @@ class HealthCheck:
         self.undeleted_areas_count_query = "SELECT COUNT(*) FROM upload_area " \
                                            "WHERE created_at > CURRENT_DATE - interval '4 weeks' " \
                                            "AND status != 'DELETED'"
+        # Counts only drift when they are being updated, so only recently updated ones (most recent first) need
+        # reconciling, and any that have gone negative.
+        self.areas_to_reconcile_query = "SELECT upload_area.id FROM upload_area " \
+                                        "INNER JOIN area_status_counts " \
+                                        "ON area_status_counts.upload_area_id = upload_area.id " \
+                                        "WHERE upload_area.status != 'DELETED' " \
+                                        "AND (area_status_counts.updated_at > CURRENT_TIMESTAMP - interval '2 days' " \
+                                        "OR area_status_counts.file_count < 0 " \
+                                        "OR EXISTS (SELECT 1 FROM jsonb_each_text(checksum_counts) " \
+                                        "WHERE value::integer < 0) " \
+                                        "OR EXISTS (SELECT 1 FROM jsonb_each_text(validation_counts) " \
+                                        "WHERE value::integer < 0)) " \
+                                        "ORDER BY area_status_counts.updated_at DESC"
+        self.stale_notifications_query = "SELECT id, file_id, notification_type FROM notification " \
+                                         "WHERE status='DELIVERING' " \
+                                         "AND notification_type IS NOT NULL " \
+                                         "AND updated_at < CURRENT_TIMESTAMP - interval '1 hour'"
         self.failed_checksum_count_query = "SELECT COUNT(*) FROM checksum " \
                                            "WHERE status='FAILED' " \
                                            "AND updated_at >= NOW() - '1 day'::INTERVAL"
@@ -182,6 +202,46 @@ class HealthCheck:
                                  f"{failed_validation_count} files failed batch validation in last day\n"
         return upload_area_status
 
+    def reconcile_area_status_counts(self, get_remaining_time_in_millis=None):
+        """
+        The status counts of each area are maintained by triggers, which concurrent updates to the same file
+        can occasionally throw off.  Recompute them for the undeleted areas whose counts were updated in the last
+        couple of days or look wrong, one area per transaction.
+        :param get_remaining_time_in_millis: the Lambda context's method of that name.  If given, stop
+                                             RECONCILIATION_TIME_MARGIN seconds before time runs out.
+        Returns the number of areas whose counts had drifted.
+        """
+        area_ids = [row[0] for row in self.db.run_query(self.areas_to_reconcile_query).fetchall()]
+        reconciled_area_count = 0
+        drifted_area_count = 0
+        for area_id in area_ids:
+            if get_remaining_time_in_millis and \
+                    get_remaining_time_in_millis() / 1000 < self.RECONCILIATION_TIME_MARGIN:
+                logger.warning(f"Ran out of time to reconcile the status counts of "
+                               f"{len(area_ids) - reconciled_area_count} areas")
+                break
+            if self.db.run_in_transaction(lambda connection: connection.execute(
+                    "SELECT reconcile_area_status_counts(%s);", (area_id,)).fetchone()[0]):
+                drifted_area_count += 1
+            reconciled_area_count += 1
+        logger.info(f"Reconciled status counts of {reconciled_area_count} areas, {drifted_area_count} had drifted")
+        return drifted_area_count
+
+    def requeue_stale_notifications(self):
+        """
+        A notification is recorded before its message is queued, so a failure in between, or a message that
+        ends up in the dead-letter queue, leaves it DELIVERING with nothing left to deliver it.  Queue those
+        that have been DELIVERING for over an hour for delivery again.  Returns the number re-queued.
+        """
+        rows = self.db.run_query(self.stale_notifications_query).fetchall()
+        for notification_id, file_id, notification_type in rows:
+            IngestNotifier(notification_type, file_id=file_id).queue_for_delivery(notification_id)
+        if rows:
+            self.db.run_query_with_params("UPDATE notification SET updated_at = %s WHERE id = ANY(%s)",
+                                          (datetime.utcnow(), [row[0] for row in rows]))
+        logger.info(f"Re-queued {len(rows)} stale notifications")
+        return len(rows)
+
     def post_message_to_url(self, url, message):
         body = json.dumps(message)
         headers = {'Content-Type': 'application/json'}
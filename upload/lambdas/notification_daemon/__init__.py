@@ -0,0 +1 @@
+from .notification_daemon import NotificationDaemon
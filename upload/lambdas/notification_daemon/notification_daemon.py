@@ -0,0 +1,88 @@
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+
+from ...common.database import UploadDB
+from ...common.ingest_notifier import IngestNotifier
+from ...common.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+@lru_cache(maxsize=None)
+def _notifier(notification_type):
+    """ One notifier per notification type, shared by every delivery this container makes """
+    return IngestNotifier(notification_type, file_id=None)
+
+
+class NotificationDaemon:
+    """
+    Deliver the notifications that IngestNotifier has recorded and queued.
+
+    Each SQS message names one DELIVERING notification record.  All the notifications in a batch of messages
+    are sent together, those that fail are retried with exponential backoff and jitter, then the records are
+    marked DELIVERED or FAILED in bulk.
+    """
+
+    DELIVERY_ATTEMPTS = 8
+    DELIVERY_CONCURRENCY = 10
+    BACKOFF_BASE = 1
+    BACKOFF_CAP = 60
+
+    def __init__(self, context):
+        self.request_id = context.aws_request_id
+        self.db = UploadDB()
+
+    def consume_sqs_records(self, sqs_records):
+        messages = [json.loads(record['body']) for record in sqs_records]
+        notification_types = {message['notification_id']: message['notification_type'] for message in messages}
+        notifications = self._pending_notifications(list(notification_types.keys()))
+        for notification in notifications:
+            notification['notification_type'] = notification_types[notification['id']]
+
+        delivered, failed = self.deliver(notifications)
+
+        self._set_status(delivered, "DELIVERED")
+        self._set_status(failed, "FAILED")
+        logger.info(f"Delivered {len(delivered)} notifications, failed to deliver {len(failed)}")
+
+    def deliver(self, notifications):
+        """
+        :param notifications: list of dicts with id, file_id, payload and notification_type
+        :return: (list of delivered notification IDs, list of undeliverable notification IDs)
+        """
+        delivered = []
+        pending = notifications
+        for attempt in range(self.DELIVERY_ATTEMPTS):
+            if attempt > 0:
+                self._backoff(attempt)
+            with ThreadPoolExecutor(max_workers=self.DELIVERY_CONCURRENCY) as executor:
+                outcomes = list(executor.map(self._send, pending))
+            delivered += [notification['id'] for notification, sent in zip(pending, outcomes) if sent]
+            pending = [notification for notification, sent in zip(pending, outcomes) if not sent]
+            if not pending:
+                break
+        return delivered, [notification['id'] for notification in pending]
+
+    def _backoff(self, attempt):
+        time.sleep(random.uniform(0, min(self.BACKOFF_CAP, self.BACKOFF_BASE * 2 ** attempt)))
+
+    @staticmethod
+    def _send(notification):
+        return _notifier(notification['notification_type']).send_notification(notification['id'],
+                                                                              notification['payload'])
+
+    def _pending_notifications(self, notification_ids):
+        """ Notifications already delivered by an earlier (redelivered) message are skipped """
+        query = "SELECT id, file_id, payload FROM notification WHERE id = ANY(%s) AND status = 'DELIVERING'"
+        results = self.db.run_query_with_params(query, (notification_ids,))
+        return [dict(id=row[0], file_id=row[1], payload=row[2]) for row in results.fetchall()]
+
+    def _set_status(self, notification_ids, status):
+        if not notification_ids:
+            return
+        query = "UPDATE notification SET status = %s, updated_at = %s WHERE id = ANY(%s)"
+        self.db.run_query_with_params(query, (status, datetime.utcnow(), notification_ids))